@@ -187,6 +187,16 @@ const API = {
         return this.get(`/messages/${chatId}?limit=${limit}&offset=${offset}`);
     },
 
+    // Получить сообщения старше указанного (курсорная пагинация)
+    async getMessagesBefore(chatId, beforeId, limit = 50) {
+        return this.get(`/messages/${chatId}?limit=${limit}&before_id=${beforeId}`);
+    },
+
+    // Получить сообщения вокруг указанного (переход к сообщению)
+    async getMessagesAround(chatId, messageId, limit = 50) {
+        return this.get(`/messages/${chatId}?limit=${limit}&around_id=${messageId}`);
+    },
+
     // Получить информацию о сообщении
     async getMessageInfo(messageId) {
         return this.get(`/messages/message/${messageId}`);
@@ -198,8 +208,15 @@ const API = {
     },
 
     // Поиск сообщений
-    async searchMessages(chatId, query, limit = 50, offset = 0) {
-        return this.get(`/messages/${chatId}/search?q=${encodeURIComponent(query)}&limit=${limit}&offset=${offset}`);
+    async searchMessages(chatId, query, limit = 50, cursor = null) {
+        const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+        return this.get(`/messages/${chatId}/search?q=${encodeURIComponent(query)}&limit=${limit}${cursorParam}`);
+    },
+
+    // Поиск сообщений во всех чатах пользователя
+    async searchAllMessages(query, limit = 50, cursor = null) {
+        const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+        return this.get(`/messages/search?q=${encodeURIComponent(query)}&limit=${limit}${cursorParam}`);
     },
 
     // Редактировать сообщение
@@ -303,6 +320,13 @@ const API = {
         return this.get(`/messages/${chatId}/${messageId}/reactions`);
     },
 
+    // Пользователи, поставившие реакцию (постранично, cursor - next_cursor из прошлого ответа)
+    async getReactionUsers(chatId, messageId, reaction, limit = 50, cursor = null) {
+        let url = `/messages/${chatId}/${messageId}/reactions/users?reaction=${encodeURIComponent(reaction)}&limit=${limit}`;
+        if (cursor) url += `&cursor=${cursor}`;
+        return this.get(url);
+    },
+
     // === PROFILE ENDPOINTS ===
 
     // Получить свой профиль
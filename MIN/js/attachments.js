@@ -1,20 +1,30 @@
 // Функции для работы с вложениями и реакциями
 
+// <source> для копий WebP / AVIF (хранятся, только если легче JPEG):
+// браузер сам выберет первый поддерживаемый формат
+function renderImageSources(variants, size) {
+    if (!variants) return '';
+    return ['avif', 'webp']
+        .filter(format => variants[`${size}.${format}`])
+        .map(format => `<source srcset="${variants[`${size}.${format}`]}" type="image/${format}">`)
+        .join('');
+}
+
 // Рендер вложения в зависимости от типа
 function renderAttachment(attachment, messageType) {
     if (!attachment) return '';
 
-    const { file_url, file_type, file_size, file_name } = attachment;
+    const { file_url, file_type, file_size, file_name, variants } = attachment;
 
     // Изображения
     if (messageType === 'image' || ['jpg', 'jpeg', 'png', 'gif', 'webp'].includes(file_type)) {
         return `
             <div class="message-attachment message-image">
-                <img src="${file_url}"
+                <picture style="display: contents">${renderImageSources(variants, 'thumb')}<img src="${variants?.thumb || file_url}"
                      alt="Изображение"
                      class="attachment-image"
                      data-url="${file_url}"
-                     title="Кликните для просмотра">
+                     title="Кликните для просмотра"></picture>
                 <div class="image-actions">
                     <button class="image-download-btn" title="Скачать" onclick="event.stopPropagation(); AttachmentUtils.downloadFile('${file_url}', '${file_name || 'image.jpg'}')">
                         <svg viewBox="0 0 24 24" fill="none" xmlns="http://www.w3.org/2000/svg">
@@ -95,7 +105,7 @@ function renderReactions(reactions, myReaction, messageId) {
             <button class="reaction-item ${isMy ? 'my-reaction' : ''}"
                     data-message-id="${messageId}"
                     data-reaction="${reaction.reaction}"
-                    title="${reaction.users.map(u => u.nickname).join(', ')}">
+                    title="${reaction.users ? reaction.users.map(u => u.nickname).join(', ') : ''}">
                 <span class="reaction-emoji">${reaction.reaction}</span>
                 <span class="reaction-count">${reaction.count}</span>
             </button>
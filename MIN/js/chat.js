@@ -19,7 +19,6 @@ document.addEventListener('DOMContentLoaded', async function() {
         currentUserPermissions: [],
         chats: [], // Список чатов для проверки space_id
         heartbeatInterval: null, // Интервал для heartbeat
-        statusUpdateInterval: null, // Интервал для обновления статусов
         // ОПТИМИЗАЦИЯ: Кеширование данных
         cache: {
             participants: null, // Кешированные участники текущего пространства
@@ -128,20 +127,31 @@ document.addEventListener('DOMContentLoaded', async function() {
     // Запуск heartbeat механизма
     function startHeartbeat() {
         // Отправляем heartbeat каждые 30 секунд для более быстрого обновления статусов
-        state.heartbeatInterval = setInterval(async () => {
-            try {
-                await API.heartbeat();
-                console.log('Heartbeat sent');
+        state.heartbeatInterval = setInterval(sendHeartbeat, 30 * 1000); // 30 секунд
 
-                // Обновляем счётчик уведомлений при каждом heartbeat
-                await updateNotificationBadge();
-            } catch (error) {
-                console.error('Heartbeat error:', error);
+        // Отправляем первый heartbeat сразу
+        sendHeartbeat();
+    }
+
+    // Один heartbeat: по сокету (статус + счётчик уведомлений одним ответом) или по HTTP, если сокет не подключён
+    async function sendHeartbeat() {
+        try {
+            if (state.wsClient && state.wsClient.connected) {
+                const reply = await state.wsClient.heartbeat();
+                renderNotificationBadge(reply.unread_count || 0);
+                return;
             }
-        }, 30 * 1000); // 30 секунд
+        } catch (error) {
+            console.error('Socket heartbeat error, falling back to HTTP:', error);
+        }
 
-        // Отправляем первый heartbeat сразу
-        API.heartbeat().catch(err => console.error('Initial heartbeat error:', err));
+        try {
+            await API.heartbeat();
+            // Обновляем счётчик уведомлений при каждом heartbeat
+            await updateNotificationBadge();
+        } catch (error) {
+            console.error('Heartbeat error:', error);
+        }
     }
 
     // Остановка heartbeat при выходе
@@ -150,33 +160,6 @@ document.addEventListener('DOMContentLoaded', async function() {
             clearInterval(state.heartbeatInterval);
             state.heartbeatInterval = null;
         }
-        if (state.statusUpdateInterval) {
-            clearInterval(state.statusUpdateInterval);
-            state.statusUpdateInterval = null;
-        }
-    }
-
-    // Периодическое обновление статусов участников
-    function startStatusUpdates(spaceId) {
-        // Очистить предыдущий интервал если есть
-        if (state.statusUpdateInterval) {
-            clearInterval(state.statusUpdateInterval);
-        }
-
-        // ОПТИМИЗАЦИЯ: Обновлять статусы реже (60 секунд) и только инвалидировать кеш
-        state.statusUpdateInterval = setInterval(async () => {
-            // Инвалидируем кеш чтобы следующий запрос получил свежие данные
-            invalidateCache();
-            
-            // Обновляем только если открыта правая панель с участниками
-            if (sidebarRight && sidebarRight.classList.contains('open')) {
-                try {
-                    await updateChatInfo();
-                } catch (error) {
-                    console.error('Failed to update participant statuses:', error);
-                }
-            }
-        }, 60 * 1000); // 60 секунд - реже обновляем
     }
 
     // Инициализация WebSocket
@@ -216,18 +199,19 @@ document.addEventListener('DOMContentLoaded', async function() {
                 state.messages.push(message);
                 updateMessagesInChat();
 
-                // Проверяем, есть ли упоминание текущего пользователя
-                const content = message.content.toLowerCase();
-                const currentNickname = state.currentUser.nickname.toLowerCase();
-                if (content.includes(`@${currentNickname}`) || content.includes('@all')) {
-                    // Обновляем счётчик уведомлений, так как возможно новое уведомление
-                    updateNotificationBadge();
-                }
+                // Счётчик уведомлений обновляется по событию new_notification
+            }
+        });
+
+        // Пропущенные за время разрыва события недоступны - перечитываем последние сообщения
+        state.wsClient.onResync((roomId) => {
+            if (roomId == state.currentChatId) {
+                loadMessages();
             }
         });
 
         // Обработчик редактирования сообщений
-        state.wsClient.socket.on('message_edited', (data) => {
+        state.wsClient.onRoomEvent('message_edited', (data) => {
             console.log('WS: Message edited', data);
 
             // Игнорируем свои собственные изменения (они уже применены локально)
@@ -273,7 +257,7 @@ document.addEventListener('DOMContentLoaded', async function() {
         });
 
         // Обработчик удаления сообщений
-        state.wsClient.socket.on('message_deleted', (data) => {
+        state.wsClient.onRoomEvent('message_deleted', (data) => {
             console.log('WS: Message deleted', data);
 
             // Игнорируем свои собственные удаления (они уже применены локально)
@@ -307,26 +291,34 @@ document.addEventListener('DOMContentLoaded', async function() {
         });
 
         // Обработчик обновления реакций
-        state.wsClient.socket.on('reaction_updated', (data) => {
+        state.wsClient.onRoomEvent('reaction_updated', (data) => {
             console.log('WS: Reaction updated', data);
 
+            // Свои реакции уже применены по ответу API
+            if (data.user_id == state.currentUser.id) {
+                return;
+            }
+
             if (data.room_id == state.currentChatId || data.chat_id == state.currentChatId) {
-                // Обновляем реакции в локальном стейте
+                // Подставляем новую сводку счётчиков (повторно доставленное событие её не меняет);
+                // изменения +1 / -1 - только для событий без сводки
                 const message = state.messages.find(m => m.id == data.message_id);
-                if (message) {
+                if (message && data.reactions) {
                     message.reactions = data.reactions;
-
-                    // Вычисляем my_reaction на основе reactions
-                    message.my_reaction = null;
-                    for (const reaction of data.reactions) {
-                        const userReacted = reaction.users.find(u => u.id === state.currentUser.id);
-                        if (userReacted) {
-                            message.my_reaction = reaction.reaction;
-                            break;
+                    console.log('Updated reactions in state:', message.reactions);
+                } else if (message) {
+                    const reactions = message.reactions || [];
+                    for (const change of data.deltas || []) {
+                        const item = reactions.find(r => r.reaction === change.reaction);
+                        if (item) {
+                            item.count += change.delta;
+                        } else if (change.delta > 0) {
+                            reactions.push({ reaction: change.reaction, count: change.delta });
                         }
                     }
+                    message.reactions = reactions.filter(r => r.count > 0);
 
-                    console.log('Updated reactions in state:', message.reactions, 'my_reaction:', message.my_reaction);
+                    console.log('Updated reactions in state:', message.reactions);
                 }
 
                 // Обновляем UI - перерисовываем весь чат
@@ -367,6 +359,13 @@ document.addEventListener('DOMContentLoaded', async function() {
             }
         });
 
+        // Новое уведомление (упоминание) - приходит в персональную комнату пользователя
+        state.wsClient.socket.on('new_notification', (data) => {
+            console.log('WS: New notification', data);
+            state.cache.notifications = null;
+            updateNotificationBadge();
+        });
+
         // Обработчик изменения статуса пользователя (real-time обновление)
         state.wsClient.socket.on('user_status_changed', (data) => {
             console.log('WS: User status changed', data);
@@ -644,7 +643,10 @@ document.addEventListener('DOMContentLoaded', async function() {
 
         state.isLoadingMessages = true;
         try {
-            const newMessages = await API.getMessages(state.currentChatId, limit, offset);
+            // Старые сообщения подгружаем по курсору (id самого раннего загруженного)
+            const newMessages = append && state.messages.length > 0
+                ? await API.getMessagesBefore(state.currentChatId, state.messages[0].id, limit)
+                : await API.getMessages(state.currentChatId, limit, offset);
             
             if (append) {
                 // Добавляем старые сообщения в начало
@@ -1182,9 +1184,12 @@ document.addEventListener('DOMContentLoaded', async function() {
         const avatarGradient = generateGradientFromId(msg.user_id);
 
         // Проверяем, есть ли реальный аватар
-        const avatarUrl = isOwn ? state.currentUser?.avatar_url : (msg.user_avatar_url || msg.user?.avatar_url);
+        // (маленькая копия 64px, если есть, в WebP / AVIF - если браузер их поддерживает)
+        const avatarVariants = isOwn ? state.currentUser?.avatar_variants : msg.user?.avatar_variants;
+        const avatarUrl = avatarVariants?.['64']
+            || (isOwn ? state.currentUser?.avatar_url : (msg.user_avatar_url || msg.user?.avatar_url));
         const avatarContent = avatarUrl
-            ? `<img src="${avatarUrl}" alt="${authorName}" style="width: 100%; height: 100%; object-fit: cover; border-radius: 50%;">`
+            ? `<picture style="display: contents">${renderImageSources(avatarVariants, '64')}<img src="${avatarUrl}" alt="${authorName}" style="width: 100%; height: 100%; object-fit: cover; border-radius: 50%;"></picture>`
             : avatarLetter;
         const avatarStyle = avatarUrl ? '' : `background: ${avatarGradient};`;
 
@@ -1333,9 +1338,11 @@ document.addEventListener('DOMContentLoaded', async function() {
         const avatarGradient = generateGradientFromId(lastMessage.user_id);
 
         // Проверяем, есть ли реальный аватар
-        const avatarUrl = isOwn ? state.currentUser?.avatar_url : lastMessage.user_avatar_url;
+        const avatarVariants = isOwn ? state.currentUser?.avatar_variants : lastMessage.user?.avatar_variants;
+        const avatarUrl = avatarVariants?.['64']
+            || (isOwn ? state.currentUser?.avatar_url : lastMessage.user_avatar_url);
         const avatarContent = avatarUrl
-            ? `<img src="${avatarUrl}" alt="${authorName}" style="width: 100%; height: 100%; object-fit: cover; border-radius: 50%;">`
+            ? `<picture style="display: contents">${renderImageSources(avatarVariants, '64')}<img src="${avatarUrl}" alt="${authorName}" style="width: 100%; height: 100%; object-fit: cover; border-radius: 50%;"></picture>`
             : avatarLetter;
         const avatarStyle = avatarUrl ? '' : `background: ${avatarGradient};`;
 
@@ -2282,19 +2289,10 @@ document.addEventListener('DOMContentLoaded', async function() {
                 </div>
             `;
 
-            // Запускаем автообновление статусов
-            startStatusUpdates(spaceId);
-
             await Modal.custom(content, '', () => {
                 // Инициализация контекстного меню после отрисовки
                 initParticipantContextMenu(spaceId, isAdmin);
             });
-
-            // Останавливаем автообновление после закрытия модального окна
-            if (state.statusUpdateInterval) {
-                clearInterval(state.statusUpdateInterval);
-                state.statusUpdateInterval = null;
-            }
         } catch (error) {
             await Modal.error('Ошибка: ' + error.message);
         }
@@ -3180,6 +3178,21 @@ document.addEventListener('DOMContentLoaded', async function() {
             });
         });
 
+        // Список поставивших реакцию подгружается при первом наведении
+        reactionItems.forEach(btn => {
+            btn.addEventListener('mouseenter', async () => {
+                if (btn.dataset.usersLoaded) return;
+                btn.dataset.usersLoaded = '1';
+                try {
+                    const result = await API.getReactionUsers(state.currentChatId, btn.dataset.messageId, btn.dataset.reaction, 20);
+                    const names = result.users.map(u => u.nickname).join(', ');
+                    btn.title = result.next_cursor ? `${names} и другие` : names;
+                } catch (error) {
+                    delete btn.dataset.usersLoaded;
+                }
+            });
+        });
+
         // Обработчики кликов по сообщениям для открытия picker реакций
         const messages = container.querySelectorAll('.message');
         messages.forEach(messageEl => {
@@ -3866,21 +3879,24 @@ document.addEventListener('DOMContentLoaded', async function() {
     async function updateNotificationBadge() {
         try {
             const result = await API.getUnreadNotificationsCount();
-            const count = result.unread_count || 0;
-
-            if (notificationBadge) {
-                if (count > 0) {
-                    notificationBadge.textContent = count > 99 ? '99+' : count;
-                    notificationBadge.style.display = 'block';
-                } else {
-                    notificationBadge.style.display = 'none';
-                }
-            }
+            renderNotificationBadge(result.unread_count || 0);
         } catch (error) {
             console.error('Failed to update notification badge:', error);
         }
     }
 
+    // Показать число непрочитанных уведомлений
+    function renderNotificationBadge(count) {
+        if (notificationBadge) {
+            if (count > 0) {
+                notificationBadge.textContent = count > 99 ? '99+' : count;
+                notificationBadge.style.display = 'block';
+            } else {
+                notificationBadge.style.display = 'none';
+            }
+        }
+    }
+
     // === НАСТРОЙКИ ПРИЛОЖЕНИЯ ===
 
     function loadPersonalizationSettings() {
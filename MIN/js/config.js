@@ -7,7 +7,12 @@ window.CONFIG = {
 
   FRONTEND_URL: window.location.origin,
   TOKEN_KEY: 'auth_token',
-  USER_KEY: 'current_user'
+  USER_KEY: 'current_user',
+
+  // транспорты Socket.IO: только WebSocket - сервер может работать несколькими процессами,
+  // а long-polling без sticky sessions попадает в процесс, который не знает сессию.
+  // 'polling' добавлять, только если сервер запущен одним процессом или за sticky-балансировщиком
+  SOCKET_TRANSPORTS: ['websocket']
 };
 
 const API_URL = window.location.hostname === 'localhost'
@@ -1,4 +1,8 @@
 // WebSocket клиент на Socket.IO
+
+// События комнаты с номером seq (сервер хранит их для досылки после переподключения)
+const SEQUENCED_EVENTS = ['new_message', 'message_edited', 'message_deleted', 'reaction_updated', 'user_kicked'];
+
 class WebSocketClient {
     constructor() {
         this.socket = null;
@@ -7,6 +11,31 @@ class WebSocketClient {
         this.onMessageCallback = null;
         this.onUserJoinedCallback = null;
         this.onUserLeftCallback = null;
+        this.onResyncCallback = null;
+        // Последний применённый номер события по комнатам (null - номер неизвестен, комната перечитывается)
+        this.roomSeq = {};
+        // Комнаты, для которых уже запрошена досылка (resume)
+        this.resumePending = {};
+        // Обработчики событий комнат с номером: вызываются только через dispatchRoomEvent
+        this.roomHandlers = {};
+        this.epoch = null;
+        this.userId = null;
+        this.nickname = null;
+        this.wasConnected = false;
+
+        this.onRoomEvent('new_message', (data) => {
+            console.log('New message received:', data);
+            if (this.onMessageCallback) {
+                this.onMessageCallback(data);
+            }
+        });
+
+        this.onRoomEvent('user_kicked', (data) => {
+            console.log('User kicked:', data);
+            if (this.onUserKickedCallback) {
+                this.onUserKickedCallback(data);
+            }
+        });
     }
 
     // Подключение к серверу
@@ -16,21 +45,60 @@ class WebSocketClient {
             return;
         }
 
-        // Подключаемся к Socket.IO серверу
+        this.userId = userId;
+        this.nickname = nickname;
+
+        // Подключаемся к Socket.IO серверу; JWT позволяет серверу вернуть комнаты после переподключения
         this.socket = io(CONFIG.API_BASE_URL, {
-            transports: ['websocket', 'polling'],
+            transports: CONFIG.SOCKET_TRANSPORTS || ['websocket'],
             query: {
                 user_id: userId,
                 nickname: nickname
-            }
+            },
+            auth: (cb) => cb({ token: typeof AuthService !== 'undefined' ? AuthService.getToken() : null })
         });
 
         // Обработчики событий
         this.socket.on('connect', () => {
             console.log('Socket.IO connected');
             this.connected = true;
+            // Ответы на прежние запросы resume потеряны вместе с соединением
+            this.resumePending = {};
+
+            // Переподключение: входим во все комнаты одним join_rooms (сервер мог уже вернуть их сам),
+            // пропущенные события дошлёт сервер (см. handleRoomJoined)
+            if (this.wasConnected) {
+                const rooms = new Set(Object.keys(this.roomSeq));
+                if (this.currentRoomId) rooms.add(String(this.currentRoomId));
+                if (rooms.size > 0) {
+                    this.socket.emit('join_rooms', { room_ids: [...rooms] });
+                }
+            }
+            this.wasConnected = true;
+        });
+
+        // События комнат с номером - только через диспетчер (дубли и пропуски, см. dispatchRoomEvent)
+        for (const event of SEQUENCED_EVENTS) {
+            this.socket.on(event, (data) => this.dispatchRoomEvent(event, data));
+        }
+
+        this.socket.on('joined_room', (data) => this.handleRoomJoined(data));
+
+        this.socket.on('rooms_joined', (data) => {
+            for (const room of data.rooms) {
+                this.handleRoomJoined(room);
+            }
+            for (const room of data.denied) {
+                console.warn('Cannot rejoin room', room.room_id, room.message);
+                delete this.roomSeq[String(room.room_id)];
+                delete this.resumePending[String(room.room_id)];
+            }
         });
 
+        this.socket.on('resume_events', (data) => this.applyMissedEvents(data.room_id, data.events));
+
+        this.socket.on('resync', (data) => this.applyResync(data.room_id, data.seq, data.epoch));
+
         this.socket.on('disconnect', () => {
             console.log('Socket.IO disconnected');
             this.connected = false;
@@ -40,13 +108,6 @@ class WebSocketClient {
             console.log('Server confirmed connection:', data);
         });
 
-        this.socket.on('new_message', (data) => {
-            console.log('New message received:', data);
-            if (this.onMessageCallback) {
-                this.onMessageCallback(data);
-            }
-        });
-
         this.socket.on('user_joined_room', (data) => {
             console.log('User joined room:', data);
             if (this.onUserJoinedCallback) {
@@ -61,15 +122,145 @@ class WebSocketClient {
             }
         });
 
-        this.socket.on('user_kicked', (data) => {
-            console.log('User kicked:', data);
-            if (this.onUserKickedCallback) {
-                this.onUserKickedCallback(data);
+        this.socket.on('error', (error) => {
+            console.error('Socket error:', error);
+        });
+    }
+
+    // Вход в комнату подтверждён: запоминаем seq или запрашиваем пропущенное
+    handleRoomJoined(data) {
+        const roomId = String(data.room_id);
+        if (this.epoch && this.epoch !== data.epoch) {
+            // Сервер перезапущен - номера прежних событий недействительны
+            this.resetEpoch(data.epoch);
+            this.roomSeq[roomId] = data.seq;
+        } else if (this.roomSeq[roomId] == null) {
+            this.roomSeq[roomId] = data.seq;
+            this.epoch = data.epoch;
+        } else {
+            // Мы уже были в комнате - запрашиваем пропущенное
+            this.requestResume(roomId);
+        }
+    }
+
+    // Событие комнаты с номером (живое или досланное): каждое seq применяется один раз и по порядку.
+    // Событие может прийти дважды - досылкой (resume / heartbeat) и по сокету: сервер кладёт его
+    // в журнал до того, как менеджер Socket.IO доставит его в комнату
+    dispatchRoomEvent(event, data) {
+        if (!data || data.seq === undefined) {
+            this.deliverRoomEvent(event, data);
+            return;
+        }
+        const roomId = String(data.room_id);
+        if (data.epoch && this.epoch && data.epoch !== this.epoch) {
+            // Сервер перезапущен: известные комнаты перечитываются целиком (вместе с этим событием)
+            const known = this.roomSeq[roomId] != null;
+            this.resetEpoch(data.epoch);
+            if (known) {
+                this.roomSeq[roomId] = data.seq;
+                return;
             }
+        }
+
+        const last = this.roomSeq[roomId];
+        if (last == null) {
+            // Точки отсчёта ещё нет (вход не подтверждён или комната перечитывается)
+            this.epoch = this.epoch || data.epoch;
+            this.roomSeq[roomId] = data.seq;
+            this.deliverRoomEvent(event, data);
+            return;
+        }
+        if (data.seq <= last) {
+            // Уже применено
+            return;
+        }
+        if (data.seq > last + 1) {
+            // Пропуск: не перескакиваем, а запрашиваем недостающее (придёт вместе с этим событием)
+            this.requestResume(roomId);
+            return;
+        }
+        this.roomSeq[roomId] = data.seq;
+        this.deliverRoomEvent(event, data);
+    }
+
+    // Вызвать обработчики события комнаты
+    deliverRoomEvent(event, data) {
+        for (const handler of this.roomHandlers[event] || []) {
+            handler(data);
+        }
+    }
+
+    // Запросить события комнаты после последнего применённого (один запрос до ответа)
+    requestResume(roomId) {
+        if (this.resumePending[roomId] || !this.socket) return;
+        this.resumePending[roomId] = true;
+        this.socket.emit('resume', {
+            room_id: roomId,
+            after_seq: this.roomSeq[roomId],
+            epoch: this.epoch
         });
+    }
 
-        this.socket.on('error', (error) => {
-            console.error('Socket error:', error);
+    // Новая эпоха сервера: номера всех комнат недействительны, их история перечитывается
+    resetEpoch(epoch) {
+        const rooms = Object.keys(this.roomSeq);
+        this.epoch = epoch;
+        this.resumePending = {};
+        for (const roomId of rooms) {
+            this.roomSeq[roomId] = null;
+            if (this.onResyncCallback) {
+                this.onResyncCallback(roomId);
+            }
+        }
+    }
+
+    // Применить пропущенные события комнаты (как если бы они пришли по сокету)
+    applyMissedEvents(roomId, events) {
+        roomId = String(roomId);
+        console.log(`Resume: ${events.length} missed events in room ${roomId}`);
+        delete this.resumePending[roomId];
+        for (const item of events) {
+            this.dispatchRoomEvent(item.event, item.data);
+        }
+    }
+
+    // Пропущенные события не сохранились - перечитать историю комнаты
+    applyResync(roomId, seq, epoch) {
+        roomId = String(roomId);
+        console.log('Resync required for room', roomId);
+        delete this.resumePending[roomId];
+        this.roomSeq[roomId] = seq;
+        this.epoch = epoch;
+        if (this.onResyncCallback) {
+            this.onResyncCallback(roomId);
+        }
+    }
+
+    // Heartbeat по сокету: обновляет статус и возвращает число непрочитанных уведомлений.
+    // Заодно досылаются события комнат, потерянные без разрыва соединения
+    heartbeat() {
+        return new Promise((resolve, reject) => {
+            if (!this.socket || !this.connected) {
+                reject(new Error('Socket not connected'));
+                return;
+            }
+            this.socket.timeout(10000).emit('heartbeat', {
+                epoch: this.epoch,
+                rooms: this.roomSeq
+            }, (err, reply) => {
+                if (err || !reply || reply.error) {
+                    reject(err || new Error(reply ? reply.error : 'Empty heartbeat reply'));
+                    return;
+                }
+                for (const room of reply.rooms || []) {
+                    if (room.resync) {
+                        this.applyResync(room.room_id, room.resync.seq, room.resync.epoch);
+                    } else {
+                        this.applyMissedEvents(room.room_id, room.events);
+                    }
+                }
+                resolve(reply);
+            });
         });
     }
 
@@ -105,6 +296,9 @@ class WebSocketClient {
         if (this.currentRoomId === roomId) {
             this.currentRoomId = null;
         }
+        // История комнаты будет загружена заново при следующем входе
+        delete this.roomSeq[String(roomId)];
+        delete this.resumePending[String(roomId)];
 
         console.log('Left room:', roomId);
     }
@@ -124,6 +318,15 @@ class WebSocketClient {
         });
     }
 
+    // Подписаться на событие комнаты с номером (message_edited, reaction_updated, ...);
+    // обработчик вызывается один раз на событие, в порядке seq
+    onRoomEvent(event, handler) {
+        if (!this.roomHandlers[event]) {
+            this.roomHandlers[event] = [];
+        }
+        this.roomHandlers[event].push(handler);
+    }
+
     // Установить обработчик новых сообщений
     onMessage(callback) {
         this.onMessageCallback = callback;
@@ -139,6 +342,11 @@ class WebSocketClient {
         this.onUserLeftCallback = callback;
     }
 
+    // Установить обработчик resync (пропущенные события не сохранились - перечитать историю)
+    onResync(callback) {
+        this.onResyncCallback = callback;
+    }
+
     // Установить обработчик кика пользователей
     onUserKicked(callback) {
         this.onUserKickedCallback = callback;
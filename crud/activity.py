@@ -3,6 +3,13 @@ from sqlalchemy import func
 from datetime import datetime, timedelta, timezone
 from models.base import UserActivity, User
 
+
+def _naive(dt: datetime) -> datetime:
+    """Привести время к локальному без timezone (как datetime.now())"""
+    if dt is not None and dt.tzinfo is not None:
+        return dt.astimezone().replace(tzinfo=None)
+    return dt
+
 class ActivityRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -82,11 +89,37 @@ class ActivityRepository:
     
     def get_user_status(self, user_id: int) -> dict:
         """Получить статус пользователя"""
+        from utils.activity_buffer import activity_buffer
+        from utils.presence_registry import presence_registry
+
+        # пользователь активен - статус считается в памяти, БД не нужна
+        live = presence_registry.status_of(user_id)
+        if live is not None:
+            status, last_seen = live
+            return {
+                "status": status,
+                "last_seen": last_seen,
+                "is_active": status == "online",
+                "device_info": None
+            }
+
+        # сначала смотрим в write-behind буфер: там активность, ещё не записанная в БД
+        buffered_last_seen = activity_buffer.get_last_seen(user_id)
+
         activity = self.db.query(UserActivity).filter(
             UserActivity.user_id == user_id
         ).first()
 
         if not activity:
+            if buffered_last_seen:
+                # запись ещё не сброшена в БД - при сбросе она создастся со статусом online
+                return {
+                    "status": "online",
+                    "last_seen": buffered_last_seen,
+                    "is_active": True,
+                    "device_info": None
+                }
+
             # Если нет записи активности - берем статус из User
             user = self.db.query(User).filter(User.id == user_id).first()
             user_status = user.status if user and user.status else "offline"
@@ -96,9 +129,11 @@ class ActivityRepository:
                 "is_active": False
             }
 
+        last_seen = buffered_last_seen or _naive(activity.last_seen)
+
         # Проверяем время последней активности
         now = datetime.now()  # Без timezone
-        time_since_active = (now - activity.last_seen).total_seconds() / 60
+        time_since_active = (now - last_seen).total_seconds() / 60
 
         # Если пользователь установил статус вручную (away, dnd, offline), сохраняем его
         # Только для online автоматически меняем на offline при долгом отсутствии
@@ -117,19 +152,20 @@ class ActivityRepository:
 
         return {
             "status": status,
-            "last_seen": activity.last_seen,
+            "last_seen": last_seen,
             "is_active": is_active,
             "device_info": activity.device_info
         }
     
     def get_online_users(self, space_id: int = None):
-        """Получить список онлайн пользователей"""
-        threshold = datetime.now() - timedelta(minutes=self.ONLINE_THRESHOLD_MINUTES)
-        
-        query = self.db.query(User).join(UserActivity).filter(
-            UserActivity.last_seen >= threshold,
-            UserActivity.status.in_(["online", "away"])
-        )
+        """Получить список онлайн пользователей (статусы - из памяти, пользователи - одним запросом)"""
+        from utils.presence_registry import presence_registry
+
+        user_ids = presence_registry.active_user_ids()
+        if not user_ids:
+            return []
+
+        query = self.db.query(User).filter(User.id.in_(user_ids))
         
         # Если указана комната - только участники этой комнаты
         if space_id:
@@ -145,13 +181,20 @@ class ActivityRepository:
         
         result = []
         for user in users:
-            status_info = self.get_user_status(user.id)
+            live = presence_registry.status_of(user.id)
+            if live is None:
+                # ушёл, пока шёл запрос
+                continue
+            status, last_seen = live
             result.append({
                 "id": user.id,
                 "nickname": user.nickname,
                 "display_name": user.display_name,
                 "avatar_url": user.avatar_url,
-                **status_info
+                "status": status,
+                "last_seen": last_seen,
+                "is_active": status == "online",
+                "device_info": None
             })
         
         return result
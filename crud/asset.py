@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import select, update, delete, exists, func
+from sqlalchemy.dialects.postgresql import insert
+from models.base import StoredAsset, Attachment, Message
+
+# поля StoredAsset, которые возвращаются вместо ответа хранилища
+_ASSET_COLUMNS = (
+    StoredAsset.id, StoredAsset.storage, StoredAsset.url, StoredAsset.public_id,
+    StoredAsset.resource_type, StoredAsset.info
+)
+
+
+def _asset_dict(row) -> Dict:
+    return {
+        "id": row.id,
+        "storage": row.storage,
+        "url": row.url,
+        "public_id": row.public_id,
+        "resource_type": row.resource_type,
+        "info": row.info or {}
+    }
+
+
+class AssetRepository:
+    """
+    Индекс загруженных файлов по содержимому (stored_assets)
+
+    - claim и add отмечают last_used_at: файл, который только что нашли или загрузили,
+      не удаляется сборщиком, пока вложение с ним ещё не создано
+    - refcount увеличивается при создании вложения (в той же транзакции) и уменьшается
+      при удалении чата; сборщик перед удалением дополнительно проверяет, что вложений нет
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def claim(self, content_hash: str, kind: str) -> Optional[Dict]:
+        """Найти уже загруженный файл с таким содержимым и отметить использование"""
+        row = self.db.execute(
+            update(StoredAsset)
+            .where(StoredAsset.content_hash == content_hash, StoredAsset.kind == kind)
+            .values(last_used_at=func.now())
+            .returning(*_ASSET_COLUMNS)
+        ).first()
+        self.db.commit()
+        return _asset_dict(row) if row else None
+
+    def add(self, content_hash: str, kind: str, storage: str, url: str, public_id: str,
+            resource_type: str, size: int, info: Dict) -> Optional[Dict]:
+        """
+        Запомнить загруженный файл
+
+        None - такой же файл параллельно загрузил другой запрос (его запись остаётся)
+        """
+        stmt = insert(StoredAsset).values(
+            content_hash=content_hash, kind=kind, storage=storage, url=url, public_id=public_id,
+            resource_type=resource_type, size=size, info=info, refcount=0
+        ).on_conflict_do_nothing(
+            index_elements=[StoredAsset.content_hash, StoredAsset.kind]
+        ).returning(*_ASSET_COLUMNS)
+        row = self.db.execute(stmt).first()
+        self.db.commit()
+        return _asset_dict(row) if row else None
+
+    def attach(self, asset_id: int):
+        """+1 ссылка (в транзакции создания вложения, без коммита)"""
+        self.db.execute(
+            update(StoredAsset)
+            .where(StoredAsset.id == asset_id)
+            .values(refcount=StoredAsset.refcount + 1, last_used_at=func.now())
+        )
+
+    def release_chat(self, chat_id: int):
+        """Снять ссылки вложений чата перед его удалением (без коммита)"""
+        counts = (
+            select(Attachment.asset_id, func.count().label("n"))
+            .join(Message, Message.id == Attachment.message_id)
+            .where(Message.chat_id == chat_id, Attachment.asset_id.isnot(None))
+            .group_by(Attachment.asset_id)
+            .subquery()
+        )
+        self.db.execute(
+            update(StoredAsset)
+            .where(StoredAsset.id == counts.c.asset_id)
+            .values(refcount=StoredAsset.refcount - counts.c.n)
+        )
+
+    def collect(self, grace_seconds: float, limit: int) -> List[Dict]:
+        """
+        Удалить из индекса файлы без ссылок, не использовавшиеся grace_seconds
+
+        Возвращает удалённые записи - сами файлы удаляются из хранилища после коммита.
+        FOR UPDATE SKIP LOCKED: несколько процессов не заберут одну запись дважды
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+        candidates = (
+            select(StoredAsset.id)
+            .where(
+                StoredAsset.refcount <= 0,
+                StoredAsset.last_used_at < cutoff,
+                # страховка: refcount мог разойтись с вложениями (правки в обход репозиториев)
+                ~exists().where(Attachment.asset_id == StoredAsset.id)
+            )
+            .order_by(StoredAsset.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        rows = self.db.execute(
+            delete(StoredAsset)
+            .where(StoredAsset.id.in_(candidates))
+            .returning(*_ASSET_COLUMNS)
+        ).all()
+        self.db.commit()
+        return [_asset_dict(row) for row in rows]
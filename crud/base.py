@@ -0,0 +1,36 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.base import AsyncSessionLocal
+
+
+class AsyncRepository:
+    """
+    Асинхронная обёртка над синхронным репозиторием из crud/
+
+    Методы репозитория выполняются через AsyncSession.run_sync: код репозитория
+    остаётся синхронным, а сами запросы идут через asyncpg и не блокируют event loop.
+    Один и тот же репозиторий можно использовать и с обычной Session, и с AsyncSession:
+
+        message_repo = AsyncRepository(MessageRepository, db)
+        message = await message_repo.get_by_id(message_id)
+    """
+
+    def __init__(self, repo_cls, session: AsyncSession):
+        self._repo_cls = repo_cls
+        self._session = session
+
+    def __getattr__(self, name: str):
+        async def method(*args, **kwargs):
+            def call(sync_session):
+                return getattr(self._repo_cls(sync_session), name)(*args, **kwargs)
+            return await self._session.run_sync(call)
+        return method
+
+
+async def run_in_session(fn, *args, **kwargs):
+    """
+    Выполнить синхронную функцию fn(db, *args, **kwargs) в отдельной асинхронной сессии
+
+    Используется там, где нет dependency FastAPI (обработчики Socket.IO, фоновые задачи)
+    """
+    async with AsyncSessionLocal() as session:
+        return await session.run_sync(fn, *args, **kwargs)
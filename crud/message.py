@@ -1,6 +1,30 @@
+import html
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_, or_, func, text
-from models.base import Message, User, Attachment
+from sqlalchemy import and_, or_, func, text, select, cast, literal, Float
+from models.base import Message, MessageOutbox, User, Attachment
+
+# маркеры подсветки в ts_headline: управляющие символы не встречаются в тексте сообщений,
+# поэтому фрагмент можно экранировать целиком и только потом превратить маркеры в <mark>
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+
+
+def highlight_snippet(snippet: str):
+    """Экранировать фрагмент из ts_headline и заменить маркеры подсветки на <mark>"""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_STOP, "</mark>")
+
+
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    """Курсор страницы поиска: "rank:id" (repr сохраняет rank без потери точности)"""
+    return f"{rank!r}:{message_id}"
+
+
+def decode_search_cursor(cursor: str) -> tuple:
+    """Разобрать курсор поиска; ValueError, если формат неверный"""
+    rank, message_id = cursor.rsplit(":", 1)
+    return float(rank), int(message_id)
 
 class MessageRepository:
     def __init__(self, db: Session):
@@ -15,19 +39,25 @@ class MessageRepository:
             attachment_id=attachment_id
         )
         self.db.add(message)
+
+        # упоминания и уведомления обрабатываются фоновым обработчиком outbox,
+        # запись в outbox попадает в ту же транзакцию, что и сообщение
+        has_side_effects = bool(content and "@" in content)
+        if has_side_effects:
+            self.db.flush()  # ID без коммита
+            self.db.add(MessageOutbox(message_id=message.id, event_type="message_created"))
+
         self.db.commit()
         self.db.refresh(message)
 
+        if has_side_effects:
+            from utils.outbox_worker import outbox_worker
+            outbox_worker.wake()
+
         # загрузка юзера для ответа
         user = self.db.query(User).filter(User.id == user_id).first()
         message.user = user
         message.user_nickname = user.nickname if user else None
-        
-        # обработка упоминаний
-        if content and "@" in content:
-            from crud.notification import MentionRepository
-            mention_repo = MentionRepository(self.db)
-            mention_repo.create_mentions(message.id, content, user_id, chat_id)
 
         return message
     
@@ -39,10 +69,17 @@ class MessageRepository:
             file_url=file_info["url"],
             file_type=file_info.get("format"),
             file_size=file_info.get("size"),
-            file_name=file_info.get("filename")
+            file_name=file_info.get("filename"),
+            variants=file_info.get("variants"),
+            asset_id=file_info.get("asset_id")
         )
         self.db.add(attachment)
         self.db.flush()  # ID без коммита
+
+        # ещё одна ссылка на общий файл (в той же транзакции, что и вложение)
+        if attachment.asset_id:
+            from crud.asset import AssetRepository
+            AssetRepository(self.db).attach(attachment.asset_id)
         
         message = Message(
             chat_id=chat_id,
@@ -66,15 +103,49 @@ class MessageRepository:
     def get_by_id(self, message_id: int):
         return self.db.query(Message).filter(Message.id == message_id).first()
 
-    def get_by_chat(self, chat_id: int, limit: int = 50, offset: int = 0):
+    def _chat_messages_query(self, chat_id: int):
         # ОПТИМИЗАЦИЯ: Загружаем пользователя вместе с сообщением через joinedload
-        messages = self.db.query(Message).options(
+        return self.db.query(Message).options(
             joinedload(Message.attachment),
             joinedload(Message.user)
         ).filter(
             Message.chat_id == chat_id,
             Message.is_deleted == False
-        ).order_by(Message.created_at.desc()).offset(offset).limit(limit).all()[::-1]
+        )
+
+    def get_by_chat(self, chat_id: int, limit: int = 50, offset: int = 0,
+                    before_id: int = None, after_id: int = None, around_id: int = None):
+        """
+        Сообщения чата в хронологическом порядке
+
+        Курсорная пагинация по индексу (chat_id, id) - скорость не зависит от глубины истории:
+        - before_id: limit сообщений старше before_id (подгрузка истории при скролле вверх)
+        - after_id: limit сообщений новее after_id (догрузка пропущенного)
+        - around_id: сообщение around_id и сообщения вокруг него (переход к сообщению из уведомления)
+        Без курсора - последние сообщения (offset оставлен для совместимости)
+        """
+        query = self._chat_messages_query(chat_id)
+
+        if before_id is not None:
+            messages = query.filter(Message.id < before_id).order_by(
+                Message.id.desc()
+            ).limit(limit).all()[::-1]
+        elif after_id is not None:
+            messages = query.filter(Message.id > after_id).order_by(
+                Message.id.asc()
+            ).limit(limit).all()
+        elif around_id is not None:
+            # половина - до сообщения (включая его самого), половина - после
+            newer_limit = limit // 2
+            older = query.filter(Message.id <= around_id).order_by(
+                Message.id.desc()
+            ).limit(limit - newer_limit).all()[::-1]
+            newer = self._chat_messages_query(chat_id).filter(Message.id > around_id).order_by(
+                Message.id.asc()
+            ).limit(newer_limit).all() if newer_limit else []
+            messages = older + newer
+        else:
+            messages = query.order_by(Message.id.desc()).offset(offset).limit(limit).all()[::-1]
 
         # Устанавливаем user_nickname из уже загруженного user
         for msg in messages:
@@ -83,19 +154,75 @@ class MessageRepository:
 
         return messages
 
-    def search_by_chat(self, chat_id: int, query: str, limit: int = 50, offset: int = 0):
-        messages = self.db.query(Message).options(
-            joinedload(Message.attachment)
-        ).filter(
-            Message.chat_id == chat_id,
-            Message.is_deleted == False,
-            Message.content.ilike(f"%{query}%")
-        ).order_by(Message.created_at.desc()).offset(offset).limit(limit).all()[::-1]
+    def search(self, query: str, chat_id: int = None, user_id: int = None,
+               limit: int = 50, cursor: tuple = None):
+        """
+        Полнотекстовый поиск сообщений (GIN-индекс по messages.search_vector)
 
-        for msg in messages:
-            user = self.db.query(User).filter(User.id == msg.user_id).first()
-            msg.user = user
-            msg.user_nickname = user.nickname if user else None
+        - chat_id: искать в одном чате
+        - user_id: искать во всех чатах, где пользователь активный участник
+        - cursor: (rank, id) последнего результата предыдущей страницы
+
+        Результаты отсортированы по релевантности (ts_rank_cd), затем по новизне.
+        У каждого сообщения заполняются rank, snippet (фрагмент с подсветкой <mark>) и cursor
+        """
+        from models.base import ChatParticipant, MESSAGE_SEARCH_CONFIG
+
+        tsquery = func.websearch_to_tsquery(MESSAGE_SEARCH_CONFIG, query)
+
+        filters = [
+            Message.search_vector.op("@@")(tsquery),
+            Message.is_deleted == False
+        ]
+        if chat_id is not None:
+            filters.append(Message.chat_id == chat_id)
+        if user_id is not None:
+            filters.append(Message.chat_id.in_(
+                select(ChatParticipant.chat_id).where(
+                    ChatParticipant.user_id == user_id,
+                    ChatParticipant.is_active == True
+                )
+            ))
+
+        # ранжируем только совпадения, а фрагменты строим только для одной страницы.
+        # ts_rank_cd возвращает real: приводим к double precision, иначе rank из курсора
+        # (Python float) не совпадёт с ним при сравнении и строки с тем же rank потеряются
+        matches = select(
+            Message.id.label("id"),
+            cast(func.ts_rank_cd(Message.search_vector, tsquery), Float(53)).label("rank")
+        ).where(*filters).subquery()
+
+        stmt = select(
+            Message,
+            matches.c.rank,
+            func.ts_headline(
+                MESSAGE_SEARCH_CONFIG,
+                Message.content,
+                tsquery,
+                f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=30, MinWords=10, MaxFragments=2"
+            ).label("snippet")
+        ).join(matches, matches.c.id == Message.id)
+
+        if cursor is not None:
+            cursor_rank, cursor_id = cursor
+            cursor_rank = literal(cursor_rank, Float(53))
+            stmt = stmt.where(or_(
+                matches.c.rank < cursor_rank,
+                and_(matches.c.rank == cursor_rank, matches.c.id < cursor_id)
+            ))
+
+        rows = self.db.execute(
+            stmt.order_by(matches.c.rank.desc(), matches.c.id.desc()).limit(limit)
+        ).all()
+
+        messages = []
+        for msg, rank, snippet in rows:
+            # пользователь уже загружен через joined relationship - без N+1
+            msg.user_nickname = msg.user.nickname if msg.user else None
+            msg.rank = rank
+            msg.snippet = highlight_snippet(snippet)
+            msg.cursor = encode_search_cursor(rank, msg.id)
+            messages.append(msg)
 
         return messages
 
@@ -1,5 +1,7 @@
+from sqlalchemy import select, literal, case, func, union_all, BigInteger
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
-from models.base import Notification, Mention, User
+from models.base import Notification, Mention, User, ChatParticipant
 import re
 
 class NotificationRepository:
@@ -8,8 +10,8 @@ class NotificationRepository:
     
     def create(self, user_id: int, notification_type: str, title: str, 
                content: str = None, related_message_id: int = None, 
-               related_user_id: int = None, related_space_id: int = None):
-        """Создать уведомление"""
+               related_user_id: int = None, related_space_id: int = None, commit: bool = True):
+        """Создать уведомление (commit=False - в рамках внешней транзакции)"""
         notification = Notification(
             user_id=user_id,
             type=notification_type,
@@ -20,8 +22,9 @@ class NotificationRepository:
             related_space_id=related_space_id
         )
         self.db.add(notification)
-        self.db.commit()
-        self.db.refresh(notification)
+        if commit:
+            self.db.commit()
+            self.db.refresh(notification)
         return notification
     
     def get_user_notifications(self, user_id: int, unread_only: bool = False, limit: int = 50):
@@ -74,105 +77,84 @@ class MentionRepository:
         mentions = re.findall(pattern, content)
         return list(set(mentions))  # Уникальные
     
-    def create_mentions(self, message_id: int, content: str, author_id: int, chat_id: int):
-        """Создать упоминания и уведомления"""
+    def create_mentions(self, message_id: int, content: str, author_id: int, chat_id: int,
+                        commit: bool = True):
+        """
+        Создать упоминания и уведомления (commit=False - в рамках внешней транзакции)
+
+        Все упоминания и уведомления вставляются одним запросом INSERT ... SELECT,
+        сколько бы участников ни было в чате (@all). Повторные упоминания
+        отбрасываются через ON CONFLICT, уведомления создаются только для новых.
+        Возвращает id пользователей, которым создано уведомление
+        """
         nicknames = self.parse_mentions(content)
 
         if not nicknames:
             return []
 
-        mentioned_user_ids = set()  # Используем set для отслеживания уникальных ID
-        notification_repo = NotificationRepository(self.db)
-        author = self.db.query(User).filter(User.id == author_id).first()
+        author = self.db.get(User, author_id)
+        if author is None:
+            return []
 
-        # Проверяем наличие @all
+        # кого упомянули: участники чата (@all) и пользователи по никнеймам
+        sources = []
         if 'all' in nicknames:
-            # Получаем всех участников чата
-            from models.base import ChatParticipant
-            participants = self.db.query(ChatParticipant).filter(
-                ChatParticipant.chat_id == chat_id,
-                ChatParticipant.is_active == True
-            ).all()
-
-            for participant in participants:
-                # Не упоминаем самого себя
-                if participant.user_id == author_id:
-                    continue
-
-                # Пропускаем если уже упомянут
-                if participant.user_id in mentioned_user_ids:
-                    continue
-
-                mentioned_user_ids.add(participant.user_id)
-
-                # Проверяем, нет ли уже такого упоминания в БД
-                existing_mention = self.db.query(Mention).filter(
-                    Mention.message_id == message_id,
-                    Mention.mentioned_user_id == participant.user_id
-                ).first()
-
-                if not existing_mention:
-                    # Создаём запись упоминания
-                    mention = Mention(
-                        message_id=message_id,
-                        mentioned_user_id=participant.user_id
-                    )
-                    self.db.add(mention)
-
-                    # Создаём уведомление
-                    user = self.db.query(User).filter(User.id == participant.user_id).first()
-                    if user:
-                        notification_repo.create(
-                            user_id=user.id,
-                            notification_type="mention",
-                            title=f"{author.nickname} упомянул всех",
-                            content=content[:100],
-                            related_message_id=message_id,
-                            related_user_id=author_id
-                        )
-
-        # Обрабатываем конкретные упоминания (кроме @all)
+            sources.append(
+                select(
+                    ChatParticipant.user_id.label("user_id"),
+                    literal(True).label("via_all")
+                ).where(
+                    ChatParticipant.chat_id == chat_id,
+                    ChatParticipant.is_active == True
+                )
+            )
         specific_nicknames = [n for n in nicknames if n != 'all']
         if specific_nicknames:
-            # Находим пользователей по никнеймам
-            users = self.db.query(User).filter(User.nickname.in_(specific_nicknames)).all()
-
-            for user in users:
-                # Не упоминаем самого себя
-                if user.id == author_id:
-                    continue
-
-                # Пропускаем если уже упомянут
-                if user.id in mentioned_user_ids:
-                    continue
-
-                mentioned_user_ids.add(user.id)
-
-                # Проверяем, нет ли уже такого упоминания в БД
-                existing_mention = self.db.query(Mention).filter(
-                    Mention.message_id == message_id,
-                    Mention.mentioned_user_id == user.id
-                ).first()
-
-                if not existing_mention:
-                    # Создаём запись упоминания
-                    mention = Mention(
-                        message_id=message_id,
-                        mentioned_user_id=user.id
-                    )
-                    self.db.add(mention)
-
-                    # Создаём уведомление
-                    notification_repo.create(
-                        user_id=user.id,
-                        notification_type="mention",
-                        title=f"{author.nickname} упомянул вас",
-                        content=content[:100],  # Первые 100 символов
-                        related_message_id=message_id,
-                        related_user_id=author_id
-                    )
+            sources.append(
+                select(
+                    User.id.label("user_id"),
+                    literal(False).label("via_all")
+                ).where(User.nickname.in_(specific_nicknames))
+            )
+        if not sources:
+            return []
 
-        self.db.commit()
+        candidates = (union_all(*sources) if len(sources) > 1 else sources[0]).subquery("candidates")
+        # один пользователь - одно упоминание; упомянутый и через @all, и по нику получает "упомянул всех"
+        targets = select(
+            candidates.c.user_id,
+            func.bool_or(candidates.c.via_all).label("via_all")
+        ).where(
+            candidates.c.user_id != author_id  # не упоминаем самого себя
+        ).group_by(candidates.c.user_id).cte("mention_targets")
+
+        new_mentions = insert(Mention).from_select(
+            ["message_id", "mentioned_user_id"],
+            select(literal(message_id, BigInteger), targets.c.user_id)
+        ).on_conflict_do_nothing(
+            index_elements=[Mention.message_id, Mention.mentioned_user_id]
+        ).returning(Mention.mentioned_user_id).cte("new_mentions")
+
+        title = case(
+            (targets.c.via_all, f"{author.nickname} упомянул всех"),
+            else_=f"{author.nickname} упомянул вас"
+        )
+        stmt = insert(Notification).from_select(
+            ["user_id", "type", "title", "content", "related_message_id", "related_user_id"],
+            select(
+                new_mentions.c.mentioned_user_id,
+                literal("mention"),
+                title,
+                literal(content[:100]),  # Первые 100 символов
+                literal(message_id, BigInteger),
+                literal(author_id, BigInteger)
+            ).join(targets, targets.c.user_id == new_mentions.c.mentioned_user_id)
+        ).returning(Notification.user_id)
+
+        mentioned_user_ids = self.db.execute(stmt).scalars().all()
+
+        if commit:
+            self.db.commit()
         return list(mentioned_user_ids)
     
     def get_message_mentions(self, message_id: int):
@@ -1,42 +1,127 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from models.base import User, Reaction
+from sqlalchemy import delete, text, bindparam, BigInteger
+from sqlalchemy.dialects.postgresql import insert
+from models.base import User, Reaction, ReactionCount
+
+# Toggle реакции одним запросом (одна реакция на пользователя, ux_reactions_message_user):
+# - та же реакция - удаляется, другая - заменяется, реакции нет - вставляется
+# - UPDATE берёт старую реакцию под блокировкой строки, поэтому параллельные клики
+#   не теряют изменения счётчиков; при гонке двух вставок вторая ничего не меняет (DO NOTHING)
+# - счётчики reaction_counts меняются в том же запросе; строки с count = 0 не удаляются
+#   (та же строка не может меняться дважды в одном запросе) и отфильтровываются при чтении
+# Результат - строки (kind, reaction, value): found, mine, delta и count
+_TOGGLE_SQL = text("""
+WITH target AS (
+    SELECT id FROM messages
+    WHERE id = :message_id AND (CAST(:chat_id AS BIGINT) IS NULL OR chat_id = :chat_id)
+),
+removed AS (
+    DELETE FROM reactions
+    WHERE message_id IN (SELECT id FROM target) AND user_id = :user_id AND reaction = :reaction
+    RETURNING reaction
+),
+changed AS (
+    UPDATE reactions r SET reaction = :reaction, added_at = now()
+    FROM (
+        SELECT id, reaction FROM reactions
+        WHERE message_id IN (SELECT id FROM target) AND user_id = :user_id
+        FOR UPDATE
+    ) old
+    WHERE r.id = old.id AND old.reaction <> :reaction
+    RETURNING old.reaction AS old_reaction
+),
+inserted AS (
+    INSERT INTO reactions (message_id, user_id, reaction)
+    SELECT id, :user_id, :reaction FROM target
+    WHERE NOT EXISTS (
+        SELECT 1 FROM reactions WHERE message_id = :message_id AND user_id = :user_id
+    )
+    ON CONFLICT (message_id, user_id) DO NOTHING
+    RETURNING reaction
+),
+deltas AS (
+    SELECT reaction, -1 AS delta FROM removed
+    UNION ALL SELECT old_reaction, -1 FROM changed
+    UNION ALL SELECT CAST(:reaction AS VARCHAR), 1 FROM changed
+    UNION ALL SELECT reaction, 1 FROM inserted
+),
+counted AS (
+    INSERT INTO reaction_counts (message_id, reaction, count)
+    SELECT :message_id, reaction, sum(delta) FROM deltas GROUP BY reaction
+    ON CONFLICT (message_id, reaction) DO UPDATE SET count = reaction_counts.count + EXCLUDED.count
+    RETURNING reaction, count
+)
+SELECT 'found' AS kind, CAST(NULL AS VARCHAR) AS reaction, CAST(NULL AS BIGINT) AS value FROM target
+UNION ALL
+SELECT 'mine', CAST(:reaction AS VARCHAR), NULL FROM changed
+UNION ALL
+SELECT 'mine', reaction, NULL FROM inserted
+UNION ALL
+SELECT 'delta', reaction, delta FROM deltas
+UNION ALL
+SELECT 'count', reaction, count FROM counted
+UNION ALL
+SELECT 'count', reaction, count FROM reaction_counts
+WHERE message_id = :message_id AND reaction NOT IN (SELECT reaction FROM counted)
+""").bindparams(
+    bindparam("message_id", type_=BigInteger),
+    bindparam("user_id", type_=BigInteger),
+    bindparam("chat_id", type_=BigInteger)
+)
+
 
 class ReactionRepository:
     def __init__(self, db: Session):
         self.db = db
     
-    def add_reaction(self, message_id: int, user_id: int, reaction: str):
-        """Добавить реакцию (или замена)"""
-        # есть ли уже реакция этого пользователя на это сообщение
-        existing = self.db.query(Reaction).filter(
-            Reaction.message_id == message_id,
-            Reaction.user_id == user_id
-        ).first()
-        
-        if existing:
-            # если та же реакция - удаляем (toggle)
-            if existing.reaction == reaction:
-                self.db.delete(existing)
-                self.db.commit()
-                return None
-            # иначе меняем реакцию
-            existing.reaction = reaction
-            self.db.commit()
-            self.db.refresh(existing)
-            return existing
-        
-        # создаём новую реакцию
-        new_reaction = Reaction(
-            message_id=message_id,
-            user_id=user_id,
-            reaction=reaction
+    def _bump_count(self, message_id: int, reaction: str, delta: int):
+        """Изменить счётчик реакции в reaction_counts (в текущей транзакции)"""
+        stmt = insert(ReactionCount).values(message_id=message_id, reaction=reaction, count=delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ReactionCount.message_id, ReactionCount.reaction],
+            set_={"count": ReactionCount.count + stmt.excluded.count}
         )
-        self.db.add(new_reaction)
+        self.db.execute(stmt)
+        if delta < 0:
+            self.db.execute(delete(ReactionCount).where(
+                ReactionCount.message_id == message_id,
+                ReactionCount.reaction == reaction,
+                ReactionCount.count <= 0
+            ))
+
+    def toggle_reaction(self, message_id: int, user_id: int, reaction: str, chat_id: int = None):
+        """
+        Поставить, заменить или снять (toggle) реакцию пользователя одним запросом
+
+        Реакция, счётчики reaction_counts и ответ - один атомарный SQL-запрос (см. _TOGGLE_SQL).
+        Возвращает (found, my_reaction, deltas, reactions):
+        found - сообщение существует (и находится в chat_id, если он указан),
+        deltas - [{"reaction", "delta"}] с +1 / -1, reactions - новая сводка [{"reaction", "count"}]
+        """
+        rows = self.db.execute(_TOGGLE_SQL, {
+            "message_id": message_id,
+            "user_id": user_id,
+            "reaction": reaction,
+            "chat_id": chat_id
+        }).all()
         self.db.commit()
-        self.db.refresh(new_reaction)
-        
-        return new_reaction
+
+        found = False
+        my_reaction = None
+        deltas = []
+        counts = []
+        for kind, emoji, value in rows:
+            if kind == "found":
+                found = True
+            elif kind == "mine":
+                my_reaction = emoji
+            elif kind == "delta":
+                deltas.append({"reaction": emoji, "delta": value})
+            elif value > 0:
+                counts.append({"reaction": emoji, "count": value})
+
+        counts.sort(key=lambda r: (-r["count"], r["reaction"]))
+        return found, my_reaction, deltas, counts
     
     def remove_reaction(self, message_id: int, user_id: int, reaction: str):
         """Удалить реакцию"""
@@ -48,36 +133,30 @@ class ReactionRepository:
         
         if existing:
             self.db.delete(existing)
+            self._bump_count(message_id, reaction, -1)
             self.db.commit()
             return True
         
         return False
+
+    def get_reaction_counts(self, message_ids: list):
+        """Сводка реакций по сообщениям из счётчиков: {message_id: [{"reaction", "count"}]}"""
+        if not message_ids:
+            return {}
+
+        rows = self.db.query(ReactionCount).filter(
+            ReactionCount.message_id.in_(message_ids),
+            ReactionCount.count > 0
+        ).order_by(ReactionCount.message_id, ReactionCount.count.desc(), ReactionCount.reaction).all()
+
+        result = {}
+        for row in rows:
+            result.setdefault(row.message_id, []).append({"reaction": row.reaction, "count": row.count})
+        return result
     
     def get_message_reactions(self, message_id: int):
-        """Получить все реакции на сообщение с группировкой"""
-        # группируем реакции
-        reactions_query = self.db.query(
-            Reaction.reaction,
-            func.count(Reaction.id).label('count')
-        ).filter(
-            Reaction.message_id == message_id
-        ).group_by(Reaction.reaction).all()
-        
-        result = []
-        for reaction, count in reactions_query:
-            # получаем пользователей которые поставили эту реакцию
-            users = self.db.query(User).join(Reaction).filter(
-                Reaction.message_id == message_id,
-                Reaction.reaction == reaction
-            ).all()
-            
-            result.append({
-                "reaction": reaction,
-                "count": count,
-                "users": [{"id": u.id, "nickname": u.nickname} for u in users]
-            })
-        
-        return result
+        """Сводка реакций на сообщение (без списков пользователей - см. get_reaction_users)"""
+        return self.get_reaction_counts([message_id]).get(message_id, [])
     
     def get_user_reaction(self, message_id: int, user_id: int):
         """Получить реакцию конкретного пользователя на сообщение"""
@@ -88,49 +167,44 @@ class ReactionRepository:
         
         return reaction.reaction if reaction else None
 
-    def get_reactions_for_messages(self, message_ids: list, current_user_id: int):
-        """ОПТИМИЗАЦИЯ: Получить реакции для нескольких сообщений одним запросом"""
+    def get_user_reactions(self, message_ids: list, user_id: int):
+        """Реакции пользователя на несколько сообщений одним запросом: {message_id: reaction}"""
         if not message_ids:
-            return {}, {}
-        
-        # Получаем все реакции для всех сообщений одним запросом
-        all_reactions = self.db.query(Reaction, User).join(
+            return {}
+
+        rows = self.db.query(Reaction.message_id, Reaction.reaction).filter(
+            Reaction.message_id.in_(message_ids),
+            Reaction.user_id == user_id
+        ).all()
+        return {message_id: reaction for message_id, reaction in rows}
+
+    def get_reactions_for_messages(self, message_ids: list, current_user_id: int):
+        """Сводки реакций и реакции текущего пользователя для нескольких сообщений (два запроса)"""
+        return (
+            self.get_reaction_counts(message_ids),
+            self.get_user_reactions(message_ids, current_user_id)
+        )
+
+    def get_reaction_users(self, message_id: int, reaction: str, limit: int = 50, after_id: int = None):
+        """
+        Пользователи, поставившие реакцию, постранично (в порядке добавления)
+
+        Возвращает (users, next_cursor); next_cursor - after_id для следующей страницы или None
+        """
+        query = self.db.query(Reaction.id, User.id, User.nickname, User.avatar_url).join(
             User, Reaction.user_id == User.id
         ).filter(
-            Reaction.message_id.in_(message_ids)
-        ).all()
-        
-        # Группируем реакции по message_id
-        reactions_by_message = {}
-        my_reactions = {}
-        
-        for reaction, user in all_reactions:
-            msg_id = reaction.message_id
-            
-            if msg_id not in reactions_by_message:
-                reactions_by_message[msg_id] = {}
-            
-            reaction_emoji = reaction.reaction
-            if reaction_emoji not in reactions_by_message[msg_id]:
-                reactions_by_message[msg_id][reaction_emoji] = {
-                    "reaction": reaction_emoji,
-                    "count": 0,
-                    "users": []
-                }
-            
-            reactions_by_message[msg_id][reaction_emoji]["count"] += 1
-            reactions_by_message[msg_id][reaction_emoji]["users"].append({
-                "id": user.id,
-                "nickname": user.nickname
-            })
-            
-            # Запоминаем реакцию текущего пользователя
-            if user.id == current_user_id:
-                my_reactions[msg_id] = reaction_emoji
-        
-        # Преобразуем в нужный формат
-        result = {}
-        for msg_id, reactions_dict in reactions_by_message.items():
-            result[msg_id] = list(reactions_dict.values())
-        
-        return result, my_reactions
\ No newline at end of file
+            Reaction.message_id == message_id,
+            Reaction.reaction == reaction
+        )
+        if after_id is not None:
+            query = query.filter(Reaction.id > after_id)
+
+        rows = query.order_by(Reaction.id).limit(limit + 1).all()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+
+        users = [
+            {"id": user_id, "nickname": nickname, "avatar_url": avatar_url}
+            for _, user_id, nickname, avatar_url in rows[:limit]
+        ]
+        return users, next_cursor
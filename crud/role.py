@@ -1,6 +1,73 @@
+import os
+from typing import Callable, Optional
+from sqlalchemy import select, exists, func
 from sqlalchemy.orm import Session
-from models.base import Role, UserRole, User
-from models.permissions import has_permission, Permission
+from models.base import Role, UserRole, User, Space, Chat, ChatParticipant
+from models.permissions import (
+    has_permission_mask, compile_permissions, decompile_permissions,
+    Permission, ALL_PERMISSIONS_MASK
+)
+from utils.cache import TTLCache
+
+PERMISSION_CACHE_TTL = int(os.getenv("PERMISSION_CACHE_TTL", "60"))  # секунды
+PERMISSION_CACHE_SIZE = int(os.getenv("PERMISSION_CACHE_SIZE", "50000"))
+
+# (user_id, space_id) -> SpacePermissions
+_permission_cache = TTLCache(maxsize=PERMISSION_CACHE_SIZE, ttl=PERMISSION_CACHE_TTL, name="space_permissions")
+# вызывается с (space_id, user_id) при каждом сбросе прав в этом процессе
+# (при нескольких процессах - рассылка сброса остальным, см. main.py)
+on_permissions_invalidate: Optional[Callable[[int, Optional[int]], None]] = None
+
+
+class SpacePermissions:
+    """Права пользователя в пространстве, собранные одним запросом"""
+    __slots__ = ("user_id", "space_id", "space_exists", "is_owner", "is_member", "mask",
+                 "role_id", "role_name", "role_color", "role_priority")
+
+    def __init__(self, user_id: int, space_id: int, space_exists: bool = False,
+                 is_owner: bool = False, is_member: bool = False,
+                 mask: int = 0, role_id: int = None, role_name: str = None,
+                 role_color: str = None, role_priority: int = None):
+        self.user_id = user_id
+        self.space_id = space_id
+        self.space_exists = space_exists
+        self.is_owner = is_owner
+        self.is_member = is_member
+        self.mask = mask
+        self.role_id = role_id
+        self.role_name = role_name
+        self.role_color = role_color
+        self.role_priority = role_priority
+
+    def has(self, permission: str) -> bool:
+        """Есть ли разрешение (владелец пространства может всё)"""
+        if self.is_owner:
+            return True
+        return self.is_member and has_permission_mask(self.mask, permission)
+
+    @property
+    def permissions(self) -> list:
+        return decompile_permissions(ALL_PERMISSIONS_MASK if self.is_owner else self.mask)
+
+
+def invalidate_permissions(space_id: int, user_id: int = None):
+    """
+    Сбросить закешированные права
+
+    Вызывается при создании/изменении/удалении ролей (для всего пространства)
+    и при назначении роли, вступлении, кике или выходе (для одного пользователя)
+    """
+    drop_cached_permissions(space_id, user_id)
+    if on_permissions_invalidate is not None:
+        on_permissions_invalidate(space_id, user_id)
+
+
+def drop_cached_permissions(space_id: int, user_id: int = None):
+    """Сбросить права только в кеше этого процесса (сброс, пришедший из другого процесса)"""
+    if user_id is not None:
+        _permission_cache.pop((user_id, space_id))
+    else:
+        _permission_cache.pop_where(lambda key, value: key[1] == space_id)
 
 class RoleRepository:
     def __init__(self, db: Session):
@@ -20,6 +87,7 @@ class RoleRepository:
         self.db.add(role)
         self.db.commit()
         self.db.refresh(role)
+        invalidate_permissions(space_id)
         return role
 
     def update(self, role_id: int, name: str = None, permissions: list = None, 
@@ -45,6 +113,7 @@ class RoleRepository:
         
         self.db.commit()
         self.db.refresh(role)
+        invalidate_permissions(role.space_id)
         return role
 
     def delete(self, role_id: int):
@@ -65,8 +134,10 @@ class RoleRepository:
                 UserRole.role_id == role_id
             ).update({"role_id": default_role.id})
         
+        space_id = role.space_id
         self.db.delete(role)
         self.db.commit()
+        invalidate_permissions(space_id)
         return True
 
     def get_by_id(self, role_id: int):
@@ -104,11 +175,13 @@ class RoleRepository:
             if target_role and target_role.priority >= assigner_role.priority:
                 return None
         
+        space_id = role.space_id
+
         # удаляем старые роли в этой комнате
         self.db.query(UserRole).filter(
             UserRole.user_id == user_id,
             UserRole.role_id.in_(
-                self.db.query(Role.id).filter(Role.space_id == role.space_id)
+                self.db.query(Role.id).filter(Role.space_id == space_id)
             )
         ).delete(synchronize_session=False)
         
@@ -117,6 +190,7 @@ class RoleRepository:
         self.db.add(user_role)
         self.db.commit()
         self.db.refresh(user_role)
+        invalidate_permissions(space_id, user_id)
         
         return user_role
     
@@ -152,34 +226,98 @@ class RoleRepository:
         role = self.db.query(Role).filter(Role.id == user_role.role_id).first()
         return role
 
+    def get_space_permissions(self, user_id: int, space_id: int) -> SpacePermissions:
+        """
+        Права пользователя в комнате (с кешированием по (user_id, space_id))
+
+        Участие, владелец, роль и её маска собираются одним запросом.
+        Если роль не назначена, берётся роль по умолчанию (без записи в БД)
+        """
+        key = (user_id, space_id)
+        cached = _permission_cache.get(key)
+        if cached is not None:
+            return cached
+
+        is_member = exists().where(
+            ChatParticipant.chat_id == Chat.id,
+            Chat.space_id == space_id,
+            ChatParticipant.user_id == user_id,
+            ChatParticipant.is_active == True
+        )
+        assigned_role_id = select(UserRole.role_id).join(
+            Role, Role.id == UserRole.role_id
+        ).where(
+            UserRole.user_id == user_id,
+            Role.space_id == space_id
+        ).order_by(Role.priority.desc()).limit(1).scalar_subquery()
+        default_role_id = select(Role.id).where(
+            Role.space_id == space_id,
+            Role.name == "Участник"
+        ).limit(1).scalar_subquery()
+
+        row = self.db.execute(
+            select(Space.admin_id, is_member.label("is_member"), Role)
+            .select_from(Space)
+            .outerjoin(Role, Role.id == func.coalesce(assigned_role_id, default_role_id))
+            .where(Space.id == space_id)
+        ).first()
+
+        if row is None:
+            permissions = SpacePermissions(user_id, space_id)
+        else:
+            admin_id, member, role = row
+            mask = 0
+            if role is not None:
+                # роли, созданные до появления маски, компилируем на лету
+                mask = role.permissions_mask
+                if mask is None:
+                    mask = compile_permissions(role.permissions)
+            permissions = SpacePermissions(
+                user_id,
+                space_id,
+                space_exists=True,
+                is_owner=admin_id == user_id,
+                is_member=bool(member),
+                mask=mask,
+                role_id=role.id if role else None,
+                role_name=role.name if role else None,
+                role_color=role.color if role else None,
+                role_priority=role.priority if role else None
+            )
+
+        _permission_cache.set(key, permissions)
+        return permissions
+
     def get_permissions(self, user_id: int, space_id: int) -> list:
         """Получить разрешения пользователя в комнате"""
-        role = self.get_user_role(user_id, space_id)
-        
-        if role and isinstance(role.permissions, list):
-            return role.permissions
-        
-        return []
+        permissions = self.get_space_permissions(user_id, space_id)
+        if not permissions.is_member:
+            return []
+        return decompile_permissions(permissions.mask)
     
     def check_permission(self, user_id: int, space_id: int, permission: str) -> bool:
-        """Проверить наличие разрешения"""
-        permissions = self.get_permissions(user_id, space_id)
-        return has_permission(permissions, permission)
+        """Проверить наличие разрешения (по битовой маске, без запросов при попадании в кеш)"""
+        permissions = self.get_space_permissions(user_id, space_id)
+        return permissions.is_member and has_permission_mask(permissions.mask, permission)
     
     def can_manage_role(self, manager_id: int, target_role_id: int, space_id: int) -> bool:
         """Проверить может ли пользователь управлять ролью"""
-        manager_role = self.get_user_role(manager_id, space_id)
+        manager = self.get_space_permissions(manager_id, space_id)
         target_role = self.get_by_id(target_role_id)
         
-        if not manager_role or not target_role:
+        if not manager.is_member or manager.role_id is None or not target_role:
+            return False
+        
+        # роль должна принадлежать этой комнате
+        if target_role.space_id != space_id:
             return False
         
         # нельзя управлять системными ролями (кроме владельца)
-        if target_role.is_system and manager_role.name != "Владелец":
+        if target_role.is_system and manager.role_name != "Владелец":
             return False
         
         # можно управлять только ролями с приоритетом ниже своего
-        return manager_role.priority > target_role.priority
+        return (manager.role_priority or 0) > (target_role.priority or 0)
     
     def get_members_with_role(self, role_id: int):
         """Получить участников с определённой ролью"""
@@ -1,5 +1,7 @@
 from sqlalchemy.orm import Session
 from models.base import Space, Chat, ChatParticipant, User, Role, UserRole
+from crud.role import invalidate_permissions
+from utils.presence import presence
 
 class SpaceRepository:
     def __init__(self, db: Session):
@@ -77,6 +79,7 @@ class SpaceRepository:
         )
         self.db.add(participant)
         self.db.commit()
+        presence.membership_changed(admin_id, space.id, joined=True)
 
         return space
 
@@ -175,6 +178,9 @@ class SpaceRepository:
             default_role = role_repo.get_default_role(space_id)
             if default_role:
                 role_repo.assign_to_user(user_id, default_role.id)
+
+        invalidate_permissions(space_id, user_id)
+        presence.membership_changed(user_id, space_id, joined=True)
         
         return space
 
@@ -192,5 +198,7 @@ class SpaceRepository:
         if participant:
             participant.is_active = False
             self.db.commit()
+            invalidate_permissions(space_id, user_id)
+            presence.membership_changed(user_id, space_id, joined=False)
         
         return participant
\ No newline at end of file
@@ -1,10 +1,12 @@
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import asyncio
 import socketio
 import os
-from models.base import Base, SessionLocal, engine
-from routers import auth, spaces, messages, profile, notifications, stickers, roles, status
+from datetime import datetime
+from models.base import Base, SessionLocal, engine, async_engine, DATABASE_URL
+from routers import auth, spaces, messages, profile, notifications, stickers, roles, status, media
 from crud.user import UserRepository
 from crud.space import SpaceRepository
 from crud.message import MessageRepository
@@ -13,6 +15,10 @@ from crud.ban import BanRepository
 
 app = FastAPI()
 
+# слишком большие запросы отклоняются до приёма тела и разбора формы (MAX_REQUEST_BODY)
+from utils.body_limit import BodySizeLimitMiddleware
+app.add_middleware(BodySizeLimitMiddleware)
+
 # CORS для продакшена
 app.add_middleware(
     CORSMiddleware,
@@ -34,9 +40,29 @@ async def root():
         "docs": "/docs"
     }
 
+# число процессов uvicorn (при запуске через python main.py)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# memory - события Socket.IO только внутри процесса, postgres - между процессами через LISTEN/NOTIFY
+SOCKETIO_MANAGER = os.getenv("SOCKETIO_MANAGER", "postgres" if WEB_CONCURRENCY > 1 else "memory")
+# транспорты Engine.IO. Запросы long-polling одной сессии должны приходить в один процесс,
+# а воркеры uvicorn на одном порту этого не обеспечивают - при нескольких процессах только WebSocket.
+# polling вместе с WEB_CONCURRENCY > 1 - только за балансировщиком со sticky sessions
+SOCKETIO_TRANSPORTS = [
+    t.strip() for t in os.getenv(
+        "SOCKETIO_TRANSPORTS", "websocket" if WEB_CONCURRENCY > 1 else "polling,websocket"
+    ).split(",") if t.strip()
+]
+
+client_manager = None
+if SOCKETIO_MANAGER == "postgres":
+    from utils.pg_manager import AsyncPostgresManager
+    client_manager = AsyncPostgresManager(DATABASE_URL)
+
 # инициализация Socket.IO сервера
 sio = socketio.AsyncServer(
     async_mode='asgi',
+    client_manager=client_manager,
+    transports=SOCKETIO_TRANSPORTS,
     cors_allowed_origins='*',
     logger=True,
     engineio_logger=True
@@ -74,6 +100,8 @@ app.include_router(notifications.router, prefix="/notifications", tags=["notific
 app.include_router(stickers.router, prefix="/stickers", tags=["stickers"])
 app.include_router(roles.router, prefix="/spaces", tags=["roles"])
 app.include_router(status.router, prefix="/status", tags=["status"])
+# файлы локального хранилища (ATTACHMENT_STORAGE / AVATAR_STORAGE = local)
+app.include_router(media.router, prefix="/media", tags=["media"])
 
 # создание таблиц
 Base.metadata.create_all(bind=engine)
@@ -94,6 +122,129 @@ async def root():
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/health/caches")
+async def cache_metrics():
+    """Метрики кешей процесса (размер, попадания, промахи)"""
+    from utils.cache import cache_stats
+    return cache_stats()
+
+@app.on_event("startup")
+async def startup():
+    from utils.activity_buffer import activity_buffer
+    from utils.outbox_worker import outbox_worker
+    from utils.message_ingest import message_ingest
+    from utils.presence import presence
+    from utils.presence_registry import presence_registry
+    from utils.image_pipeline import start_image_pool
+    from utils.asset_gc import asset_collector
+    # процессы обработки изображений - первыми, пока в приложении нет других потоков
+    start_image_pool()
+    # периодический сброс буфера активности в БД
+    activity_buffer.start()
+    # пакетная запись сообщений из Socket.IO (если включена SOCKET_MESSAGE_INGEST=batch)
+    message_ingest.start()
+    # обработка упоминаний и уведомлений после отправки сообщений
+    outbox_worker.start()
+    # склейка и адресная рассылка статусов пользователей
+    presence.start()
+    # переходы online -> away -> offline
+    presence_registry.start()
+    # удаление файлов вложений, на которые больше нет ссылок
+    asset_collector.start()
+
+    if client_manager is not None:
+        from utils.message_cache import message_cache
+        # слушаем канал сразу, а не с первого подключения сокета
+        if not sio.manager_initialized:
+            sio.manager_initialized = True
+            client_manager.initialize()
+        # окна кеша сообщений в других процессах сбрасываются при любом изменении чата
+        message_cache.on_change = lambda chat_id: client_manager.publish("message_cache_invalidate", chat_id=chat_id)
+        client_manager.on("message_cache_invalidate", lambda data: message_cache.invalidate(data["chat_id"]))
+
+        # права и данные пользователей (ник, аватар) кешируются в каждом процессе - сброс рассылается всем
+        from crud import role as role_crud
+        from utils import auth as auth_utils
+        role_crud.on_permissions_invalidate = lambda space_id, user_id: client_manager.publish(
+            "permissions_invalidate", space_id=space_id, user_id=user_id
+        )
+        client_manager.on("permissions_invalidate", lambda data: role_crud.drop_cached_permissions(
+            data["space_id"], data["user_id"]
+        ))
+        auth_utils.on_principal_invalidate = lambda user_id: client_manager.publish(
+            "principal_invalidate", user_id=user_id
+        )
+        client_manager.on("principal_invalidate", lambda data: auth_utils.drop_cached_principal(data["user_id"]))
+
+        from utils.room_events import room_events
+        # номера событий комнат общие для всех процессов, события других процессов - в журнал
+        room_events.use_shared_sequence(
+            "shared", client_manager.next_room_seq, client_manager.current_room_seq, client_manager.current_room_seqs
+        )
+        client_manager.on_emit(room_events.record_remote)
+
+        # состав пространств меняется в одном процессе, а сокеты пользователя могут быть в других
+        def publish_membership(user_id, space_id, joined):
+            client_manager.publish("presence_membership", user_id=user_id, space_id=space_id, joined=joined)
+
+        def apply_membership(data):
+            if data["user_id"] is None:
+                presence.apply_space_removed(data["space_id"])
+            else:
+                presence.apply_membership(data["user_id"], data["space_id"], data["joined"])
+
+        presence.on_change = publish_membership
+        client_manager.on("presence_membership", apply_membership)
+
+        # исключённый пользователь выходит из комнаты чата и на сокетах в других процессах
+        from utils import socketio_handlers
+        socketio_handlers.ws_manager.on_kick = lambda user_id, room_id: client_manager.publish(
+            "socket_room_kick", user_id=user_id, room_id=room_id
+        )
+        client_manager.on("socket_room_kick", lambda data: asyncio.get_running_loop().create_task(
+            socketio_handlers.ws_manager.remove_user_from_room(data["user_id"], data["room_id"])
+        ))
+
+        # статус пользователя в каждом процессе считается по своим сокетам, итоговый - лучший из всех
+        presence_registry.on_local_change = lambda user_id, status, last_seen: client_manager.publish(
+            "presence_local", user_id=user_id, status=status,
+            last_seen=last_seen.isoformat() if last_seen else None
+        )
+        presence_registry.on_manual_change = lambda user_id, status: client_manager.publish(
+            "presence_manual", user_id=user_id, status=status
+        )
+        client_manager.on("presence_local", lambda data: presence_registry.apply_remote(
+            data["host_id"], data["user_id"], data["status"],
+            datetime.fromisoformat(data["last_seen"]) if data["last_seen"] else None
+        ))
+        client_manager.on("presence_manual", lambda data: presence_registry.apply_manual(data["user_id"], data["status"]))
+        # процесс, который перестал подавать признаки жизни (упал, перезапущен), перестаёт учитываться
+        presence_registry.host_id = client_manager.host_id
+        presence_registry.on_heartbeat = lambda: client_manager.publish("presence_heartbeat")
+        client_manager.on("presence_heartbeat", lambda data: presence_registry.host_alive(data["host_id"]))
+
+@app.on_event("shutdown")
+async def shutdown():
+    from utils.activity_buffer import activity_buffer
+    from utils.outbox_worker import outbox_worker
+    from utils.message_ingest import message_ingest
+    from utils.presence import presence
+    from utils.presence_registry import presence_registry
+    # записываем накопленную активность и сообщения до закрытия соединений
+    await activity_buffer.stop()
+    await message_ingest.stop()
+    await outbox_worker.stop()
+    await presence_registry.stop()
+    await presence.stop()
+    from utils.image_pipeline import stop_image_pool
+    from utils.asset_gc import asset_collector
+    await asset_collector.stop()
+    stop_image_pool()
+    if client_manager is not None:
+        await client_manager.close()
+    # закрываем пул соединений асинхронного движка
+    await async_engine.dispose()
+
 # сохраняем глобальный инстанс Socket.IO
 from utils.socketio_instance import set_sio
 set_sio(sio)
@@ -106,4 +257,11 @@ register_socketio_handlers(sio)
 app_with_socketio = socketio.ASGIApp(sio, app)
 
 if __name__ == "__main__":
-    uvicorn.run(app_with_socketio, host="0.0.0.0", port=8080)
\ No newline at end of file
+    if WEB_CONCURRENCY > 1:
+        if "polling" in SOCKETIO_TRANSPORTS:
+            print("[Startup] WARNING: long-polling with several workers needs sticky routing "
+                  "in front of them; set SOCKETIO_TRANSPORTS=websocket otherwise")
+        # несколько процессов: uvicorn импортирует приложение в каждом воркере сам
+        uvicorn.run("main:app_with_socketio", host="0.0.0.0", port=8080, workers=WEB_CONCURRENCY)
+    else:
+        uvicorn.run(app_with_socketio, host="0.0.0.0", port=8080)
\ No newline at end of file
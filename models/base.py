@@ -1,8 +1,11 @@
-from sqlalchemy import create_engine, Column, String, Boolean, DateTime, ForeignKey, Integer, BigInteger, Text, JSON, Index
+from sqlalchemy import create_engine, Column, String, Boolean, DateTime, ForeignKey, Integer, BigInteger, Text, JSON, Index, Computed
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates, deferred
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.sql import func
+from models.permissions import compile_permissions
 import bcrypt
 from datetime import datetime, timezone
 from dotenv import load_dotenv
@@ -13,8 +16,27 @@ load_dotenv()
 # строка подключения к бд
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/chat_app")
 
+
+def make_async_url(url: str) -> str:
+    """Преобразует строку подключения psycopg2 в строку для asyncpg"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            url = "postgresql+asyncpg://" + url[len(prefix):]
+            break
+    # asyncpg не понимает sslmode, у него параметр называется ssl
+    return url.replace("sslmode=", "ssl=")
+
+# асинхронная строка подключения (можно переопределить отдельно)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", make_async_url(DATABASE_URL))
+
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# асинхронный движок для async-эндпоинтов и обработчиков Socket.IO:
+# запросы не блокируют event loop, пока ждут ответа Postgres
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # хеширование паролей через bcrypt напрямую
@@ -39,6 +61,7 @@ class User(Base):
     email = Column(String(255), unique=True, index=True)
     password_hash = Column(String(255))
     avatar_url = Column(String(500))
+    avatar_variants = Column(JSON)  # URL по размерам: {"64": url, "64.webp": url, "128": url, ..., "400": url}
     status = Column(String(10), default="offline")
     is_bot = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -46,6 +69,7 @@ class User(Base):
 
     bio = Column(Text)  # о себе
     profile_background_url = Column(String(500)) # фон профиля
+    profile_background_variants = Column(JSON)  # URL по размерам: {"600": url, "600.webp": url, "1200": url, ...}
     display_name = Column(String(100))  # отображаемое имя (может отличаться от nickname)
 
     # user_roles = relationship("UserRole", back_populates="user")
@@ -77,12 +101,20 @@ class Chat(Base):
     avatar_url = Column(String(500))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+# конфигурация полнотекстового поиска: без стемминга, одинаково работает для русского и английского
+MESSAGE_SEARCH_CONFIG = "simple"
+
 class Message(Base):
     __tablename__ = "messages"
     id = Column(BigInteger, primary_key=True, index=True, autoincrement=True)
     chat_id = Column(BigInteger, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False, index=True)
     user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False, index=True)
-    content = Column(Text, index=True)
+    content = Column(Text)
+    # вычисляется самой БД из content, в ORM не загружается
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{MESSAGE_SEARCH_CONFIG}', coalesce(content, ''))", persisted=True)
+    ))
     type = Column(String(20), default="text")
     attachment_id = Column(BigInteger, ForeignKey("attachments.id"))
     is_deleted = Column(Boolean, default=False)
@@ -91,7 +123,44 @@ class Message(Base):
     user = relationship("User", foreign_keys=[user_id], lazy="joined")
     attachment = relationship("Attachment", foreign_keys=[attachment_id], lazy="joined")
 
-    __table_args__ = (Index('ix_messages_chat_created_at', 'chat_id', 'created_at'),)
+    __table_args__ = (
+        Index('ix_messages_chat_created_at', 'chat_id', 'created_at'),
+        Index('ix_messages_chat_id_id', 'chat_id', 'id'),  # курсорная пагинация (before_id / after_id / around_id)
+        Index('ix_messages_search_vector', 'search_vector', postgresql_using='gin'),  # полнотекстовый поиск
+    )
+
+class MessageOutbox(Base):
+    """
+    Transactional outbox: побочные эффекты сообщения (упоминания, уведомления, рассылка)
+
+    Запись добавляется в той же транзакции, что и сообщение, и удаляется
+    фоновым обработчиком (utils/outbox_worker.py) после успешной обработки
+    """
+    __tablename__ = "message_outbox"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    message_id = Column(BigInteger, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
+    event_type = Column(String(50), nullable=False)  # message_created
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class SocketIOPayload(Base):
+    """
+    Большие сообщения Socket.IO между процессами (не помещаются в NOTIFY)
+
+    Нужна только при запуске нескольких процессов (utils/pg_manager.py); записи живут около минуты
+    """
+    __tablename__ = "socketio_payloads"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    data = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class RoomEventCounter(Base):
+    """Номер последнего события комнаты Socket.IO (при нескольких процессах, см. utils/room_events.py)"""
+    __tablename__ = "room_event_counters"
+    room_id = Column(String(100), primary_key=True)
+    seq = Column(BigInteger, nullable=False, default=0)
 
 class Attachment(Base):
     __tablename__ = "attachments"
@@ -101,7 +170,37 @@ class Attachment(Base):
     file_type = Column(String(50))
     file_size = Column(BigInteger)
     file_name = Column(String(255))
+    variants = Column(JSON)  # уменьшенные копии изображения: {"thumb": url, "thumb.webp": url}
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
+    # общий загруженный файл (дедупликация по содержимому), None - загружен до дедупликации
+    asset_id = Column(BigInteger, ForeignKey("stored_assets.id", ondelete="SET NULL"), index=True)
+
+class StoredAsset(Base):
+    """
+    Файл в хранилище, общий для всех вложений с одинаковым содержимым
+
+    Ключ - хеш BLAKE2b содержимого и папка (тип вложения). Повторная загрузка того же файла
+    не идёт в хранилище, а получает URL и метаданные отсюда. refcount - число вложений,
+    которые ссылаются на файл; файлы без ссылок удаляет utils/asset_gc.py
+    """
+    __tablename__ = "stored_assets"
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    content_hash = Column(String(64), nullable=False)  # BLAKE2b-256, hex
+    kind = Column(String(50), nullable=False)  # chat_images, chat_audio, chat_documents
+    storage = Column(String(20), nullable=False)  # cloudinary, supabase, local
+    url = Column(String(500), nullable=False)
+    public_id = Column(String(500))
+    resource_type = Column(String(20))
+    size = Column(BigInteger)
+    info = Column(JSON)  # width, height, format, duration, variants и файлы копий
+    refcount = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ux_stored_assets_hash_kind", "content_hash", "kind", unique=True),
+        Index("ix_stored_assets_refcount_used", "refcount", "last_used_at"),  # кандидаты на удаление
+    )
 
 class Reaction(Base):
     __tablename__ = "reactions"
@@ -117,20 +216,36 @@ class Reaction(Base):
     message = relationship("Message", lazy="joined")
 
     __table_args__ = (
-        Index("ux_reactions_message_user_reaction", "message_id", "user_id", "reaction", unique=True),
+        Index("ux_reactions_message_user", "message_id", "user_id", unique=True),  # одна реакция пользователя на сообщение
+        Index('ix_reactions_message_reaction_id', 'message_id', 'reaction', 'id'),  # списки пользователей по реакции
     )
 
+class ReactionCount(Base):
+    """Счётчик реакций сообщения; обновляется вместе с reactions (см. ReactionRepository)"""
+    __tablename__ = "reaction_counts"
+
+    message_id = Column(BigInteger, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
+    reaction = Column(String(10), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 class Role(Base):
     __tablename__ = "roles"
     id = Column(BigInteger, primary_key=True, index=True, autoincrement=True)
     space_id = Column(BigInteger, ForeignKey("spaces.id", ondelete="CASCADE"), nullable=False, index=True)
     name = Column(String(50), nullable=False)
     permissions = Column(JSON)  # список разрешений
+    permissions_mask = Column(BigInteger, nullable=True)  # те же разрешения битовой маской (см. models/permissions.py)
     color = Column(String(7))
     priority = Column(Integer, default=10)  # выше = больше прав
     is_system = Column(Boolean, default=False)  # системную роль нельзя удалить
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    @validates("permissions")
+    def _compile_permissions_mask(self, key, permissions):
+        """Маска пересчитывается при каждом присваивании списка разрешений"""
+        self.permissions_mask = compile_permissions(permissions)
+        return permissions
+
 class Space(Base):
     __tablename__ = "spaces"
     id = Column(BigInteger, primary_key=True, index=True, autoincrement=True)
@@ -180,7 +295,8 @@ class Mention(Base):
     message_id = Column(BigInteger, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False, index=True)
     mentioned_user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    __table_args__ = (Index('ix_mentions_message_user', 'message_id', 'mentioned_user_id'),)
+    # уникальный: повторные упоминания отбрасываются через ON CONFLICT
+    __table_args__ = (Index('ix_mentions_message_user', 'message_id', 'mentioned_user_id', unique=True),)
 
 class StickerPack(Base):
     __tablename__ = "sticker_packs"
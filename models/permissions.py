@@ -168,6 +168,33 @@ class RoleHierarchy:
         return moderator_level > target_level
 
 
+# бит каждого разрешения в маске роли (Role.permissions_mask)
+# ВАЖНО: новые разрешения добавлять только в конец Permission.ALL, иначе сохранённые маски сдвинутся
+PERMISSION_BITS = {permission: 1 << index for index, permission in enumerate(Permission.ALL)}
+
+# маска со всеми разрешениями (для владельца пространства)
+ALL_PERMISSIONS_MASK = sum(PERMISSION_BITS.values())
+
+
+def compile_permissions(permissions: list) -> int:
+    """Свернуть список разрешений в битовую маску (неизвестные разрешения пропускаются)"""
+    mask = 0
+    for permission in permissions or []:
+        mask |= PERMISSION_BITS.get(permission, 0)
+    return mask
+
+
+def decompile_permissions(mask: int) -> list:
+    """Развернуть битовую маску обратно в список разрешений"""
+    return [permission for permission, bit in PERMISSION_BITS.items() if mask & bit]
+
+
+def has_permission_mask(mask: int, required_permission: str) -> bool:
+    """Проверить наличие разрешения в битовой маске"""
+    bit = PERMISSION_BITS.get(required_permission)
+    return bool(bit) and (mask & bit) == bit
+
+
 def has_permission(user_permissions: list, required_permission: str) -> bool:
     """Проверить наличие разрешения у пользователя"""
     return required_permission in user_permissions
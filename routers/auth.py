@@ -6,7 +6,7 @@ from sqlalchemy.orm import Session
 from schemas.user import UserCreate, UserOut, Token
 from models.base import User, SessionLocal, get_password_hash, verify_password
 from crud.user import UserRepository
-from utils.auth import create_access_token, get_db, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
+from utils.auth import create_access_token, get_db, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, get_current_principal, Principal
 
 router = APIRouter()
 
@@ -59,9 +59,9 @@ async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 @router.get("/check-user")
-async def check_user(
+def check_user(
     identifier: str,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Проверить существование пользователя по никнейму или ID"""
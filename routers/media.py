@@ -0,0 +1,41 @@
+import os
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from utils.storage_backends import get_storage, EXTENSION_CONTENT_TYPES
+
+router = APIRouter()
+
+# имена файлов не переиспользуются - браузер и CDN могут не перепроверять файл
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/{path:path}")
+async def get_media(path: str):
+    """
+    Отдать файл локального хранилища (STORAGE = local)
+
+    - поддерживаются Range-запросы (перемотка аудио, докачка), ETag и Last-Modified
+    - изображения и аудио отдаются для просмотра, остальное - только для скачивания (nosniff)
+    - файл отдаётся с диска без чтения в память; под сервером с расширением
+      http.response.pathsend (например, Granian) - системным вызовом sendfile
+    """
+    file_path = get_storage("local").path_for(path)
+    # путь вне MEDIA_ROOT и недописанные файлы не отдаём
+    if file_path is None or file_path.endswith(".part") or not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Файл не найден")
+
+    # тип - по расширению из списка разрешённых, а не по догадке: файлы с другим
+    # расширением (например, сохранённые до проверки типа) отдаются как octet-stream
+    media_type = EXTENSION_CONTENT_TYPES.get(os.path.splitext(file_path)[1].lower(), "application/octet-stream")
+    headers = {"Cache-Control": MEDIA_CACHE_CONTROL, "X-Content-Type-Options": "nosniff"}
+    if media_type.startswith(("image/", "audio/")):
+        return FileResponse(file_path, media_type=media_type, headers=headers)
+    # документы только скачиваются: браузер не откроет их на домене API
+    return FileResponse(
+        file_path,
+        media_type=media_type,
+        headers=headers,
+        filename=os.path.basename(file_path),
+        content_disposition_type="attachment"
+    )
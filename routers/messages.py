@@ -1,74 +1,84 @@
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query, status, UploadFile, File
-from typing import List
+from typing import List, Optional
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import json
 
-from schemas.message import MessageCreate, MessageOut, MessageUpdate
-from utils.auth import get_current_user, get_db
+from schemas.message import MessageCreate, MessageOut, MessageUpdate, MessageSearchOut
+from utils.auth import get_current_principal, Principal, get_db, get_async_db
+from utils.chat_access import ChatAccess, get_chat_access, resolve_chat_access
 from utils.file_upload import FileUploader
+from utils.message_cache import message_cache, serialize_message
 from utils.socketio_instance import get_sio
-from models.base import User, ChatParticipant
-from crud.message import MessageRepository
+from utils.room_events import emit_room_event
+from crud.base import AsyncRepository
+from crud.message import MessageRepository, decode_search_cursor
 from crud.reaction import ReactionRepository
 
 router = APIRouter()
 
+
+def _parse_search_cursor(cursor: Optional[str]):
+    if cursor is None:
+        return None
+    try:
+        return decode_search_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+
 # FastAPI WebSocket код удалён - используем Socket.IO
 # См. utils/socketio_handlers.py для realtime функциональности
 
 @router.get("/message/{message_id}")
-def get_message_info(
+async def get_message_info(
     message_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получить информацию о конкретном сообщении (chat_id и space_id)"""
-    message_repo = MessageRepository(db)
-    message = message_repo.get_by_id(message_id)
+    message_repo = AsyncRepository(MessageRepository, db)
+    message = await message_repo.get_by_id(message_id)
 
     if not message:
         raise HTTPException(status_code=404, detail="Сообщение не найдено")
 
-    # Проверка что пользователь - участник чата
-    participant = db.query(ChatParticipant).filter(
-        ChatParticipant.chat_id == message.chat_id,
-        ChatParticipant.user_id == current_user.id,
-        ChatParticipant.is_active == True
-    ).first()
-
-    if not participant:
-        raise HTTPException(status_code=403, detail="У вас нет доступа к этому сообщению")
-
-    # Получаем информацию о чате
-    from models.base import Chat
-    chat = db.query(Chat).filter(Chat.id == message.chat_id).first()
+    # Проверка что пользователь - участник чата (чат и участие - одним запросом)
+    access = await resolve_chat_access(db, current_user.id, message.chat_id)
+    access.require_member("У вас нет доступа к этому сообщению")
 
     return {
         "message_id": message.id,
         "chat_id": message.chat_id,
-        "space_id": chat.space_id if chat else None,
+        "space_id": access.space_id,
         "content": message.content
     }
 
+@router.get("/search", response_model=List[MessageSearchOut])
+def search_all_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """Поиск сообщений во всех чатах, где пользователь участник"""
+    message_repo = MessageRepository(db)
+    return message_repo.search(q, user_id=current_user.id, limit=limit, cursor=_parse_search_cursor(cursor))
+
 @router.post("/{chat_id}", response_model=MessageOut)
 def send_message(
     chat_id: int, 
     message: MessageCreate, 
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
     db: Session = Depends(get_db)
 ):
     """Отправить сообщение в чат"""
     message_repo = MessageRepository(db)
     
-    # проверка что пользователь - участник чата
-    participant = db.query(ChatParticipant).filter(
-        ChatParticipant.chat_id == chat_id, 
-        ChatParticipant.user_id == current_user.id, 
-        ChatParticipant.is_active == True
-    ).first()
-    
-    if not participant:
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
+    # проверка что пользователь - участник чата и не забанен
+    access.require_member()
+    access.require_not_banned("Вы забанены и не можете отправлять сообщения")
     
     # создание сообщения
     new_message = message_repo.create(
@@ -78,6 +88,7 @@ def send_message(
         message.type, 
         message.attachment_id if hasattr(message, 'attachment_id') else None
     )
+    message_cache.add_message(chat_id, serialize_message(new_message))
     
     return new_message
 
@@ -86,82 +97,68 @@ async def add_reaction(
     chat_id: int,
     message_id: int,
     reaction: str = Query(..., min_length=1, max_length=10),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Добавить реакцию на сообщение"""
-    from crud.ban import BanRepository
-    from models.base import Chat
+    reaction_repo = AsyncRepository(ReactionRepository, db)
 
-    reaction_repo = ReactionRepository(db)
-    message_repo = MessageRepository(db)
-    ban_repo = BanRepository(db)
+    # проверка участника и бана (уже собраны в access)
+    access.require_member()
+    access.require_not_banned("Вы забанены и не можете добавлять реакции")
 
-    # проверка что сообщение существует и в правильном чате
-    message = message_repo.get_by_id(message_id)
-    if not message or message.chat_id != chat_id:
+    # toggle, счётчики, сводка и реакция пользователя - один запрос;
+    # заодно проверяется, что сообщение существует и находится в этом чате
+    found, my_reaction, deltas, all_reactions = await reaction_repo.toggle_reaction(
+        message_id, current_user.id, reaction, chat_id=chat_id
+    )
+    if not found:
         raise HTTPException(status_code=404, detail="Сообщение не найдено")
 
-    # проверка участника
-    participant = db.query(ChatParticipant).filter(
-        ChatParticipant.chat_id == chat_id,
-        ChatParticipant.user_id == current_user.id,
-        ChatParticipant.is_active == True
-    ).first()
+    message_cache.apply_reaction_deltas(chat_id, message_id, deltas)
 
-    if not participant:
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
-
-    # Проверка бана
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
-    if chat and chat.space_id:
-        if ban_repo.is_active(current_user.id, chat.space_id):
-            raise HTTPException(status_code=403, detail="Вы забанены и не можете добавлять реакции")
-
-    # добавляем реакцию (toggle)
-    result = reaction_repo.add_reaction(message_id, current_user.id, reaction)
-
-    # получаем обновлённые реакции
-    all_reactions = reaction_repo.get_message_reactions(message_id)
-
-    # получаем текущую реакцию пользователя
-    my_reaction = reaction_repo.get_user_reaction(message_id, current_user.id)
-
-    # Отправка уведомления через Socket.IO
+    # В комнату уходят только счётчики, без списков пользователей: новая сводка reactions
+    # (клиент её просто подставляет - повторная доставка события ничего не портит) и deltas (+1 / -1)
     sio = get_sio()
-    if sio:
-        await sio.emit('reaction_updated', {
+    if sio and deltas:
+        await emit_room_event(sio, 'reaction_updated', {
             'message_id': message_id,
             'chat_id': chat_id,
             'room_id': str(chat_id),
+            'user_id': current_user.id,
             'reactions': all_reactions,
-            'user_id': current_user.id
-        }, room=str(chat_id))
+            'deltas': deltas
+        }, chat_id)
 
     return {
         "message_id": message_id,
         "reactions": all_reactions,
-        "my_reaction": my_reaction
+        "my_reaction": my_reaction,
+        "deltas": deltas
     }
 
 @router.get("/{chat_id}/{message_id}/reactions")
 async def get_reactions(
     chat_id: int,
     message_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Получить все реакции на сообщение"""
-    reaction_repo = ReactionRepository(db)
-    message_repo = MessageRepository(db)
+    reaction_repo = AsyncRepository(ReactionRepository, db)
+    message_repo = AsyncRepository(MessageRepository, db)
+
+    access.require_member()
     
     # проверка сообщения
-    message = message_repo.get_by_id(message_id)
+    message = await message_repo.get_by_id(message_id)
     if not message or message.chat_id != chat_id:
         raise HTTPException(status_code=404, detail="Сообщение не найдено")
     
-    reactions = reaction_repo.get_message_reactions(message_id)
-    my_reaction = reaction_repo.get_user_reaction(message_id, current_user.id)
+    reactions = await reaction_repo.get_message_reactions(message_id)
+    my_reaction = await reaction_repo.get_user_reaction(message_id, current_user.id)
     
     return {
         "message_id": message_id,
@@ -169,29 +166,89 @@ async def get_reactions(
         "my_reaction": my_reaction
     }
 
+@router.get("/{chat_id}/{message_id}/reactions/users")
+async def get_reaction_users(
+    chat_id: int,
+    message_id: int,
+    reaction: str = Query(..., min_length=1, max_length=10),
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[int] = Query(None, ge=1),
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Пользователи, поставившие реакцию (постранично)
+
+    Для следующей страницы передайте next_cursor из ответа
+    """
+    reaction_repo = AsyncRepository(ReactionRepository, db)
+    message_repo = AsyncRepository(MessageRepository, db)
+
+    access.require_member()
+
+    message = await message_repo.get_by_id(message_id)
+    if not message or message.chat_id != chat_id:
+        raise HTTPException(status_code=404, detail="Сообщение не найдено")
+
+    users, next_cursor = await reaction_repo.get_reaction_users(message_id, reaction, limit, cursor)
+
+    return {
+        "message_id": message_id,
+        "reaction": reaction,
+        "users": users,
+        "next_cursor": next_cursor
+    }
+
 @router.get("/{chat_id}", response_model=List[MessageOut])
 def get_messages(
     chat_id: int, 
     limit: int = Query(50, ge=1, le=100), 
     offset: int = Query(0, ge=0), 
-    current_user: User = Depends(get_current_user),
+    before_id: Optional[int] = Query(None, ge=1),
+    after_id: Optional[int] = Query(None, ge=0),
+    around_id: Optional[int] = Query(None, ge=1),
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
     db: Session = Depends(get_db)
 ):
-    """Получить сообщения из чата (оптимизировано)"""
+    """
+    Получить сообщения из чата (оптимизировано)
+
+    - before_id: сообщения старше указанного (подгрузка истории)
+    - after_id: сообщения новее указанного
+    - around_id: сообщения вокруг указанного (переход к сообщению)
+    Можно указать только один курсор; без курсора возвращаются последние сообщения
+    """
     message_repo = MessageRepository(db)
     reaction_repo = ReactionRepository(db)
 
     # проверка что пользователь - участник чата
-    participant = db.query(ChatParticipant).filter(
-        ChatParticipant.chat_id == chat_id,
-        ChatParticipant.user_id == current_user.id,
-        ChatParticipant.is_active == True
-    ).first()
-
-    if not participant:
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
-
-    messages = message_repo.get_by_chat(chat_id, limit, offset)
+    access.require_member()
+
+    cursors = [c for c in (before_id, after_id, around_id) if c is not None]
+    if len(cursors) > 1:
+        raise HTTPException(status_code=400, detail="Укажите только один из параметров: before_id, after_id, around_id")
+
+    # Последняя страница активного чата отдаётся из памяти
+    latest_page = not cursors and offset == 0
+    if latest_page:
+        cached = message_cache.get_latest(chat_id, limit)
+        if cached is not None:
+            # реакции текущего пользователя - один запрос по индексу
+            my_reactions = reaction_repo.get_user_reactions([m["id"] for m in cached], current_user.id)
+            for item in cached:
+                item["my_reaction"] = my_reactions.get(item["id"])
+            return cached
+        # промах: читаем сразу всё окно кеша, чтобы следующие запросы попали в память;
+        # version - до чтения: fill пропустит окно, если сообщения чата изменятся раньше
+        cache_version = message_cache.version()
+        messages = message_repo.get_by_chat(chat_id, message_cache.max_messages)
+    else:
+        messages = message_repo.get_by_chat(
+            chat_id, limit, offset,
+            before_id=before_id, after_id=after_id, around_id=around_id
+        )
 
     # ОПТИМИЗАЦИЯ: Получаем все реакции одним запросом
     message_ids = [msg.id for msg in messages]
@@ -202,31 +259,39 @@ def get_messages(
         msg.reactions = all_reactions.get(msg.id, [])
         msg.my_reaction = my_reactions.get(msg.id)
 
+    if latest_page:
+        message_cache.fill(
+            chat_id,
+            [serialize_message(msg, msg.reactions) for msg in messages],
+            complete=len(messages) < message_cache.max_messages,
+            since=cache_version
+        )
+        return messages[-limit:]
+
     return messages
 
-@router.get("/{chat_id}/search", response_model=List[MessageOut])
+@router.get("/{chat_id}/search", response_model=List[MessageSearchOut])
 def search_messages(
     chat_id: int, 
-    q: str = Query(..., min_length=1), 
+    q: str = Query(..., min_length=1, max_length=200), 
     limit: int = Query(50, ge=1, le=100), 
-    offset: int = Query(0, ge=0), 
-    current_user: User = Depends(get_current_user),
+    cursor: Optional[str] = Query(None),
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
     db: Session = Depends(get_db)
 ):
-    """Поиск сообщений в чате"""
+    """
+    Поиск сообщений в чате
+
+    Результаты отсортированы по релевантности. Для следующей страницы
+    передайте cursor последнего результата
+    """
     message_repo = MessageRepository(db)
     
     # проверка что пользователь - участник чата
-    participant = db.query(ChatParticipant).filter(
-        ChatParticipant.chat_id == chat_id, 
-        ChatParticipant.user_id == current_user.id, 
-        ChatParticipant.is_active == True
-    ).first()
+    access.require_member()
     
-    if not participant:
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
-    
-    messages = message_repo.search_by_chat(chat_id, q, limit, offset)
+    messages = message_repo.search(q, chat_id=chat_id, limit=limit, cursor=_parse_search_cursor(cursor))
     return messages
 
 @router.patch("/{chat_id}/{message_id}", response_model=MessageOut)
@@ -234,7 +299,7 @@ def update_message(
     chat_id: int, 
     message_id: int, 
     update_data: MessageUpdate, 
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Редактировать сообщение"""
@@ -247,6 +312,7 @@ def update_message(
     updated_message = message_repo.update(message_id, update_data.content, current_user.id)
     if not updated_message:
         raise HTTPException(status_code=400, detail="Не удалось обновить сообщение")
+    message_cache.update_message(chat_id, message_id, content=updated_message.content)
     
     return updated_message
 
@@ -254,16 +320,14 @@ def update_message(
 def delete_message(
     chat_id: int,
     message_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
     db: Session = Depends(get_db)
 ):
     """Удалить сообщение"""
-    from models.base import Chat, Space
     from models.permissions import Permission
-    from crud.role import RoleRepository
 
     message_repo = MessageRepository(db)
-    role_repo = RoleRepository(db)
 
     # Проверяем существование сообщения
     message = message_repo.get_by_id(message_id)
@@ -275,22 +339,13 @@ def delete_message(
 
     # Если не автор, проверяем права на удаление чужих сообщений
     if not is_author:
-        # Получаем chat и проверяем type
-        chat = db.query(Chat).filter(Chat.id == chat_id).first()
-        if not chat:
+        if not access.chat_exists:
             raise HTTPException(status_code=404, detail="Чат не найден")
 
         # Если это групповой чат (space)
-        if chat.type == "group" and chat.space_id:
-            space = db.query(Space).filter(Space.id == chat.space_id).first()
-
+        if access.chat_type == "group" and access.space_id:
             # Проверяем: админ пространства или есть право DELETE_ANY_MESSAGES
-            can_delete = (
-                (space and space.admin_id == current_user.id) or
-                role_repo.check_permission(current_user.id, chat.space_id, Permission.DELETE_ANY_MESSAGES)
-            )
-
-            if not can_delete:
+            if not access.has(Permission.DELETE_ANY_MESSAGES):
                 raise HTTPException(status_code=403, detail="У вас нет прав на удаление чужих сообщений")
         else:
             # В приватных чатах можно удалять только свои сообщения
@@ -300,6 +355,7 @@ def delete_message(
     deleted_message = message_repo.delete(message_id, current_user.id, force=not is_author)
     if not deleted_message:
         raise HTTPException(status_code=400, detail="Не удалось удалить сообщение")
+    message_cache.remove_message(chat_id, message_id)
 
     return {"message": "Сообщение удалено"}
 
@@ -307,37 +363,22 @@ def delete_message(
 async def send_image(
     chat_id: int,
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Отправить изображение"""
-    from crud.ban import BanRepository
-    from models.base import Chat
+    message_repo = AsyncRepository(MessageRepository, db)
 
-    message_repo = MessageRepository(db)
-    ban_repo = BanRepository(db)
-
-    # проверка участника
-    participant = db.query(ChatParticipant).filter(
-        ChatParticipant.chat_id == chat_id,
-        ChatParticipant.user_id == current_user.id,
-        ChatParticipant.is_active == True
-    ).first()
-
-    if not participant:
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
-
-    # Проверка бана
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
-    if chat and chat.space_id:
-        if ban_repo.is_active(current_user.id, chat.space_id):
-            raise HTTPException(status_code=403, detail="Вы забанены и не можете отправлять файлы")
+    # проверка участника и бана
+    access.require_member()
+    access.require_not_banned("Вы забанены и не можете отправлять файлы")
 
     # загрузка файла
     file_info = await FileUploader.upload_image(file)
 
     # создание сообщения
-    new_message = message_repo.create_with_attachment(
+    new_message = await message_repo.create_with_attachment(
         chat_id,
         current_user.id,
         f"📷 {file.filename}",
@@ -345,6 +386,8 @@ async def send_image(
         file_info
     )
 
+    message_cache.add_message(chat_id, serialize_message(new_message))
+
     # Отправка уведомления через Socket.IO
     sio = get_sio()
     if sio:
@@ -352,7 +395,8 @@ async def send_image(
             'id': new_message.attachment.id,
             'file_url': new_message.attachment.file_url,
             'file_type': new_message.attachment.file_type,
-            'file_size': new_message.attachment.file_size
+            'file_size': new_message.attachment.file_size,
+            'variants': new_message.attachment.variants
         }
 
         message_data = {
@@ -373,7 +417,7 @@ async def send_image(
             'my_reaction': None
         }
 
-        await sio.emit('new_message', message_data, room=str(chat_id))
+        await emit_room_event(sio, 'new_message', message_data, chat_id)
 
     return new_message
 
@@ -381,34 +425,20 @@ async def send_image(
 async def send_audio(
     chat_id: int,
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Отправить аудио"""
-    from crud.ban import BanRepository
-    from models.base import Chat
-
-    message_repo = MessageRepository(db)
-    ban_repo = BanRepository(db)
+    message_repo = AsyncRepository(MessageRepository, db)
 
-    participant = db.query(ChatParticipant).filter(
-        ChatParticipant.chat_id == chat_id,
-        ChatParticipant.user_id == current_user.id,
-        ChatParticipant.is_active == True
-    ).first()
-
-    if not participant:
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
-
-    # Проверка бана
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
-    if chat and chat.space_id:
-        if ban_repo.is_active(current_user.id, chat.space_id):
-            raise HTTPException(status_code=403, detail="Вы забанены и не можете отправлять файлы")
+    # проверка участника и бана
+    access.require_member()
+    access.require_not_banned("Вы забанены и не можете отправлять файлы")
 
     file_info = await FileUploader.upload_audio(file)
 
-    new_message = message_repo.create_with_attachment(
+    new_message = await message_repo.create_with_attachment(
         chat_id,
         current_user.id,
         f"🎵 {file.filename}",
@@ -416,6 +446,8 @@ async def send_audio(
         file_info
     )
 
+    message_cache.add_message(chat_id, serialize_message(new_message))
+
     # Отправка уведомления через Socket.IO
     sio = get_sio()
     if sio:
@@ -444,7 +476,7 @@ async def send_audio(
             'my_reaction': None
         }
 
-        await sio.emit('new_message', message_data, room=str(chat_id))
+        await emit_room_event(sio, 'new_message', message_data, chat_id)
 
     return new_message
 
@@ -452,34 +484,20 @@ async def send_audio(
 async def send_document(
     chat_id: int,
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    access: ChatAccess = Depends(get_chat_access),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Отправить документ"""
-    from crud.ban import BanRepository
-    from models.base import Chat
+    message_repo = AsyncRepository(MessageRepository, db)
 
-    message_repo = MessageRepository(db)
-    ban_repo = BanRepository(db)
-
-    participant = db.query(ChatParticipant).filter(
-        ChatParticipant.chat_id == chat_id,
-        ChatParticipant.user_id == current_user.id,
-        ChatParticipant.is_active == True
-    ).first()
-
-    if not participant:
-        raise HTTPException(status_code=403, detail="Вы не участник этого чата")
-
-    # Проверка бана
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
-    if chat and chat.space_id:
-        if ban_repo.is_active(current_user.id, chat.space_id):
-            raise HTTPException(status_code=403, detail="Вы забанены и не можете отправлять файлы")
+    # проверка участника и бана
+    access.require_member()
+    access.require_not_banned("Вы забанены и не можете отправлять файлы")
 
     file_info = await FileUploader.upload_document(file)
 
-    new_message = message_repo.create_with_attachment(
+    new_message = await message_repo.create_with_attachment(
         chat_id,
         current_user.id,
         f"📄 {file.filename}",
@@ -487,6 +505,8 @@ async def send_document(
         file_info
     )
 
+    message_cache.add_message(chat_id, serialize_message(new_message))
+
     # Отправка уведомления через Socket.IO
     sio = get_sio()
     if sio:
@@ -515,6 +535,6 @@ async def send_document(
             'my_reaction': None
         }
 
-        await sio.emit('new_message', message_data, room=str(chat_id))
+        await emit_room_event(sio, 'new_message', message_data, chat_id)
 
     return new_message
\ No newline at end of file
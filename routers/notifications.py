@@ -2,17 +2,16 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
 
-from utils.auth import get_current_user, get_db
-from models.base import User
+from utils.auth import get_current_principal, Principal, get_db
 from crud.notification import NotificationRepository
 
 router = APIRouter()
 
 @router.get("/")
-async def get_notifications(
+def get_notifications(
     unread_only: bool = False,
     limit: int = 50,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить уведомления"""
@@ -36,8 +35,8 @@ async def get_notifications(
     } for n in notifications]
 
 @router.get("/unread-count")
-async def get_unread_count(
-    current_user: User = Depends(get_current_user),
+def get_unread_count(
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить количество непрочитанных уведомлений"""
@@ -47,9 +46,9 @@ async def get_unread_count(
     return {"unread_count": count}
 
 @router.post("/{notification_id}/read")
-async def mark_notification_read(
+def mark_notification_read(
     notification_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Пометить уведомление как прочитанное"""
@@ -62,8 +61,8 @@ async def mark_notification_read(
     return {"message": "Уведомление помечено как прочитанное"}
 
 @router.post("/mark-all-read")
-async def mark_all_read(
-    current_user: User = Depends(get_current_user),
+def mark_all_read(
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Пометить все уведомления как прочитанные"""
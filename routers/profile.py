@@ -1,17 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Query
+from fastapi.responses import RedirectResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import bcrypt
 
 from schemas.profile import ProfileUpdate, ProfileOut, MyProfileOut
-from utils.auth import get_current_user, get_db
-from utils.storage import upload_image_to_storage, delete_image_from_storage
+from utils.auth import get_current_user, get_current_principal, Principal, get_db, get_async_db, invalidate_principal
+from utils.storage import upload_image_to_storage, delete_images_from_storage
+from utils.image_pipeline import pick_variant, ImageError, AVATAR_RENDITIONS, BANNER_RENDITIONS
+from utils.cache import TTLCache
 from models.base import User
 
 router = APIRouter()
 
+# URL аватаров и баннеров для /{user_id}/avatar и /{user_id}/banner (между процессами - не дольше TTL)
+PROFILE_IMAGE_CACHE_TTL = 60
+_profile_images = TTLCache(maxsize=20000, ttl=PROFILE_IMAGE_CACHE_TTL, name="profile_images")
+
+
+async def _get_profile_images(db: AsyncSession, user_id: int):
+    """(avatar_url, avatar_variants, profile_background_url, profile_background_variants) пользователя"""
+    images = _profile_images.get(user_id)
+    if images is None:
+        row = (await db.execute(
+            select(User.avatar_url, User.avatar_variants, User.profile_background_url, User.profile_background_variants)
+            .where(User.id == user_id)
+        )).first()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        images = tuple(row)
+        _profile_images.set(user_id, images)
+    return images
+
+
+def _image_redirect(url: str, variants, size: str, accept: str) -> RedirectResponse:
+    """Перенаправить на размер в самом лёгком формате, который принимает клиент"""
+    target = pick_variant(variants, size, accept) or url
+    return RedirectResponse(target, status_code=307, headers={
+        "Cache-Control": f"public, max-age={PROFILE_IMAGE_CACHE_TTL}",
+        "Vary": "Accept"
+    })
+
 
 @router.get("/me", response_model=MyProfileOut)
-async def get_my_profile(
+def get_my_profile(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -22,7 +55,7 @@ async def get_my_profile(
 
 
 @router.patch("/me", response_model=MyProfileOut)
-async def update_my_profile(
+def update_my_profile(
     profile_data: ProfileUpdate,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -36,25 +69,30 @@ async def update_my_profile(
     if profile_data.bio is not None:
         current_user.bio = profile_data.bio
 
+    # внешний URL задаётся без уменьшенных копий
     if profile_data.avatar_url is not None:
         current_user.avatar_url = profile_data.avatar_url
+        current_user.avatar_variants = None
 
     if profile_data.profile_background_url is not None:
         current_user.profile_background_url = (
             profile_data.profile_background_url
         )
+        current_user.profile_background_variants = None
 
     db.commit()
     db.refresh(current_user)
+    invalidate_principal(current_user.id)
+    _profile_images.pop(current_user.id)
 
     return current_user
 
 
 @router.get("/{user_id}", response_model=ProfileOut)
-async def get_user_profile(
+def get_user_profile(
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Получить профиль пользователя по ID"""
     from crud.activity import ActivityRepository
@@ -78,10 +116,10 @@ async def get_user_profile(
 
 
 @router.get("/nickname/{nickname}", response_model=ProfileOut)
-async def get_user_profile_by_nickname(
+def get_user_profile_by_nickname(
     nickname: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Получить профиль пользователя по никнейму"""
     user = db.query(User).filter(User.nickname == nickname).first()
@@ -95,18 +133,56 @@ async def get_user_profile_by_nickname(
     return user
 
 
+# объявлены после /nickname/{nickname}: /nickname/avatar - это поиск по никнейму
+@router.get("/{user_id}/avatar")
+async def get_avatar(
+    user_id: int,
+    request: Request,
+    size: str = Query("400"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Аватар пользователя нужного размера (64, 128, 400)
+
+    Перенаправляет на WebP / AVIF, если клиент их принимает (заголовок Accept) и они легче JPEG.
+    Можно ставить прямо в <img src> - авторизация не нужна, как и для самих файлов в хранилище
+    """
+    if size not in AVATAR_RENDITIONS:
+        raise HTTPException(status_code=400, detail=f"Размер: {', '.join(AVATAR_RENDITIONS)}")
+    avatar_url, avatar_variants, _, _ = await _get_profile_images(db, user_id)
+    if not avatar_url:
+        raise HTTPException(status_code=404, detail="Аватар не загружен")
+    return _image_redirect(avatar_url, avatar_variants, size, request.headers.get("accept"))
+
+
+@router.get("/{user_id}/banner")
+async def get_banner(
+    user_id: int,
+    request: Request,
+    size: str = Query("1200"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Баннер профиля нужного размера (600, 1200) в самом лёгком формате, который принимает клиент"""
+    if size not in BANNER_RENDITIONS:
+        raise HTTPException(status_code=400, detail=f"Размер: {', '.join(BANNER_RENDITIONS)}")
+    _, _, banner_url, banner_variants = await _get_profile_images(db, user_id)
+    if not banner_url:
+        raise HTTPException(status_code=404, detail="Баннер не загружен")
+    return _image_redirect(banner_url, banner_variants, size, request.headers.get("accept"))
+
+
 @router.post("/upload-avatar", response_model=MyProfileOut)
 async def upload_avatar(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Загрузить аватар пользователя
 
     - Принимает изображение (JPEG, PNG, WebP)
-    - Оптимизирует до 400x400px
-    - Загружает в Supabase Storage
+    - Делает размеры 64, 128 и 400px (avatar_variants)
+    - Загружает в хранилище аватаров
     - Обновляет профиль пользователя
     """
 
@@ -126,45 +202,58 @@ async def upload_avatar(
             detail="Файл слишком большой. Максимум 5MB"
         )
 
-    # Удаляем старый аватар если есть
-    if current_user.avatar_url:
-        await delete_image_from_storage(current_user.avatar_url)
+    user = await db.get(User, current_user.id)
 
-    # Загружаем новый аватар
-    avatar_url = await upload_image_to_storage(
-        user_id=current_user.id,
-        file_bytes=contents,
-        file_type="avatar",
-        content_type=file.content_type
-    )
+    # Загружаем новый аватар (старый удаляется только после успешной загрузки)
+    try:
+        avatar_urls = await upload_image_to_storage(
+            user_id=current_user.id,
+            file_bytes=contents,
+            file_type="avatar",
+            content_type=file.content_type
+        )
+    except ImageError:
+        raise HTTPException(
+            status_code=400,
+            detail="Файл не является изображением или слишком большой по разрешению"
+        )
 
-    if not avatar_url:
+    if not avatar_urls:
         raise HTTPException(
             status_code=500,
             detail="Ошибка загрузки файла"
         )
 
-    # Обновляем профиль
-    current_user.avatar_url = avatar_url
-    db.commit()
-    db.refresh(current_user)
-
-    print(f"✅ Avatar uploaded for user {current_user.id}: {avatar_url}")
-    return current_user
+    # Обновляем профиль: avatar_url - самый большой размер
+    avatar_url = avatar_urls["400"]
+    old_url, old_variants = user.avatar_url, user.avatar_variants
+    user.avatar_url = avatar_url
+    user.avatar_variants = avatar_urls
+    await db.commit()
+    await db.refresh(user)
+    invalidate_principal(user.id)
+    _profile_images.pop(user.id)
+
+    # Удаляем старый аватар со всеми размерами если есть
+    if old_url:
+        await delete_images_from_storage(old_url, old_variants)
+
+    print(f"✅ Avatar uploaded for user {user.id}: {avatar_url}")
+    return user
 
 
 @router.post("/upload-banner", response_model=MyProfileOut)
 async def upload_banner(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Загрузить баннер профиля пользователя
 
     - Принимает изображение (JPEG, PNG, WebP)
-    - Оптимизирует до 1200x400px
-    - Загружает в Supabase Storage
+    - Делает размеры 600x200 и 1200x400px (profile_background_variants)
+    - Загружает в хранилище аватаров
     - Обновляет профиль пользователя
     """
 
@@ -184,35 +273,47 @@ async def upload_banner(
             detail="Файл слишком большой. Максимум 10MB"
         )
 
-    # Удаляем старый баннер если есть
-    if current_user.profile_background_url:
-        await delete_image_from_storage(current_user.profile_background_url)
+    user = await db.get(User, current_user.id)
 
-    # Загружаем новый баннер
-    banner_url = await upload_image_to_storage(
-        user_id=current_user.id,
-        file_bytes=contents,
-        file_type="banner",
-        content_type=file.content_type
-    )
+    # Загружаем новый баннер (старый удаляется только после успешной загрузки)
+    try:
+        banner_urls = await upload_image_to_storage(
+            user_id=current_user.id,
+            file_bytes=contents,
+            file_type="banner",
+            content_type=file.content_type
+        )
+    except ImageError:
+        raise HTTPException(
+            status_code=400,
+            detail="Файл не является изображением или слишком большой по разрешению"
+        )
 
-    if not banner_url:
+    if not banner_urls:
         raise HTTPException(
             status_code=500,
             detail="Ошибка загрузки файла"
         )
 
-    # Обновляем профиль
-    current_user.profile_background_url = banner_url
-    db.commit()
-    db.refresh(current_user)
+    # Обновляем профиль: profile_background_url - самый большой размер
+    banner_url = banner_urls["1200"]
+    old_url, old_variants = user.profile_background_url, user.profile_background_variants
+    user.profile_background_url = banner_url
+    user.profile_background_variants = banner_urls
+    await db.commit()
+    await db.refresh(user)
+    _profile_images.pop(user.id)
 
-    print(f"✅ Banner uploaded for user {current_user.id}: {banner_url}")
-    return current_user
+    # Удаляем старый баннер со всеми размерами если есть
+    if old_url:
+        await delete_images_from_storage(old_url, old_variants)
+
+    print(f"✅ Banner uploaded for user {user.id}: {banner_url}")
+    return user
 
 
 @router.patch("/update-nickname", response_model=MyProfileOut)
-async def update_nickname(
+def update_nickname(
     nickname: str,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -244,12 +345,13 @@ async def update_nickname(
     current_user.nickname = nickname
     db.commit()
     db.refresh(current_user)
+    invalidate_principal(current_user.id)
 
     return current_user
 
 
 @router.patch("/update-email", response_model=MyProfileOut)
-async def update_email(
+def update_email(
     email: str,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -284,7 +386,7 @@ async def update_email(
 
 
 @router.post("/change-password")
-async def change_password(
+def change_password(
     old_password: str,
     new_password: str,
     current_user: User = Depends(get_current_user),
@@ -3,8 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 from pydantic import BaseModel
 
-from utils.auth import get_current_user, get_db
-from models.base import User
+from utils.auth import get_current_principal, Principal, get_db
 from models.permissions import Permission, get_permission_info
 from crud.role import RoleRepository
 
@@ -23,31 +22,31 @@ class RoleUpdate(BaseModel):
     priority: Optional[int] = None
 
 @router.get("/{space_id}/roles")
-async def get_space_roles(
+def get_space_roles(
     space_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить список ролей комнаты с иерархией"""
     role_repo = RoleRepository(db)
     
     # проверка доступа к комнате
-    if not role_repo.get_user_role(current_user.id, space_id):
+    if not role_repo.get_space_permissions(current_user.id, space_id).is_member:
         raise HTTPException(status_code=403, detail="Вы не участник этой комнаты")
     
     hierarchy = role_repo.get_role_hierarchy(space_id)
     return hierarchy
 
 @router.get("/{space_id}/permissions")
-async def get_available_permissions(
+def get_available_permissions(
     space_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить список всех доступных разрешений (для UI)"""
     role_repo = RoleRepository(db)
     
-    if not role_repo.get_user_role(current_user.id, space_id):
+    if not role_repo.get_space_permissions(current_user.id, space_id).is_member:
         raise HTTPException(status_code=403, detail="Вы не участник этой комнаты")
     
     # группируем разрешения
@@ -68,7 +67,7 @@ async def get_available_permissions(
 # @router.get("/{space_id}/my-permissions")
 # async def get_my_permissions(
 #     space_id: int,
-#     current_user: User = Depends(get_current_user),
+#     current_user: Principal = Depends(get_current_principal),
 #     db: Session = Depends(get_db)
 # ):
 #     """Получить мои разрешения в комнате"""
@@ -94,7 +93,7 @@ async def get_available_permissions(
 # async def create_role(
 #     space_id: int,
 #     role_data: RoleCreate,
-#     current_user: User = Depends(get_current_user),
+#     current_user: Principal = Depends(get_current_principal),
 #     db: Session = Depends(get_db)
 # ):
 #     """Создать новую роль"""
@@ -128,11 +127,11 @@ async def get_available_permissions(
 #     }
 
 @router.patch("/{space_id}/roles/{role_id}")
-async def update_role(
+def update_role(
     space_id: int,
     role_id: int,
     role_data: RoleUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Обновить роль"""
@@ -167,10 +166,10 @@ async def update_role(
     }
 
 @router.delete("/{space_id}/roles/{role_id}")
-async def delete_role(
+def delete_role(
     space_id: int,
     role_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Удалить роль"""
@@ -192,11 +191,11 @@ async def delete_role(
     return {"message": "Роль удалена"}
 
 @router.post("/{space_id}/members/{user_id}/role")
-async def assign_role_to_member(
+def assign_role_to_member(
     space_id: int,
     user_id: int,
     role_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Назначить роль участнику"""
@@ -215,17 +214,17 @@ async def assign_role_to_member(
     return {"message": "Роль назначена"}
 
 @router.get("/{space_id}/roles/{role_id}/members")
-async def get_role_members(
+def get_role_members(
     space_id: int,
     role_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить участников с определённой ролью"""
     role_repo = RoleRepository(db)
     
     # проверка доступа
-    if not role_repo.get_user_role(current_user.id, space_id):
+    if not role_repo.get_space_permissions(current_user.id, space_id).is_member:
         raise HTTPException(status_code=403, detail="Вы не участник этой комнаты")
     
     members = role_repo.get_members_with_role(role_id)
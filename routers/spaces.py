@@ -1,22 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile
 from typing import List
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timezone
 
 from schemas.space import SpaceCreate, SpaceOut, BanCreate, RoleCreate, RoleOut
-from utils.auth import get_current_user, check_permissions, get_db
+from utils.auth import get_current_principal, Principal, check_permissions, get_db, get_async_db
 from models.base import User, Space
+from crud.base import AsyncRepository
 from crud.space import SpaceRepository
 from crud.ban import BanRepository
-from crud.role import RoleRepository
+from crud.role import RoleRepository, invalidate_permissions
+from utils.presence import presence
 from utils.file_upload import FileUploader
 
 router = APIRouter()
 
 @router.post("/", response_model=SpaceOut)
-async def create_space(
+def create_space(
     space: SpaceCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Создание новой комнаты"""
@@ -62,9 +66,9 @@ async def create_space(
     return new_space
 
 @router.get("/")
-async def get_all_spaces(
+def get_all_spaces(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Получить список комнат, где пользователь является активным участником (оптимизировано)"""
     from models.base import Chat, ChatParticipant
@@ -89,10 +93,10 @@ async def get_all_spaces(
     } for space, chat_id in results]
 
 @router.get("/{space_id}", response_model=SpaceOut)
-async def get_space(
+def get_space(
     space_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Получить информацию о комнате"""
     space_repo = SpaceRepository(db)
@@ -102,9 +106,9 @@ async def get_space(
     return space
 
 @router.post("/{space_id}/join")
-async def join_space(
+def join_space(
     space_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Присоединиться к комнате"""
@@ -123,14 +127,15 @@ async def join_space(
     return {"message": "Вы успешно присоединились к комнате"}
 
 @router.get("/{space_id}/participants")
-async def get_participants(
+def get_participants(
     space_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить участников комнаты (оптимизировано)"""
     from models.base import UserRole, Role, Ban, Chat, ChatParticipant
     from sqlalchemy.orm import joinedload
+    from utils.presence_registry import presence_registry
 
     # Получаем чат пространства
     chat = db.query(Chat).filter(Chat.space_id == space_id).first()
@@ -196,7 +201,7 @@ async def get_participants(
             "id": user.id,
             "nickname": user.nickname,
             "display_name": user.display_name,
-            "status": user.status,
+            "status": presence_registry.current_status(user.id, user.status),
             "avatar_url": user.avatar_url,
             "role": role_info,
             "is_banned": user.id in banned_user_ids
@@ -211,122 +216,108 @@ async def get_participants(
 async def kick_user(
     space_id: int,
     user_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Исключить пользователя из комнаты"""
     from models.permissions import Permission, RoleHierarchy
-    from models.base import Role, UserRole, Chat
+    from models.base import Chat
     from utils.socketio_instance import sio
+    from utils.room_events import emit_room_event
 
-    space_repo = SpaceRepository(db)
-    role_repo = RoleRepository(db)
+    space_repo = AsyncRepository(SpaceRepository, db)
+    role_repo = AsyncRepository(RoleRepository, db)
+
+    # Права обоих пользователей (из кеша или одним запросом на каждого)
+    actor = await role_repo.get_space_permissions(current_user.id, space_id)
+    target = await role_repo.get_space_permissions(user_id, space_id)
 
     # Проверка существования пространства
-    space = space_repo.get_by_id(space_id)
-    if not space:
+    if not actor.space_exists:
         raise HTTPException(status_code=404, detail="Пространство не найдено")
 
     # Проверка прав - админ или разрешение KICK_MEMBERS
-    if not (space.admin_id == current_user.id or
-            role_repo.check_permission(current_user.id, space_id, Permission.KICK_MEMBERS)):
+    if not actor.has(Permission.KICK_MEMBERS):
         raise HTTPException(status_code=403, detail="У вас нет прав на исключение пользователей")
 
     # Нельзя кикнуть админа
-    if user_id == space.admin_id:
+    if target.is_owner:
         raise HTTPException(status_code=403, detail="Нельзя исключить администратора пространства")
 
-    # Проверка иерархии ролей
-    current_user_role = db.query(UserRole).join(Role).filter(
-        UserRole.user_id == current_user.id,
-        Role.space_id == space_id
-    ).first()
-
-    target_user_role = db.query(UserRole).join(Role).filter(
-        UserRole.user_id == user_id,
-        Role.space_id == space_id
-    ).first()
-
     # Если не владелец, проверяем иерархию
-    if space.admin_id != current_user.id:
-        if not current_user_role or not current_user_role.role:
+    if not actor.is_owner:
+        if not actor.role_name:
             raise HTTPException(status_code=403, detail="У вас нет роли в этом пространстве")
 
-        if target_user_role and target_user_role.role:
-            if not RoleHierarchy.can_moderate(current_user_role.role.name, target_user_role.role.name):
+        if target.role_name:
+            if not RoleHierarchy.can_moderate(actor.role_name, target.role_name):
                 raise HTTPException(status_code=403, detail="Вы не можете исключить пользователя с такой же или более высокой ролью")
 
     # Получаем информацию о пользователе для события
-    kicked_user = db.query(User).filter(User.id == user_id).first()
+    kicked_user = await db.get(User, user_id)
 
     # Получаем chat_id пространства
-    chat = db.query(Chat).filter(
+    chat = await db.scalar(select(Chat).where(
         Chat.space_id == space_id,
         Chat.type == "group"
-    ).first()
+    ).limit(1))
 
-    space_repo.kick(space_id, user_id)
+    await space_repo.kick(space_id, user_id)
 
     # Отправляем WebSocket-событие о кике пользователя
     if chat and kicked_user:
         room_id = str(chat.id)
-        await sio.emit('user_kicked', {
+        await emit_room_event(sio, 'user_kicked', {
             'space_id': space_id,
             'room_id': room_id,
             'user_id': user_id,
             'nickname': kicked_user.nickname
-        }, room=room_id)
+        }, room_id)
+
+        # Подключения исключённого пользователя больше не получают события чата
+        from utils.socketio_handlers import ws_manager
+        if ws_manager:
+            await ws_manager.kick_from_room(user_id, room_id)
 
     return {"message": "Пользователь исключён из комнаты"}
 
 @router.post("/{space_id}/ban/{user_id}")
-async def ban_user(
+def ban_user(
     space_id: int,
     user_id: int,
     ban_data: BanCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Забанить пользователя в комнате"""
     from models.permissions import Permission, RoleHierarchy
-    from models.base import Role, UserRole
 
-    space_repo = SpaceRepository(db)
     ban_repo = BanRepository(db)
     role_repo = RoleRepository(db)
 
+    # Права обоих пользователей (из кеша или одним запросом на каждого)
+    actor = role_repo.get_space_permissions(current_user.id, space_id)
+    target = role_repo.get_space_permissions(user_id, space_id)
+
     # Проверка существования пространства
-    space = space_repo.get_by_id(space_id)
-    if not space:
+    if not actor.space_exists:
         raise HTTPException(status_code=404, detail="Пространство не найдено")
 
     # Проверка прав - админ или разрешение BAN_MEMBERS
-    if not (space.admin_id == current_user.id or
-            role_repo.check_permission(current_user.id, space_id, Permission.BAN_MEMBERS)):
+    if not actor.has(Permission.BAN_MEMBERS):
         raise HTTPException(status_code=403, detail="У вас нет прав на бан пользователей")
 
     # Нельзя забанить админа
-    if user_id == space.admin_id:
+    if target.is_owner:
         raise HTTPException(status_code=403, detail="Нельзя забанить администратора пространства")
 
-    # Проверка иерархии ролей
-    current_user_role = db.query(UserRole).join(Role).filter(
-        UserRole.user_id == current_user.id,
-        Role.space_id == space_id
-    ).first()
-
-    target_user_role = db.query(UserRole).join(Role).filter(
-        UserRole.user_id == user_id,
-        Role.space_id == space_id
-    ).first()
-
     # Если не владелец, проверяем иерархию
-    if space.admin_id != current_user.id:
-        if not current_user_role or not current_user_role.role:
+    if not actor.is_owner:
+        if not actor.role_name:
             raise HTTPException(status_code=403, detail="У вас нет роли в этом пространстве")
 
-        if target_user_role and target_user_role.role:
-            if not RoleHierarchy.can_moderate(current_user_role.role.name, target_user_role.role.name):
+        if target.role_name:
+            if not RoleHierarchy.can_moderate(actor.role_name, target.role_name):
                 raise HTTPException(status_code=403, detail="Вы не можете забанить пользователя с такой же или более высокой ролью")
 
     # Создание бана
@@ -342,28 +333,27 @@ async def ban_user(
     return {"message": "Пользователь забанен"}
 
 @router.delete("/{space_id}/unban/{user_id}")
-async def unban_user(
+def unban_user(
     space_id: int,
     user_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Разбанить пользователя"""
     from models.permissions import Permission
     from crud.ban import BanRepository
 
-    space_repo = SpaceRepository(db)
     ban_repo = BanRepository(db)
     role_repo = RoleRepository(db)
 
+    actor = role_repo.get_space_permissions(current_user.id, space_id)
+
     # Проверка существования пространства
-    space = space_repo.get_by_id(space_id)
-    if not space:
+    if not actor.space_exists:
         raise HTTPException(status_code=404, detail="Пространство не найдено")
 
     # Проверка прав - админ или разрешение BAN_MEMBERS
-    if not (space.admin_id == current_user.id or
-            role_repo.check_permission(current_user.id, space_id, Permission.BAN_MEMBERS)):
+    if not actor.has(Permission.BAN_MEMBERS):
         raise HTTPException(status_code=403, detail="У вас нет прав на управление банами")
 
     # Удаляем бан
@@ -375,24 +365,22 @@ async def unban_user(
     return {"message": "Пользователь разбанен"}
 
 @router.get("/{space_id}/my-permissions")
-async def get_my_permissions(
+def get_my_permissions(
     space_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить права текущего пользователя в пространстве"""
-    from models.base import Role, UserRole
-
-    space_repo = SpaceRepository(db)
     role_repo = RoleRepository(db)
 
+    actor = role_repo.get_space_permissions(current_user.id, space_id)
+
     # Проверка существования пространства
-    space = space_repo.get_by_id(space_id)
-    if not space:
+    if not actor.space_exists:
         raise HTTPException(status_code=404, detail="Пространство не найдено")
 
     # Если пользователь - админ, возвращаем все права
-    if space.admin_id == current_user.id:
+    if actor.is_owner:
         from models.permissions import Permission
         return {
             "is_admin": True,
@@ -400,47 +388,39 @@ async def get_my_permissions(
             "role": {"name": "Владелец", "color": "#FF0000"}
         }
 
-    # Получаем роль пользователя
-    permissions = role_repo.get_permissions(current_user.id, space_id)
-    role = db.query(Role).join(UserRole).filter(
-        UserRole.user_id == current_user.id,
-        Role.space_id == space_id
-    ).first()
-
     role_info = None
-    if role:
+    if actor.is_member and actor.role_name:
         role_info = {
-            "name": role.name,
-            "color": role.color
+            "name": actor.role_name,
+            "color": actor.role_color
         }
 
     return {
         "is_admin": False,
-        "permissions": permissions,
+        "permissions": actor.permissions if actor.is_member else [],
         "role": role_info
     }
 
 @router.post("/{space_id}/roles", response_model=RoleOut)
-async def create_role(
+def create_role(
     space_id: int,
     role_data: RoleCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Создать кастомную роль (только для админов и модераторов с правами)"""
     from models.permissions import Permission
 
     role_repo = RoleRepository(db)
-    space_repo = SpaceRepository(db)
+
+    actor = role_repo.get_space_permissions(current_user.id, space_id)
 
     # Проверка существования пространства
-    space = space_repo.get_by_id(space_id)
-    if not space:
+    if not actor.space_exists:
         raise HTTPException(status_code=404, detail="Пространство не найдено")
 
-    # Проверка прав - нужно разрешение MANAGE_ROLES или быть админом
-    if not (space.admin_id == current_user.id or
-            role_repo.check_permission(current_user.id, space_id, Permission.MANAGE_ROLES)):
+    # Проверка прав - нужно разрешение PROMOTE_MEMBERS или быть админом
+    if not actor.has(Permission.PROMOTE_MEMBERS):
         raise HTTPException(status_code=403, detail="У вас нет прав на создание ролей")
 
     # Создаём роль
@@ -454,57 +434,46 @@ async def create_role(
     return new_role
 
 @router.post("/{space_id}/assign-role/{user_id}/{role_id}")
-async def assign_role(
+def assign_role(
     space_id: int,
     user_id: int,
     role_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Назначить роль пользователю"""
     from models.permissions import Permission, RoleHierarchy
-    from models.base import Role, UserRole
 
     role_repo = RoleRepository(db)
-    space_repo = SpaceRepository(db)
 
-    # проверка прав - нужно разрешение MANAGE_ROLES
-    if not role_repo.check_permission(current_user.id, space_id, Permission.MANAGE_ROLES):
+    actor = role_repo.get_space_permissions(current_user.id, space_id)
+
+    # проверка прав - нужно разрешение PROMOTE_MEMBERS
+    if not actor.has(Permission.PROMOTE_MEMBERS):
         raise HTTPException(status_code=403, detail="У вас нет прав на назначение ролей")
 
     # Получаем роль, которую хотим назначить
-    target_role = db.query(Role).filter(Role.id == role_id).first()
-    if not target_role:
+    target_role = role_repo.get_by_id(role_id)
+    if not target_role or target_role.space_id != space_id:
         raise HTTPException(status_code=404, detail="Роль не найдена")
 
-    # Проверка пространства
-    space = space_repo.get_by_id(space_id)
-    if not space:
-        raise HTTPException(status_code=404, detail="Пространство не найдено")
-
     # Если не владелец, проверяем иерархию
-    if space.admin_id != current_user.id:
-        # Получаем роль того, кто назначает
-        current_user_role = db.query(UserRole).join(Role).filter(
-            UserRole.user_id == current_user.id,
-            Role.space_id == space_id
-        ).first()
-
-        if not current_user_role or not current_user_role.role:
+    if not actor.is_owner:
+        if not actor.role_name:
             raise HTTPException(status_code=403, detail="У вас нет роли в этом пространстве")
 
         # Проверяем, может ли модератор назначать эту роль
-        if not RoleHierarchy.can_moderate(current_user_role.role.name, target_role.name):
+        if not RoleHierarchy.can_moderate(actor.role_name, target_role.name):
             raise HTTPException(status_code=403, detail="Вы не можете назначать роль такого же или более высокого уровня")
 
     role_repo.assign_to_user(user_id, role_id)
     return {"message": "Роль успешно назначена"}
 
 @router.post("/{space_id}/add-user")
-async def add_user_to_space(
+def add_user_to_space(
     space_id: int,
     user_identifier: str,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Добавить пользователя в пространство по никнейму или ID"""
@@ -539,14 +508,16 @@ async def add_user_to_space(
     }
 
 @router.patch("/{space_id}/name")
-async def update_space_name(
+def update_space_name(
     space_id: int,
     new_name: str,
     new_description: str = None,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Изменить название и описание пространства"""
+    from models.permissions import Permission
+
     space_repo = SpaceRepository(db)
     role_repo = RoleRepository(db)
 
@@ -556,11 +527,10 @@ async def update_space_name(
         raise HTTPException(status_code=404, detail="Пространство не найдено")
 
     # Проверка прав - владелец или пользователь с разрешением change_info
-    is_admin = space.admin_id == current_user.id
-    user_role = role_repo.get_user_role_in_space(current_user.id, space_id)
-    has_permission = user_role and user_role.permissions and 'change_info' in user_role.permissions
+    actor = role_repo.get_space_permissions(current_user.id, space_id)
+    is_admin = actor.is_owner
 
-    if not is_admin and not has_permission:
+    if not actor.has(Permission.CHANGE_INFO):
         raise HTTPException(status_code=403, detail="У вас нет прав на изменение информации")
 
     # Обновляем название
@@ -582,9 +552,9 @@ async def update_space_name(
     }
 
 @router.post("/{space_id}/leave")
-async def leave_space(
+def leave_space(
     space_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Покинуть пространство (только для обычных участников, не админов)"""
@@ -605,9 +575,9 @@ async def leave_space(
     return {"message": "Вы покинули пространство"}
 
 @router.delete("/{space_id}/delete")
-async def delete_space(
+def delete_space(
     space_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Удалить пространство (только админ)"""
@@ -639,12 +609,17 @@ async def delete_space(
         ).first()
 
         if chat:
+            # Файлы вложений чата больше не нужны этому чату (удалит сборщик, если ссылок не осталось)
+            from crud.asset import AssetRepository
+            AssetRepository(db).release_chat(chat.id)
             # Удаляем чат (это каскадно удалит Messages, Attachments, ChatParticipants)
             db.delete(chat)
 
         # Удаляем само пространство
         db.delete(space)
         db.commit()
+        invalidate_permissions(space_id)
+        presence.space_removed(space_id)
 
         return {"message": "Пространство успешно удалено"}
     except Exception as e:
@@ -656,14 +631,12 @@ async def delete_space(
 async def upload_space_avatar(
     space_id: int,
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Загрузить аватар пространства (только админ)"""
-    space_repo = SpaceRepository(db)
-
     # Проверка существования пространства
-    space = space_repo.get_by_id(space_id)
+    space = await db.get(Space, space_id)
     if not space:
         raise HTTPException(status_code=404, detail="Пространство не найдено")
 
@@ -673,13 +646,12 @@ async def upload_space_avatar(
 
     # Загрузка через Cloudinary
     try:
-        result = await FileUploader.upload_image(file)
+        result = await FileUploader.upload_image(file, thumbnails=False, dedup=False)
         avatar_url = result["url"]
 
         # Обновляем аватар пространства
         space.avatar_url = avatar_url
-        db.commit()
-        db.refresh(space)
+        await db.commit()
 
         return {
             "message": "Аватар пространства успешно загружен",
@@ -689,5 +661,5 @@ async def upload_space_avatar(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка загрузки аватара: {str(e)}")
@@ -1,16 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
-from utils.auth import get_current_user, get_db
+from utils.auth import get_current_principal, Principal, get_db, get_async_db, invalidate_principal
 from models.base import User
+from crud.base import AsyncRepository
 from crud.activity import ActivityRepository
 
 router = APIRouter()
 
 @router.get("/my-status")
-async def get_my_status(
-    current_user: User = Depends(get_current_user),
+def get_my_status(
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить мой статус"""
@@ -26,11 +28,11 @@ async def get_my_status(
 @router.post("/set-status")
 async def set_status(
     status: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Установить статус (online, offline, away, dnd)"""
-    from utils.socketio_instance import get_sio
+    from utils.presence_registry import presence_registry
     
     valid_statuses = ["online", "offline", "away", "dnd"]
     if status not in valid_statuses:
@@ -39,24 +41,20 @@ async def set_status(
             detail=f"Некорректный статус. Допустимые: {', '.join(valid_statuses)}"
         )
     
-    activity_repo = ActivityRepository(db)
-    activity_repo.set_status(current_user.id, status)
+    activity_repo = AsyncRepository(ActivityRepository, db)
+    await activity_repo.set_status(current_user.id, status)
+    # статус хранится и в users - кешированная копия устарела
+    invalidate_principal(current_user.id)
     
-    # Broadcast статуса всем пользователям через WebSocket
-    sio = get_sio()
-    if sio:
-        await sio.emit('user_status_changed', {
-            'user_id': current_user.id,
-            'nickname': current_user.nickname,
-            'status': status
-        })
+    # Переход считает реестр присутствия, статус получат только соседи по пространствам
+    presence_registry.set_manual(current_user.id, status, current_user.nickname)
     
     return {"message": f"Статус изменён на {status}"}
 
 @router.get("/user/{user_id}")
-async def get_user_status(
+def get_user_status(
     user_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить статус другого пользователя"""
@@ -77,9 +75,9 @@ async def get_user_status(
     }
 
 @router.get("/online")
-async def get_online_users(
+def get_online_users(
     space_id: int = None,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить список онлайн пользователей"""
@@ -93,13 +91,12 @@ async def get_online_users(
     }
 
 @router.post("/heartbeat")
-async def heartbeat(
-    current_user: User = Depends(get_current_user),
+def heartbeat(
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Heartbeat для обновления времени последней активности (без изменения статуса)"""
-    activity_repo = ActivityRepository(db)
-    # Используем update_last_seen вместо update_activity, чтобы не менять статус
-    activity_repo.update_last_seen(current_user.id)
+    # Активность уже отмечена при авторизации запроса (update_user_activity_middleware):
+    # статус - в памяти, время - в write-behind буфере, в БД пишется пачкой
 
     return {"message": "Activity updated"}
\ No newline at end of file
@@ -1,17 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.orm import Session
 from typing import List
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from utils.auth import get_current_user, get_db
+from utils.auth import get_current_principal, Principal, get_db, get_async_db
 from utils.file_upload import FileUploader
-from models.base import User, StickerPack, Sticker, UserStickerPack
+from models.base import StickerPack, Sticker, UserStickerPack
 
 router = APIRouter()
 
 @router.get("/packs")
-async def get_public_packs(
+def get_public_packs(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Получить публичные паки стикеров"""
     packs = db.query(StickerPack).filter(StickerPack.is_public == True).all()
@@ -31,10 +33,10 @@ async def get_public_packs(
     return result
 
 @router.get("/packs/{pack_id}")
-async def get_pack_stickers(
+def get_pack_stickers(
     pack_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Получить стикеры из пака"""
     pack = db.query(StickerPack).filter(StickerPack.id == pack_id).first()
@@ -62,9 +64,9 @@ async def get_pack_stickers(
     }
 
 @router.get("/my-packs")
-async def get_my_packs(
+def get_my_packs(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Получить установленные паки пользователя"""
     user_packs = db.query(UserStickerPack).filter(
@@ -85,10 +87,10 @@ async def get_my_packs(
     return result
 
 @router.post("/packs/{pack_id}/install")
-async def install_pack(
+def install_pack(
     pack_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Установить пак стикеров"""
     # проверка что пак существует
@@ -113,10 +115,10 @@ async def install_pack(
     return {"message": "Пак установлен"}
 
 @router.delete("/packs/{pack_id}/uninstall")
-async def uninstall_pack(
+def uninstall_pack(
     pack_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Удалить пак стикеров"""
     user_pack = db.query(UserStickerPack).filter(
@@ -133,11 +135,11 @@ async def uninstall_pack(
     return {"message": "Пак удалён"}
 
 @router.post("/packs/create")
-async def create_pack(
+def create_pack(
     name: str,
     description: str = None,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Создать пак стикеров"""
     pack = StickerPack(
@@ -158,24 +160,26 @@ async def add_sticker_to_pack(
     file: UploadFile = File(...),
     name: str = None,
     emoji_shortcode: str = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Добавить стикер в пак"""
     # проверка что пак существует и принадлежит пользователю
-    pack = db.query(StickerPack).filter(
+    pack = await db.scalar(select(StickerPack).where(
         StickerPack.id == pack_id,
         StickerPack.author_id == current_user.id
-    ).first()
+    ).limit(1))
     
     if not pack:
         raise HTTPException(status_code=404, detail="Пак не найден или нет доступа")
     
     # загрузка изображения
-    file_info = await FileUploader.upload_image(file)
+    file_info = await FileUploader.upload_image(file, thumbnails=False, dedup=False)
     
     # получаем следующий sort_order
-    max_order = db.query(Sticker).filter(Sticker.pack_id == pack_id).count()
+    max_order = await db.scalar(
+        select(func.count(Sticker.id)).where(Sticker.pack_id == pack_id)
+    )
     
     # создание стикера
     sticker = Sticker(
@@ -186,8 +190,8 @@ async def add_sticker_to_pack(
         sort_order=max_order
     )
     db.add(sticker)
-    db.commit()
-    db.refresh(sticker)
+    await db.commit()
+    await db.refresh(sticker)
     
     return {
         "id": sticker.id,
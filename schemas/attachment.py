@@ -6,6 +6,7 @@ class AttachmentOut(BaseModel):
     file_type: str | None = None
     file_size: int | None = None
     file_name: str | None = None
+    variants: dict | None = None  # уменьшенные копии изображения: {"thumb": url}
 
     model_config = {
         "from_attributes": True
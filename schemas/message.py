@@ -1,5 +1,5 @@
 from pydantic import BaseModel, field_validator
-from typing import Optional
+from typing import Dict, Optional
 from datetime import datetime
 from schemas.attachment import AttachmentOut
 
@@ -33,6 +33,7 @@ class UserInfo(BaseModel):
     id: int
     nickname: str
     avatar_url: Optional[str] = None
+    avatar_variants: Optional[Dict[str, str]] = None  # URL аватара по размерам: 64, 128, 400
     
     class Config:
         from_attributes = True
@@ -51,4 +52,10 @@ class MessageOut(BaseModel):
     my_reaction: Optional[str] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class MessageSearchOut(MessageOut):
+    """Результат полнотекстового поиска"""
+    rank: float
+    snippet: Optional[str] = None  # фрагмент с подсветкой совпадений (<mark>), HTML экранирован
+    cursor: str  # передать в параметр cursor, чтобы получить следующую страницу
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Dict, Optional
 from datetime import datetime
 
 
@@ -17,7 +17,9 @@ class ProfileOut(BaseModel):
     display_name: Optional[str] = None
     bio: Optional[str] = None
     avatar_url: Optional[str] = None
+    avatar_variants: Optional[Dict[str, str]] = None  # URL по размерам: 64, 128, 400
     profile_background_url: Optional[str] = None
+    profile_background_variants: Optional[Dict[str, str]] = None  # URL по размерам: 600, 1200
     status: str
     created_at: datetime
     
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, field_validator
-from typing import Optional
+from typing import Dict, Optional
 from utils.validators import Validators
 
 class UserCreate(BaseModel):
@@ -38,7 +38,9 @@ class UserOut(BaseModel):
     email: Optional[str]
     status: str
     avatar_url: Optional[str] = None
+    avatar_variants: Optional[Dict[str, str]] = None
     profile_background_url: Optional[str] = None
+    profile_background_variants: Optional[Dict[str, str]] = None
     bio: Optional[str] = None
     display_name: Optional[str] = None
 
@@ -0,0 +1,88 @@
+"""
+Постраничный поиск сообщений (MessageRepository.search) на PostgreSQL
+
+Нужна тестовая БД: TEST_DATABASE_URL=postgresql://.../chat_app_test python -m pytest tests
+Без неё тесты пропускаются. Данные создаются в транзакции, которая в конце откатывается
+"""
+import os
+import uuid
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL не задан")
+
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+
+@pytest.fixture
+def db():
+    from sqlalchemy.orm import Session
+    from models.base import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+
+
+def _chat_with_messages(db, contents):
+    from models.base import User, Chat, Message
+
+    suffix = uuid.uuid4().hex[:8]
+    user1 = User(nickname=f"search_a_{suffix}")
+    user2 = User(nickname=f"search_b_{suffix}")
+    db.add_all([user1, user2])
+    db.flush()
+    chat = Chat(user1_id=user1.id, user2_id=user2.id)
+    db.add(chat)
+    db.flush()
+    messages = [Message(chat_id=chat.id, user_id=user1.id, content=content) for content in contents]
+    db.add_all(messages)
+    db.flush()
+    return chat, messages
+
+
+def _all_pages(repo, query, chat_id, limit):
+    from crud.message import decode_search_cursor
+
+    found, cursor = [], None
+    while True:
+        page = repo.search(query, chat_id=chat_id, limit=limit, cursor=cursor)
+        found.extend(page)
+        if len(page) < limit:
+            return found
+        cursor = decode_search_cursor(page[-1].cursor)
+
+
+def test_search_pages_through_equal_ranks(db):
+    from crud.message import MessageRepository
+
+    # одинаковый текст - одинаковый ts_rank_cd, дробный (не точно представимый в real)
+    contents = ["космос и звёзды, далёкий космос"] * 7
+    chat, messages = _chat_with_messages(db, contents)
+
+    found = _all_pages(MessageRepository(db), "космос", chat.id, limit=2)
+
+    assert len({msg.rank for msg in found}) == 1
+    assert [msg.id for msg in found] == sorted((msg.id for msg in messages), reverse=True)
+
+
+def test_search_pages_through_mixed_ranks(db):
+    from crud.message import MessageRepository
+
+    contents = ["космос", "космос космос", "космос", "про космос и снова космос", "космос"]
+    chat, messages = _chat_with_messages(db, contents)
+
+    found = _all_pages(MessageRepository(db), "космос", chat.id, limit=2)
+
+    assert sorted(msg.id for msg in found) == sorted(msg.id for msg in messages)
+    assert [(msg.rank, msg.id) for msg in found] == sorted(((msg.rank, msg.id) for msg in found), reverse=True)
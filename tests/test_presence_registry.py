@@ -0,0 +1,202 @@
+"""
+Колесо таймеров статусов присутствия (PresenceRegistry): переходы online -> away -> offline,
+задержка после отключения, оборот колеса и статусы упавших процессов
+
+Без БД и Socket.IO: время подменяется, рассылка статусов записывается в список
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from utils import presence_registry as module
+from utils.presence_registry import PresenceRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class FakeFanout:
+    def __init__(self):
+        self.sent = []
+
+    async def status_changed(self, user_id, nickname, status):
+        self.sent.append((user_id, status))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(module, "time", clock)
+    monkeypatch.setattr(module, "TICK_SECONDS", 1.0)
+    monkeypatch.setattr(module, "ONLINE_THRESHOLD_SECONDS", 300.0)
+    monkeypatch.setattr(module, "AWAY_THRESHOLD_SECONDS", 900.0)
+    monkeypatch.setattr(module, "DISCONNECT_GRACE_SECONDS", 30.0)
+    monkeypatch.setattr(module, "HOST_TIMEOUT_SECONDS", 60.0)
+    return clock
+
+
+@pytest.fixture
+def fanout(monkeypatch):
+    fanout = FakeFanout()
+    monkeypatch.setattr(module, "presence", fanout)
+    return fanout
+
+
+def _registry() -> PresenceRegistry:
+    registry = PresenceRegistry()
+
+    async def load_manual(user_ids):
+        # ручных статусов нет
+        for user_id in user_ids:
+            registry._users[user_id].manual_loaded = True
+
+    registry._load_manual = load_manual
+    return registry
+
+
+@pytest.fixture
+def registry(clock, fanout):
+    return _registry()
+
+
+def _advance(registry, clock, seconds):
+    clock.now += seconds
+    asyncio.run(registry.advance())
+
+
+def test_idle_user_goes_online_away_offline(registry, clock, fanout):
+    registry.touch(1)
+    _advance(registry, clock, 1)
+    assert fanout.sent == [(1, "online")]
+
+    _advance(registry, clock, 298)
+    assert fanout.sent == [(1, "online")]
+
+    _advance(registry, clock, 2)
+    assert fanout.sent == [(1, "online"), (1, "away")]
+
+    _advance(registry, clock, 600)
+    assert fanout.sent == [(1, "online"), (1, "away"), (1, "offline")]
+    # ушедший пользователь убран из памяти - дальше статус читается из БД
+    assert registry.status_of(1) is None
+
+
+def test_connected_user_stays_away(registry, clock, fanout):
+    registry.connect(1, "alice")
+    _advance(registry, clock, 1)
+    _advance(registry, clock, 2000)
+
+    assert fanout.sent == [(1, "online"), (1, "away")]
+    assert registry.status_of(1)[0] == "away"
+
+
+def test_activity_returns_away_user_online(registry, clock, fanout):
+    registry.connect(1, "alice")
+    _advance(registry, clock, 1)
+    _advance(registry, clock, 300)
+    registry.touch(1)
+    _advance(registry, clock, 1)
+
+    assert fanout.sent == [(1, "online"), (1, "away"), (1, "online")]
+
+
+def test_disconnect_grace(registry, clock, fanout):
+    registry.connect(1, "alice")
+    _advance(registry, clock, 1)
+    registry.disconnect(1)
+
+    _advance(registry, clock, 29)
+    assert fanout.sent == [(1, "online")]
+
+    _advance(registry, clock, 2)
+    assert fanout.sent == [(1, "online"), (1, "offline")]
+    assert registry.status_of(1) is None
+
+
+def test_reconnect_within_grace_stays_online(registry, clock, fanout):
+    registry.connect(1, "alice")
+    _advance(registry, clock, 1)
+    registry.disconnect(1)
+    _advance(registry, clock, 10)
+    # перезагрузка вкладки
+    registry.connect(1, "alice")
+
+    _advance(registry, clock, 60)
+    assert fanout.sent == [(1, "online")]
+    assert registry.status_of(1)[0] == "online"
+
+
+def test_deadline_past_wheel_size_waits_full_turns(clock, fanout, monkeypatch):
+    monkeypatch.setattr(module, "WHEEL_SLOTS", 8)
+    registry = _registry()
+    registry.touch(1)
+    _advance(registry, clock, 1)
+
+    # дедлайн away (300 тиков) попадает в ячейку, через которую колесо проходит 37 раз до него
+    for _ in range(298):
+        _advance(registry, clock, 1)
+    assert fanout.sent == [(1, "online")]
+
+    _advance(registry, clock, 1)
+    assert fanout.sent == [(1, "online"), (1, "away")]
+
+
+def test_moved_deadline_leaves_old_slot(clock, fanout, monkeypatch):
+    monkeypatch.setattr(module, "WHEEL_SLOTS", 8)
+    registry = _registry()
+    registry.connect(1, "alice")
+    _advance(registry, clock, 1)
+    # ручной статус пересчитывается сразу: дедлайн away переносится в другую ячейку
+    registry.apply_manual(1, "dnd")
+    _advance(registry, clock, 1)
+    assert fanout.sent == [(1, "online"), (1, "dnd")]
+
+    # старая запись в ячейке дедлайна away отбрасывается без пересчёта
+    for _ in range(310):
+        _advance(registry, clock, 1)
+    assert fanout.sent == [(1, "online"), (1, "dnd")]
+    assert all(1 not in slot for slot in registry._slots)
+
+
+def test_statuses_of_silent_host_expire(registry, clock, fanout):
+    registry.host_id = "b"
+    registry.apply_remote("a", 5, "online", None)
+    assert registry.status_of(5)[0] == "online"
+
+    clock.now += 61
+    asyncio.run(registry._expire_hosts())
+
+    assert registry.status_of(5) is None
+    assert fanout.sent == [(5, "offline")]
+    assert registry.expired_hosts == 1
+
+
+def test_only_leader_broadcasts_expired_statuses(registry, clock, fanout):
+    registry.host_id = "c"
+    registry.apply_remote("a", 5, "online", None)
+    clock.now += 61
+    # процесс "b" жив, и рассылает он: его host_id меньше
+    registry.host_alive("b")
+    asyncio.run(registry._expire_hosts())
+
+    assert registry.status_of(5) is None
+    assert fanout.sent == []
+
+
+def test_heard_host_keeps_statuses(registry, clock, fanout):
+    registry.host_id = "b"
+    registry.apply_remote("a", 5, "online", None)
+    clock.now += 50
+    registry.host_alive("a")
+    clock.now += 50
+    asyncio.run(registry._expire_hosts())
+
+    assert registry.status_of(5)[0] == "online"
+    assert registry.expired_hosts == 0
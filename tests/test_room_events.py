@@ -0,0 +1,116 @@
+"""
+Журнал событий комнат (RoomEventLog): досылка только непрерывной цепочкой, иначе resync
+
+Без БД и Socket.IO: номера выдаются в памяти (один процесс)
+"""
+import asyncio
+
+from utils.room_events import RoomEventLog, emit_room_event
+
+
+def _log(**kwargs) -> RoomEventLog:
+    return RoomEventLog(name="test_room_events", **kwargs)
+
+
+def _emit(log: RoomEventLog, room_id: str, count: int):
+    async def run():
+        for _ in range(count):
+            seq = await log.next_seq(room_id)
+            log.record(room_id, seq, "new_message", {"seq": seq})
+    asyncio.run(run())
+
+
+def _seqs(events):
+    return [seq for seq, _, _ in events]
+
+
+def test_replay_returns_missed_events_in_order():
+    log = _log()
+    _emit(log, "1", 5)
+
+    assert _seqs(asyncio.run(log.replay("1", 2, log.epoch))) == [3, 4, 5]
+    assert asyncio.run(log.replay("1", 5, log.epoch)) == []
+    assert log.replayed == 3
+    assert log.resyncs == 0
+
+
+def test_events_recorded_out_of_order_are_replayed_sorted():
+    log = _log()
+    log.record("1", 1, "new_message", {"seq": 1})
+    log.record("1", 3, "message_edited", {"seq": 3})
+    # событие другого процесса дошло позже следующего
+    log.record("1", 2, "reaction_updated", {"seq": 2})
+
+    events = asyncio.run(log.replay("1", 0, log.epoch))
+    assert _seqs(events) == [1, 2, 3]
+    assert [event for _, event, _ in events] == ["new_message", "reaction_updated", "message_edited"]
+
+
+def test_gap_in_ring_requires_resync():
+    log = _log()
+    log.record("1", 1, "new_message", {"seq": 1})
+    log.record("1", 3, "new_message", {"seq": 3})
+
+    # события 2 в журнале нет - досылка 1 и 3 пропустила бы его
+    assert asyncio.run(log.replay("1", 0, log.epoch)) is None
+    # после 2 цепочка снова непрерывна
+    assert _seqs(asyncio.run(log.replay("1", 2, log.epoch))) == [3]
+    assert log.resyncs == 1
+
+
+def test_events_evicted_from_ring_require_resync():
+    log = _log(max_events=3)
+    _emit(log, "1", 5)
+
+    assert asyncio.run(log.replay("1", 1, log.epoch)) is None
+    assert _seqs(asyncio.run(log.replay("1", 2, log.epoch))) == [3, 4, 5]
+
+
+def test_evicted_room_keeps_numbering_and_resyncs():
+    log = _log(max_rooms=1)
+    _emit(log, "1", 2)
+    _emit(log, "2", 1)
+
+    # буфер комнаты 1 вытеснен, но номера не начинаются заново
+    assert asyncio.run(log.current_seq("1")) == 2
+    assert asyncio.run(log.replay("1", 1, log.epoch)) is None
+    _emit(log, "1", 1)
+    assert asyncio.run(log.current_seq("1")) == 3
+
+
+def test_other_epoch_or_future_seq_requires_resync():
+    log = _log()
+    _emit(log, "1", 2)
+
+    assert asyncio.run(log.replay("1", 1, "old-epoch")) is None
+    assert asyncio.run(log.replay("1", 5, log.epoch)) is None
+    assert log.resyncs == 2
+
+
+def test_record_remote_ignores_unsequenced_events():
+    log = _log()
+    log.record_remote({"event": "user_joined_room", "room": "1", "data": {"seq": 1}})
+    log.record_remote({"event": "new_message", "room": "1", "data": {"text": "без номера"}})
+    log.record_remote({"event": "new_message", "room": "1", "data": {"seq": 1}})
+
+    assert asyncio.run(log.current_seq("1")) == 1
+    assert _seqs(asyncio.run(log.replay("1", 0, log.epoch))) == [1]
+
+
+def test_emit_room_event_records_before_sending(monkeypatch):
+    from utils import room_events as module
+
+    log = _log()
+    monkeypatch.setattr(module, "room_events", log)
+    sent = []
+
+    class FakeSio:
+        async def emit(self, event, payload, room=None, skip_sid=None):
+            # к моменту отправки событие уже в журнале - его можно дослать
+            sent.append((event, payload, room, _seqs(await log.replay(room, 0, log.epoch))))
+
+    asyncio.run(emit_room_event(FakeSio(), "new_message", {"message_id": 7}, 42))
+
+    event, payload, room, replayable = sent[0]
+    assert (event, room, replayable) == ("new_message", "42", [1])
+    assert payload == {"message_id": 7, "seq": 1, "epoch": log.epoch}
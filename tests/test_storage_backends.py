@@ -0,0 +1,49 @@
+"""
+Удаление файлов Cloudinary по URL (CloudinaryStorage.parse_url / delete_url)
+
+Без сети: destroy подменяется, проверяется только разбор URL
+"""
+import pytest
+
+from utils.storage_backends import CloudinaryStorage
+
+
+@pytest.fixture(autouse=True)
+def cloud_name(monkeypatch):
+    monkeypatch.setenv("CLOUDINARY_CLOUD_NAME", "demo")
+
+
+def test_parse_image_url_drops_version_and_extension():
+    url = "https://res.cloudinary.com/demo/image/upload/v1712345678/12/avatar_abc_400.jpg"
+    assert CloudinaryStorage.parse_url(url) == ("12/avatar_abc_400", "image")
+
+
+def test_parse_raw_url_keeps_extension():
+    url = "https://res.cloudinary.com/demo/raw/upload/v1/chat/report%20final.pdf"
+    assert CloudinaryStorage.parse_url(url) == ("chat/report final.pdf", "raw")
+
+
+def test_parse_url_skips_transformations():
+    url = "https://res.cloudinary.com/demo/video/upload/c_fill,w_10/v9/chat/voice.mp3"
+    assert CloudinaryStorage.parse_url(url) == ("chat/voice", "video")
+
+
+@pytest.mark.parametrize("url", [
+    "https://res.cloudinary.com/other/image/upload/v1/x.jpg",
+    "https://project.supabase.co/storage/v1/object/public/avatars/1/avatar_400.jpg",
+    "/media/chat/x.jpg",
+    "",
+])
+def test_foreign_urls_are_not_deleted(url):
+    storage = CloudinaryStorage()
+    storage.delete = lambda *args: pytest.fail("чужой URL не должен удаляться")
+    assert storage.delete_url(url) is False
+
+
+def test_delete_url_destroys_by_public_id():
+    storage = CloudinaryStorage()
+    calls = []
+    storage.delete = lambda public_id, url, resource_type="image": calls.append((public_id, resource_type)) or True
+
+    assert storage.delete_url("https://res.cloudinary.com/demo/image/upload/v1/12/banner_1200.webp")
+    assert calls == [("12/banner_1200", "image")]
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy import select, values, column, literal, case, func, BigInteger, DateTime
+from sqlalchemy.dialects.postgresql import insert
+from models.base import AsyncSessionLocal, UserActivity, User
+
+# статусы, установленные вручную - буфер их не перезаписывает
+MANUAL_STATUSES = ("away", "dnd", "offline")
+
+
+class ActivityBuffer:
+    """
+    Write-behind буфер времени последней активности пользователей
+
+    Вместо SELECT + COMMIT в user_activity на каждый авторизованный запрос
+    запоминаем last_seen в памяти и раз в несколько секунд сбрасываем
+    всё накопленное одним INSERT ... ON CONFLICT DO UPDATE
+    """
+
+    FLUSH_INTERVAL_SECONDS = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))
+
+    def __init__(self):
+        # user_id -> время последней активности (без timezone, как в ActivityRepository)
+        self._pending: Dict[int, datetime] = {}
+        # записи, которые прямо сейчас пишутся в БД (чтобы чтение не откатывалось назад)
+        self._in_flight: Dict[int, datetime] = {}
+        # touch вызывается из threadpool (get_current_user), поэтому нужен lock
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, user_id: int):
+        """Отметить активность пользователя (без обращения к БД)"""
+        now = datetime.now()  # Без timezone
+        with self._lock:
+            self._pending[user_id] = now
+
+    def get_last_seen(self, user_id: int) -> Optional[datetime]:
+        """Последняя активность из буфера (ещё не записанная в БД) или None"""
+        with self._lock:
+            return self._pending.get(user_id) or self._in_flight.get(user_id)
+
+    async def flush(self):
+        """Записать накопленную активность в БД одним запросом"""
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._in_flight = batch
+
+        try:
+            buffered = values(
+                column("user_id", BigInteger),
+                column("last_seen", DateTime),
+                name="buffered_activity"
+            ).data(list(batch.items()))
+
+            # новая запись получает статус из users.status, как раньше в update_last_seen
+            initial_status = func.coalesce(func.nullif(User.status, ""), "online")
+            # join с users отбрасывает пользователей, удалённых до сброса буфера
+            source = select(
+                buffered.c.user_id,
+                buffered.c.last_seen,
+                initial_status,
+                initial_status == "online"
+            ).join(User, User.id == buffered.c.user_id)
+
+            stmt = insert(UserActivity).from_select(
+                ["user_id", "last_seen", "status", "is_active"], source
+            )
+            is_manual = UserActivity.status.in_(MANUAL_STATUSES)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[UserActivity.user_id],
+                set_={
+                    "last_seen": func.greatest(UserActivity.last_seen, stmt.excluded.last_seen),
+                    # статус, установленный вручную, не трогаем - как раньше в update_last_seen
+                    "status": case((is_manual, UserActivity.status), else_=literal("online")),
+                    "is_active": case((is_manual, UserActivity.is_active), else_=literal(True)),
+                    "updated_at": func.now(),
+                }
+            )
+
+            async with AsyncSessionLocal() as db:
+                await db.execute(stmt)
+                await db.commit()
+        except Exception as e:
+            print(f"[ActivityBuffer] Flush error: {e}")
+            # возвращаем записи обратно, более свежие значения не затираем
+            with self._lock:
+                for user_id, last_seen in batch.items():
+                    if user_id not in self._pending:
+                        self._pending[user_id] = last_seen
+        finally:
+            with self._lock:
+                self._in_flight = {}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL_SECONDS)
+            await self.flush()
+
+    def start(self):
+        """Запустить периодический сброс (вызывается при старте приложения)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить периодический сброс и записать остатки"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# единственный буфер на процесс
+activity_buffer = ActivityBuffer()
@@ -0,0 +1,77 @@
+import asyncio
+import os
+from typing import Dict, Optional
+from crud.base import run_in_session
+
+
+class AssetCollector:
+    """
+    Сборщик общих файлов вложений (stored_assets), на которые не ссылается ни одно вложение
+
+    Раз в ASSET_GC_INTERVAL секунд удаляет из индекса пачками записи с refcount <= 0,
+    которые не использовались ASSET_GC_GRACE секунд (запас для загрузки, после которой
+    сообщение ещё не создано), и после коммита удаляет их файлы из хранилища.
+    Несколько процессов не мешают друг другу (FOR UPDATE SKIP LOCKED)
+    """
+
+    INTERVAL_SECONDS = float(os.getenv("ASSET_GC_INTERVAL", "3600"))
+    GRACE_SECONDS = float(os.getenv("ASSET_GC_GRACE", "3600"))
+    BATCH_SIZE = int(os.getenv("ASSET_GC_BATCH_SIZE", "100"))
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.collected = 0
+
+    async def _delete_files(self, asset: Dict):
+        from utils.storage_backends import get_storage
+        from utils.file_upload import run_upload
+
+        storage = get_storage(asset["storage"])
+        files = [(asset["public_id"], asset["url"], asset["resource_type"])]
+        files += [(copy["public_id"], copy["url"], "image") for copy in asset["info"].get("files", [])]
+        for public_id, url, resource_type in files:
+            try:
+                await run_upload(storage.delete, public_id, url, resource_type)
+            except Exception as e:
+                # запись уже удалена - файл останется в хранилище, но ссылок на него нет
+                print(f"[AssetGC] Failed to delete {url}: {e}")
+
+    async def collect_batch(self) -> int:
+        """Удалить одну пачку; возвращает число удалённых файлов"""
+        from crud.asset import AssetRepository
+
+        assets = await run_in_session(
+            lambda db: AssetRepository(db).collect(self.GRACE_SECONDS, self.BATCH_SIZE)
+        )
+        for asset in assets:
+            await self._delete_files(asset)
+        self.collected += len(assets)
+        return len(assets)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.INTERVAL_SECONDS)
+            try:
+                # полная пачка - значит, кандидаты ещё есть
+                while await self.collect_batch() >= self.BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print(f"[AssetGC] Batch error: {e}")
+
+    def start(self):
+        """Запустить сборщик (вызывается при старте приложения)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# единственный экземпляр на процесс
+asset_collector = AssetCollector()
@@ -1,11 +1,15 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Callable, Optional
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
+import hashlib
 import os
-from models.base import SessionLocal, User, verify_password
+import time
+from models.base import SessionLocal, AsyncSessionLocal, User, verify_password
+from utils.cache import TTLCache
 
 load_dotenv()
 
@@ -21,8 +25,49 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key-change-me-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "1440"))  # 24 часа по умолчанию
 
+# кеши аутентификации
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))  # проверенные токены, секунды
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))  # данные пользователей, секунды
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
+# sha256(token) -> (user_id, exp)
+_token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=TOKEN_CACHE_TTL, name="auth_tokens")
+# user_id -> Principal
+_principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL, name="auth_principals")
+# вызывается с user_id при каждом сбросе данных пользователя в этом процессе
+# (при нескольких процессах - рассылка сброса остальным, см. main.py)
+on_principal_invalidate: Optional[Callable[[int], None]] = None
+
+
+class Principal:
+    """
+    Аутентифицированный пользователь
+
+    Лёгкая копия нужных полей из users: хранится в кеше и не привязана к сессии БД.
+    Для изменения профиля нужен ORM-объект - см. get_current_user
+    """
+    __slots__ = ("id", "nickname", "display_name", "avatar_url", "status")
+
+    def __init__(self, id: int, nickname: str, display_name: str = None,
+                 avatar_url: str = None, status: str = None):
+        self.id = id
+        self.nickname = nickname
+        self.display_name = display_name
+        self.avatar_url = avatar_url
+        self.status = status
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            nickname=user.nickname,
+            display_name=user.display_name,
+            avatar_url=user.avatar_url,
+            status=user.status
+        )
+
 def get_db():
     """Dependency для получения сессии БД"""
     db = SessionLocal()
@@ -31,6 +76,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Dependency для получения асинхронной сессии БД (для async-эндпоинтов)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Создание JWT токена"""
     to_encode = data.copy()
@@ -41,63 +91,113 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     
     to_encode.update({"exp": expire})
     
-    # проверяем какая библиотека используется
-    try:
-        from jose import jwt as jose_jwt
-        encoded_jwt = jose_jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    except ImportError:
-        import jwt as pyjwt
-        encoded_jwt = pyjwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def update_user_activity_middleware(user_id: int, db: Session):
-    """Обновить активность при каждом запросе"""
-    from crud.activity import ActivityRepository
-    from models.base import UserActivity
-    
-    activity_repo = ActivityRepository(db)
-    
-    # Проверяем текущий статус пользователя
-    activity = db.query(UserActivity).filter(UserActivity.user_id == user_id).first()
-    
-    # Если статус установлен вручную (away, dnd, offline) - не меняем его, только обновляем last_seen
-    if activity and activity.status in ["away", "dnd", "offline"]:
-        activity_repo.update_last_seen(user_id)
-    else:
-        # Если статус online или нет записи - обновляем как обычно
-        activity_repo.update_activity(user_id, status="online")
+def update_user_activity_middleware(user_id: int):
+    """
+    Обновить активность при каждом запросе
+
+    Запись в user_activity не делается сразу: время попадает в write-behind буфер,
+    который раз в несколько секунд сбрасывается в БД одним запросом.
+    Статус, установленный вручную (away, dnd, offline), при сбросе не меняется.
+    Текущий статус считается в памяти (PresenceRegistry)
+    """
+    from utils.activity_buffer import activity_buffer
+    from utils.presence_registry import presence_registry
+
+    activity_buffer.touch(user_id)
+    presence_registry.touch(user_id)
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def verify_token(token: str) -> Optional[int]:
+    """
+    Проверить JWT и вернуть id пользователя (или None, если токен невалиден)
+
+    Результат проверки кешируется по хешу токена, но не дольше срока действия токена
+    """
+    key = _token_key(token)
+    cached = _token_cache.get(key)
+    if cached is not None:
+        user_id, exp = cached
+        if exp is None or exp > time.time():
+            return user_id
+        _token_cache.pop(key)
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = int(payload.get("sub"))
+    except (JWTError, TypeError, ValueError):
+        return None
+
+    exp = payload.get("exp")
+    ttl = TOKEN_CACHE_TTL if exp is None else min(TOKEN_CACHE_TTL, exp - time.time())
+    if ttl > 0:
+        _token_cache.set(key, (user_id, exp), ttl=ttl)
+    return user_id
+
+def invalidate_principal(user_id: int):
+    """Сбросить кешированные данные пользователя (после изменения профиля)"""
+    drop_cached_principal(user_id)
+    if on_principal_invalidate is not None:
+        on_principal_invalidate(user_id)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    """Получение текущего пользователя из JWT токена"""
+def drop_cached_principal(user_id: int):
+    """Сбросить данные пользователя только в кеше этого процесса (сброс из другого процесса)"""
+    _principal_cache.pop(user_id)
+
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    """
+    Получение текущего пользователя из JWT токена (без ORM-объекта)
+
+    При попадании в кеш не делает ни одного запроса к БД.
+    Подходит для всех эндпоинтов, которым нужны только id, nickname и аватар
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Не удалось валидировать токен",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
-    try:
-        try:
-            from jose import jwt as jose_jwt
-            payload = jose_jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        except ImportError:
-            import jwt as pyjwt
-            payload = pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-            
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.id == int(user_id)).first()
-    if user is None:
+
+    user_id = verify_token(token)
+    if user_id is None:
         raise credentials_exception
-    
+
+    principal = _principal_cache.get(user_id)
+    if principal is None:
+        user = await db.get(User, user_id)
+        if user is None:
+            raise credentials_exception
+        principal = Principal.from_user(user)
+        _principal_cache.set(user_id, principal)
+
     # обновление активности
-    await update_user_activity_middleware(user.id, db)
-    
+    update_user_activity_middleware(principal.id)
+
+    return principal
+
+def get_current_user(
+    principal: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+) -> User:
+    """
+    Получение текущего пользователя как ORM-объекта
+
+    Нужна эндпоинтам, которые меняют профиль через сессию db.
+    Синхронная dependency: FastAPI выполняет её в threadpool
+    """
+    user = db.get(User, principal.id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Не удалось валидировать токен",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 def check_permissions(db: Session, user_id: int, space_id: int, required_permission: str) -> bool:
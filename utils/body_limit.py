@@ -0,0 +1,88 @@
+import json
+import os
+from fastapi import HTTPException
+
+# предел тела запроса: самый большой файл (10 МБ) плюс запас на поля и разметку multipart
+MAX_REQUEST_BODY = int(os.getenv("MAX_REQUEST_BODY", str(11 * 1024 * 1024)))
+
+
+class BodyTooLarge(HTTPException):
+    """
+    Тело запроса больше MAX_REQUEST_BODY
+
+    HTTPException: FastAPI пробрасывает её из разбора формы как есть (ответ 413),
+    а не превращает в 400, как остальные ошибки чтения тела
+    """
+
+    def __init__(self, max_body_size: int):
+        super().__init__(
+            status_code=413,
+            detail=f"Запрос слишком большой. Максимум: {max_body_size / (1024*1024):.0f}MB"
+        )
+
+
+class BodySizeLimitMiddleware:
+    """
+    Отклонение слишком больших запросов до разбора формы
+
+    Starlette принимает multipart-тело целиком (во временный файл) ещё до вызова обработчика,
+    поэтому проверка размера в обработчике не экономит ни трафик, ни диск.
+    - Content-Length больше предела - сразу 413, тело не читается
+    - без Content-Length (chunked) - тело считается по мере приёма и обрывается на пределе
+    """
+
+    def __init__(self, app, max_body_size: int = MAX_REQUEST_BODY):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": BodyTooLarge(self.max_body_size).detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None:
+            try:
+                too_large = int(content_length) > self.max_body_size
+            except ValueError:
+                too_large = False
+            if too_large:
+                return await self._reject(send)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    raise BodyTooLarge(self.max_body_size)
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except BodyTooLarge:
+            # тело читали вне обработчика FastAPI - отвечаем сами, если ответ ещё не начат
+            if response_started:
+                raise
+            await self._reject(send)
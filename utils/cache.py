@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+# все именованные кеши процесса (для метрик)
+_registry: List[Any] = []
+
+
+def register_cache(cache):
+    """Добавить кеш в метрики (нужны атрибут name и метод stats())"""
+    _registry.append(cache)
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру кеш с временем жизни записей
+
+    - при переполнении вытесняется запись, к которой дольше всего не обращались (LRU)
+    - потокобезопасен: используется и из event loop, и из threadpool
+    - считает попадания и промахи
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if name:
+            register_cache(self)
+
+    def get(self, key, default=None):
+        """Получить значение или default, если записи нет или она устарела"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float = None):
+        """Сохранить значение (ttl по умолчанию - общий для кеша)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Удалить запись"""
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item is not None else default
+
+    def pop_where(self, predicate: Callable[[Any, Any], bool]) -> int:
+        """Удалить все записи, для которых predicate(key, value) истинно"""
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики кеша"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None
+        }
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Метрики всех именованных кешей процесса"""
+    return {cache.name: cache.stats() for cache in _registry}
@@ -0,0 +1,142 @@
+from datetime import datetime, timezone
+from typing import Dict, List
+from fastapi import Depends, HTTPException
+from sqlalchemy import select, exists, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.base import Chat, ChatParticipant, Space, Role, UserRole, Ban
+from models.permissions import has_permission_mask, compile_permissions
+from utils.auth import get_current_principal, get_async_db, Principal
+
+
+class ChatAccess:
+    """
+    Доступ пользователя к чату: чат, пространство, участие, бан и права роли
+
+    Собирается одним запросом (см. resolve_chat_access) и живёт до конца запроса
+    """
+    __slots__ = ("user_id", "chat_id", "chat_exists", "chat_type", "space_id",
+                 "is_member", "is_banned", "is_owner", "mask")
+
+    def __init__(self, user_id: int, chat_id: int, chat_exists: bool = False, chat_type: str = None,
+                 space_id: int = None, is_member: bool = False, is_banned: bool = False,
+                 is_owner: bool = False, mask: int = 0):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.chat_exists = chat_exists
+        self.chat_type = chat_type
+        self.space_id = space_id
+        self.is_member = is_member
+        self.is_banned = is_banned
+        self.is_owner = is_owner
+        self.mask = mask
+
+    def has(self, permission: str) -> bool:
+        """Есть ли разрешение в пространстве чата (владелец пространства может всё)"""
+        if self.space_id is None:
+            return False
+        if self.is_owner:
+            return True
+        return self.is_member and has_permission_mask(self.mask, permission)
+
+    def require_member(self, detail: str = "Вы не участник этого чата"):
+        """403, если пользователь не участник чата"""
+        if not self.is_member:
+            raise HTTPException(status_code=403, detail=detail)
+
+    def require_not_banned(self, detail: str = "Вы забанены в этом пространстве"):
+        """403, если у пользователя активный бан в пространстве чата"""
+        if self.is_banned:
+            raise HTTPException(status_code=403, detail=detail)
+
+
+def _access_query(user_id: int):
+    """Запрос доступа пользователя к чатам (условие на Chat.id добавляет вызывающий)"""
+    now = datetime.now(timezone.utc)
+
+    is_member = exists().where(
+        ChatParticipant.chat_id == Chat.id,
+        ChatParticipant.user_id == user_id,
+        ChatParticipant.is_active == True
+    )
+    is_banned = exists().where(
+        Ban.user_id == user_id,
+        Ban.space_id == Chat.space_id,
+        or_(Ban.until > now, Ban.until.is_(None))
+    )
+    # роль пользователя в пространстве чата, иначе роль по умолчанию - как в RoleRepository
+    assigned_role_id = select(UserRole.role_id).join(
+        Role, Role.id == UserRole.role_id
+    ).where(
+        UserRole.user_id == user_id,
+        Role.space_id == Chat.space_id
+    ).order_by(Role.priority.desc()).limit(1).scalar_subquery()
+    default_role_id = select(Role.id).where(
+        Role.space_id == Chat.space_id,
+        Role.name == "Участник"
+    ).limit(1).scalar_subquery()
+
+    return (
+        select(
+            Chat.id,
+            Chat.type,
+            Chat.space_id,
+            Space.admin_id,
+            is_member.label("is_member"),
+            is_banned.label("is_banned"),
+            Role.permissions_mask,
+            Role.permissions
+        )
+        .select_from(Chat)
+        .outerjoin(Space, Space.id == Chat.space_id)
+        .outerjoin(Role, Role.id == func.coalesce(assigned_role_id, default_role_id))
+    )
+
+
+def _to_access(user_id: int, row) -> ChatAccess:
+    chat_id, chat_type, space_id, admin_id, member, banned, mask, permissions = row
+    if mask is None:
+        mask = compile_permissions(permissions)
+
+    return ChatAccess(
+        user_id,
+        chat_id,
+        chat_exists=True,
+        chat_type=chat_type,
+        space_id=space_id,
+        is_member=bool(member),
+        is_banned=bool(banned),
+        is_owner=admin_id is not None and admin_id == user_id,
+        mask=mask
+    )
+
+
+async def resolve_chat_access(db: AsyncSession, user_id: int, chat_id: int) -> ChatAccess:
+    """Собрать ChatAccess одним запросом к БД"""
+    row = (await db.execute(_access_query(user_id).where(Chat.id == chat_id))).first()
+    if row is None:
+        return ChatAccess(user_id, chat_id)
+    return _to_access(user_id, row)
+
+
+async def resolve_chat_access_many(db: AsyncSession, user_id: int, chat_ids: List[int]) -> Dict[int, ChatAccess]:
+    """ChatAccess сразу для нескольких чатов - тоже одним запросом (вход в комнаты после переподключения)"""
+    result = {chat_id: ChatAccess(user_id, chat_id) for chat_id in chat_ids}
+    if not chat_ids:
+        return result
+    rows = (await db.execute(_access_query(user_id).where(Chat.id.in_(chat_ids)))).all()
+    for row in rows:
+        result[row[0]] = _to_access(user_id, row)
+    return result
+
+
+async def get_chat_access(
+    chat_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+) -> ChatAccess:
+    """
+    Dependency: доступ текущего пользователя к чату из пути запроса
+
+    FastAPI кеширует dependency в пределах запроса, поэтому запрос к БД выполняется один раз
+    """
+    return await resolve_chat_access(db, current_user.id, chat_id)
@@ -1,17 +1,18 @@
-import cloudinary
-import cloudinary.uploader
+import asyncio
+import functools
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
 from fastapi import UploadFile, HTTPException
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# конфигурация Cloudinary из переменных окружения
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET")
-)
+# хранилище вложений выбирается ATTACHMENT_STORAGE (cloudinary, supabase, local), см. utils/storage_backends.py
+from utils.storage_backends import attachment_storage, STORAGE_TIMEOUT_SECONDS
+from crud.base import run_in_session
 
 # разрешённые типы файлов и размеры
 ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/gif", "image/webp"]
@@ -25,10 +26,187 @@ ALLOWED_DOCUMENT_TYPES = [
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
+# хеш содержимого считается кусками
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# загрузка в хранилище синхронная - выполняется в отдельном пуле потоков
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+# сколько загрузок одновременно (остальные ждут своей очереди, не занимая event loop)
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", str(UPLOAD_WORKERS)))
+# таймаут обращения к хранилищу (UPLOAD_TIMEOUT), передаётся в save; очередь в него не входит
+UPLOAD_TIMEOUT_SECONDS = STORAGE_TIMEOUT_SECONDS
+
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+_upload_slots: Optional[asyncio.Semaphore] = None
+
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"Файл слишком большой. Максимум: {max_size / (1024*1024)}MB"
+    )
+
+
+async def read_upload(file: UploadFile, max_size: int = MAX_FILE_SIZE, hasher=None):
+    """
+    Проверить размер загруженного файла и при необходимости посчитать хеш содержимого
+
+    Starlette уже принял файл во временный файл (file.file) до вызова обработчика - он и
+    возвращается, без копирования. Слишком большие запросы отклоняются раньше, до разбора формы
+    (utils/body_limit.py). hasher (hashlib) получает содержимое кусками.
+    Возвращает (file.file с позицией в начале, размер); закрывает его Starlette после запроса
+    """
+    if file.size is not None and file.size > max_size:
+        raise _too_large(max_size)
+
+    size = file.size
+    if size is None or hasher is not None:
+        size = 0
+        await file.seek(0)
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise _too_large(max_size)
+            if hasher is not None:
+                hasher.update(chunk)
+
+    await file.seek(0)
+    return file.file, size
+
+
+async def run_upload(func: Callable, *args, **kwargs):
+    """
+    Выполнить синхронную загрузку в хранилище в пуле потоков
+
+    Не больше UPLOAD_CONCURRENCY загрузок одновременно. Поток нельзя прервать, поэтому
+    таймаут задаётся самому обращению к хранилищу (timeout в save, клиенту Supabase - при создании).
+    Если запрос отменён (клиент отключился), run_upload всё равно дожидается потока:
+    слот освобождается только после него, а файл, который поток читает, закрывается
+    вызывающим кодом уже после завершения потока
+    """
+    global _upload_slots
+    if _upload_slots is None:
+        _upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async with _upload_slots:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_upload_executor, functools.partial(func, *args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            while not future.done():
+                try:
+                    await asyncio.wait([future])
+                except asyncio.CancelledError:
+                    pass
+            raise
+
+
+async def gather_uploads(storage, uploads: list, resource_type: str = "image") -> list:
+    """
+    Выполнить несколько run_upload(storage.save, ...) параллельно
+
+    Ждёт все загрузки, даже если одна упала (их файлы ещё читаются потоками).
+    При ошибке уже загруженные файлы удаляются и ошибка пробрасывается дальше
+    """
+    results = await asyncio.gather(*uploads, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if not errors:
+        return results
+    for result in results:
+        if not isinstance(result, BaseException):
+            await _delete_file(storage, result["public_id"], result["url"], resource_type)
+    raise errors[0]
+
+
+def content_hasher():
+    """Хеш содержимого для дедупликации вложений (BLAKE2b-256)"""
+    return hashlib.blake2b(digest_size=32)
+
+
+async def _claim_asset(content_hash: str, kind: str) -> Optional[dict]:
+    """Уже загруженный файл с таким содержимым (stored_assets) или None"""
+    from crud.asset import AssetRepository
+    try:
+        return await run_in_session(lambda db: AssetRepository(db).claim(content_hash, kind))
+    except Exception as e:
+        # индекс - только ускорение: без него файл просто загружается
+        print(f"[Upload] Asset lookup failed: {e}")
+        return None
+
+
+def _from_asset(asset: dict, size: int, **extra) -> dict:
+    """Ответ загрузки по записи stored_assets (без обращения к хранилищу)"""
+    info = {key: value for key, value in asset["info"].items() if key != "files"}
+    return {"url": asset["url"], "public_id": asset["public_id"], **info, "size": size, "asset_id": asset["id"], **extra}
+
+
+async def _delete_file(storage, public_id: str, url: str, resource_type: str):
+    try:
+        await run_upload(storage.delete, public_id, url, resource_type)
+    except Exception as e:
+        print(f"[Upload] Failed to delete {url}: {e}")
+
+
+async def _remember_asset(content_hash: str, kind: str, storage, resource_type: str,
+                          result: dict, files: list) -> dict:
+    """
+    Записать загруженный файл в stored_assets и добавить asset_id в ответ
+
+    Если тот же файл параллельно загрузил другой запрос, используется его запись,
+    а только что загруженные файлы удаляются
+    """
+    from crud.asset import AssetRepository
+
+    info = {key: value for key, value in result.items() if key not in ("url", "public_id", "size", "filename")}
+    info["files"] = files
+    try:
+        asset = await run_in_session(lambda db: AssetRepository(db).add(
+            content_hash, kind, storage.name, result["url"], result["public_id"],
+            resource_type, result["size"], info
+        ))
+        if asset is None:
+            asset = await _claim_asset(content_hash, kind)
+            if asset is None:
+                return result
+            await _delete_file(storage, result["public_id"], result["url"], resource_type)
+            for copy in files:
+                await _delete_file(storage, copy["public_id"], copy["url"], "image")
+            extra = {"filename": result["filename"]} if "filename" in result else {}
+            return _from_asset(asset, result["size"], **extra)
+    except Exception as e:
+        print(f"[Upload] Failed to remember asset: {e}")
+        return result
+    result["asset_id"] = asset["id"]
+    return result
+
+
 class FileUploader:
+    """
+    Загрузка вложений в хранилище
+
+    dedup=True (вложения сообщений): содержимое хешируется по ходу чтения, и если такой же файл
+    уже загружен, ответ собирается из stored_assets без загрузки и обработки изображения.
+    В ответе тогда есть asset_id - вложение ссылается на общий файл (refcount).
+    Стикеры и иконки пространств загружаются с dedup=False: их файлы не учитываются вложениями
+    """
+
     @staticmethod
-    async def upload_image(file: UploadFile) -> dict:
-        """Загрузить изображение"""
+    async def upload_image(file: UploadFile, thumbnails: bool = True, dedup: bool = True) -> dict:
+        """
+        Загрузить изображение
+
+        Оригинал сохраняется как есть, для ленты чата делается уменьшенная копия
+        (variants["thumb"], а также "thumb.webp" / "thumb.avif", если они легче).
+        GIF загружается без копий - уменьшенная копия потеряла бы анимацию.
+        thumbnails=False - только оригинал (стикеры, иконки пространств)
+        """
+        from utils.image_pipeline import (
+            process_image, rendition_filename, ImageError, CHAT_IMAGE_RENDITIONS, FORMAT_CONTENT_TYPES
+        )
+
         # проверка типа файла
         if file.content_type not in ALLOWED_IMAGE_TYPES:
             raise HTTPException(
@@ -36,35 +214,72 @@ class FileUploader:
                 detail=f"Недопустимый тип файла. Разрешены: {', '.join(ALLOWED_IMAGE_TYPES)}"
             )
         
-        # проверка размера
-        contents = await file.read()
-        if len(contents) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Файл слишком большой. Максимум: {MAX_FILE_SIZE / (1024*1024)}MB"
-            )
+        # чтение с проверкой размера (и хешем содержимого)
+        hasher = content_hasher() if dedup else None
+        contents, size = await read_upload(file, hasher=hasher)
+        storage = attachment_storage()
         
-        # загрузка в Cloudinary
         try:
-            result = cloudinary.uploader.upload(
+            # такой файл уже загружен - ни загрузки, ни обработки изображения
+            if hasher is not None:
+                asset = await _claim_asset(hasher.hexdigest(), "chat_images")
+                if asset is not None:
+                    return _from_asset(asset, size)
+
+            image = None
+            if thumbnails and file.content_type != "image/gif":
+                # уменьшенные копии в пуле процессов, оригинал уже в contents
+                try:
+                    image = await process_image(contents.read(), CHAT_IMAGE_RENDITIONS)
+                except ImageError:
+                    raise HTTPException(status_code=400, detail="Файл не является изображением")
+                contents.seek(0)
+
+            # загрузка в хранилище (вне event loop), оригинал и копии параллельно
+            uploads = [run_upload(
+                storage.save,
                 contents,
-                folder="chat_images",
-                resource_type="image"
-            )
+                "chat_images",
+                file.filename,
+                file.content_type,
+                resource_type="image",
+                timeout=UPLOAD_TIMEOUT_SECONDS
+            )]
+            renditions = image["renditions"] if image else {}
+            names = list(renditions)
+            base_name = os.path.splitext(os.path.basename(file.filename or "image"))[0]
+            for name in names:
+                uploads.append(run_upload(
+                    storage.save,
+                    io.BytesIO(renditions[name]["data"]),
+                    "chat_images",
+                    rendition_filename(base_name, name, renditions[name]),
+                    FORMAT_CONTENT_TYPES[renditions[name]["format"]],
+                    resource_type="image",
+                    timeout=UPLOAD_TIMEOUT_SECONDS
+                ))
+            result, *copies = await gather_uploads(storage, uploads)
             
-            return {
-                "url": result["secure_url"],
+            response = {
+                "url": result["url"],
                 "public_id": result["public_id"],
-                "width": result.get("width"),
-                "height": result.get("height"),
+                "width": result.get("width") or (image and image["width"]),
+                "height": result.get("height") or (image and image["height"]),
                 "format": result.get("format"),
-                "size": len(contents)
+                "size": size,
+                "variants": {name: copy["url"] for name, copy in zip(names, copies)} or None
             }
+            if hasher is None:
+                return response
+            files = [{"public_id": copy["public_id"], "url": copy["url"]} for copy in copies]
+            return await _remember_asset(hasher.hexdigest(), "chat_images", storage, "image", response, files)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Ошибка загрузки: {str(e)}")
     
     @staticmethod
-    async def upload_audio(file: UploadFile) -> dict:
+    async def upload_audio(file: UploadFile, dedup: bool = True) -> dict:
         """Загрузить аудио"""
         if file.content_type not in ALLOWED_AUDIO_TYPES:
             raise HTTPException(
@@ -72,32 +287,43 @@ class FileUploader:
                 detail=f"Недопустимый тип файла. Разрешены: {', '.join(ALLOWED_AUDIO_TYPES)}"
             )
         
-        contents = await file.read()
-        if len(contents) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Файл слишком большой. Максимум: {MAX_FILE_SIZE / (1024*1024)}MB"
-            )
+        hasher = content_hasher() if dedup else None
+        contents, size = await read_upload(file, hasher=hasher)
+        storage = attachment_storage()
         
         try:
-            result = cloudinary.uploader.upload(
+            if hasher is not None:
+                asset = await _claim_asset(hasher.hexdigest(), "chat_audio")
+                if asset is not None:
+                    return _from_asset(asset, size)
+
+            result = await run_upload(
+                storage.save,
                 contents,
-                folder="chat_audio",
-                resource_type="video"  # для аудио используем тип 'video'
+                "chat_audio",
+                file.filename,
+                file.content_type,
+                resource_type="video",  # для аудио в Cloudinary используем тип 'video'
+                timeout=UPLOAD_TIMEOUT_SECONDS
             )
             
-            return {
-                "url": result["secure_url"],
+            response = {
+                "url": result["url"],
                 "public_id": result["public_id"],
                 "format": result.get("format"),
-                "size": len(contents),
+                "size": size,
                 "duration": result.get("duration")
             }
+            if hasher is None:
+                return response
+            return await _remember_asset(hasher.hexdigest(), "chat_audio", storage, "video", response, [])
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Ошибка загрузки: {str(e)}")
     
     @staticmethod
-    async def upload_document(file: UploadFile) -> dict:
+    async def upload_document(file: UploadFile, dedup: bool = True) -> dict:
         """Загрузить документ"""
         if file.content_type not in ALLOWED_DOCUMENT_TYPES:
             raise HTTPException(
@@ -105,27 +331,39 @@ class FileUploader:
                 detail=f"Недопустимый тип файла. Разрешены: PDF, DOC, DOCX, TXT"
             )
         
-        contents = await file.read()
-        if len(contents) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Файл слишком большой. Максимум: {MAX_FILE_SIZE / (1024*1024)}MB"
-            )
+        hasher = content_hasher() if dedup else None
+        contents, size = await read_upload(file, hasher=hasher)
+        storage = attachment_storage()
         
         try:
-            result = cloudinary.uploader.upload(
+            if hasher is not None:
+                asset = await _claim_asset(hasher.hexdigest(), "chat_documents")
+                if asset is not None:
+                    # имя файла - своё у каждой загрузки
+                    return _from_asset(asset, size, filename=file.filename)
+
+            result = await run_upload(
+                storage.save,
                 contents,
-                folder="chat_documents",
-                resource_type="raw"  # для документов используем 'raw'
+                "chat_documents",
+                file.filename,
+                file.content_type,
+                resource_type="raw",  # для документов используем 'raw'
+                timeout=UPLOAD_TIMEOUT_SECONDS
             )
             
-            return {
-                "url": result["secure_url"],
+            response = {
+                "url": result["url"],
                 "public_id": result["public_id"],
                 "format": result.get("format"),
-                "size": len(contents),
+                "size": size,
                 "filename": file.filename
             }
+            if hasher is None:
+                return response
+            return await _remember_asset(hasher.hexdigest(), "chat_documents", storage, "raw", response, [])
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Ошибка загрузки: {str(e)}")
     
@@ -0,0 +1,194 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+# процессов для обработки изображений; 0 - обрабатывать в пуле потоков загрузки (без отдельных процессов)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+# защита от "бомб" распаковки: исходники больше этого числа пикселей отклоняются
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40 * 1000 * 1000)))
+
+# форматы, которые делаются вместе с JPEG: webp, avif (avif - если Pillow собран с его поддержкой)
+IMAGE_FORMATS = [f.strip().lower() for f in os.getenv("IMAGE_FORMATS", "webp").split(",") if f.strip()]
+
+FORMAT_CONTENT_TYPES = {"jpg": "image/jpeg", "webp": "image/webp", "avif": "image/avif"}
+_PIL_FORMATS = {"jpg": "JPEG", "webp": "WEBP", "avif": "AVIF"}
+# порядок выбора при согласовании: от обычно самого лёгкого формата к JPEG
+_NEGOTIATION_ORDER = ("avif", "webp")
+
+# размеры (вписать в прямоугольник) по назначению
+AVATAR_RENDITIONS = {"64": (64, 64), "128": (128, 128), "400": (400, 400)}
+BANNER_RENDITIONS = {"600": (600, 200), "1200": (1200, 400)}
+CHAT_IMAGE_RENDITIONS = {"thumb": (320, 320)}
+
+
+class ImageError(ValueError):
+    """Файл не удалось прочитать как изображение"""
+
+
+def _normalize(img):
+    """Привести к RGB или RGBA (если у исходника есть прозрачность)"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        return img.convert('RGBA')
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _flatten(img):
+    """Прозрачность - на белом фоне (JPEG без альфа-канала)"""
+    from PIL import Image
+
+    if img.mode != 'RGBA':
+        return img
+    background = Image.new('RGB', img.size, (255, 255, 255))
+    background.paste(img, mask=img.split()[-1])
+    return background
+
+
+def _encode(img, fmt: str, quality: int) -> bytes:
+    output = BytesIO()
+    if fmt == "jpg":
+        _flatten(img).save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+    elif fmt == "webp":
+        img.save(output, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(output, format=_PIL_FORMATS[fmt], quality=quality)
+    return output.getvalue()
+
+
+def render_image(image_bytes: bytes, renditions: Dict[str, Tuple[int, int]], quality: int = 85,
+                 formats: List[str] = None) -> Dict:
+    """
+    Сделать набор размеров изображения за одно декодирование
+
+    Выполняется в процессе пула. Размеры считаются от большего к меньшему:
+    каждый следующий уменьшается из предыдущего, а не из исходника.
+    Каждый размер кодируется в JPEG (ключ "64") и в форматы formats (ключ "64.webp").
+    WebP и AVIF сохраняют прозрачность; формат не сохраняется, если он не легче уже сделанных.
+
+    Returns:
+        {"width", "height" исходника, "renditions": {key: {"data", "width", "height", "format"}}}
+    """
+    from PIL import Image, ImageOps
+
+    # Pillow сам отклоняет только изображения больше 2 * MAX_IMAGE_PIXELS (до этого - лишь предупреждение)
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        width, height = img.size
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ImageError(f"Изображение слишком большое: {width}x{height}")
+        # JPEG декодируется сразу в уменьшенном масштабе (1/2 - 1/8), если он всё ещё не меньше нужного
+        largest = max(max(size) for size in renditions.values())
+        img.draft('RGB', (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        img = _normalize(img)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageError(str(e))
+
+    Image.init()
+    requested = formats if formats is not None else IMAGE_FORMATS
+    # WebP кодируется раньше AVIF: AVIF сохраняется, только если легче обоих
+    extra = [fmt for fmt in ("webp", "avif") if fmt in requested and _PIL_FORMATS[fmt] in Image.SAVE]
+
+    result = {}
+    source = img
+    for name, size in sorted(renditions.items(), key=lambda item: item[1][0] * item[1][1], reverse=True):
+        rendition = source.copy()
+        rendition.thumbnail(size, Image.Resampling.LANCZOS)
+        smallest = None
+        for fmt in ["jpg"] + extra:
+            data = _encode(rendition, fmt, quality)
+            if smallest is not None and len(data) >= smallest:
+                continue
+            smallest = len(data)
+            result[name if fmt == "jpg" else f"{name}.{fmt}"] = {
+                "data": data,
+                "width": rendition.width,
+                "height": rendition.height,
+                "format": fmt
+            }
+        source = rendition
+
+    return {"width": width, "height": height, "renditions": result}
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _warmup():
+    # Pillow и его плагины форматов загружаются в процессе заранее, а не на первой загрузке
+    from PIL import Image
+    Image.init()
+    return os.getpid()
+
+
+def start_image_pool():
+    """
+    Создать пул процессов (вызывается первым при старте приложения)
+
+    Процессы порождаются fork сразу, пока в приложении ещё нет других потоков
+    """
+    global _pool
+    if IMAGE_WORKERS <= 0 or _pool is not None:
+        return
+    # fork, а не spawn/forkserver: иначе каждый процесс пула заново импортирует main.py
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=context)
+    for _ in range(IMAGE_WORKERS):
+        _pool.submit(_warmup)
+
+
+def stop_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def process_image(image_bytes: bytes, renditions: Dict[str, Tuple[int, int]], quality: int = 85) -> Dict:
+    """Сделать размеры изображения вне event loop (см. render_image)"""
+    if IMAGE_WORKERS <= 0:
+        from utils.file_upload import run_upload
+        return await run_upload(render_image, image_bytes, renditions, quality, IMAGE_FORMATS)
+
+    if _pool is None:
+        start_image_pool()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_pool, render_image, image_bytes, renditions, quality, IMAGE_FORMATS)
+    except BrokenProcessPool:
+        # процесс пула упал (например, по памяти) - следующий запрос получит новый пул
+        print("[ImagePipeline] Process pool is broken, restarting")
+        stop_image_pool()
+        raise
+
+
+def rendition_filename(base_name: str, key: str, rendition: Dict) -> str:
+    """Имя файла размера: avatar_..._64.webp"""
+    return f"{base_name}_{key.split('.')[0]}.{rendition['format']}"
+
+
+def accepted_formats(accept: Optional[str]) -> List[str]:
+    """Форматы из заголовка Accept, которые лучше JPEG (image/* и */* их не подразумевают)"""
+    accept = (accept or "").lower()
+    return [fmt for fmt in _NEGOTIATION_ORDER if FORMAT_CONTENT_TYPES[fmt] in accept]
+
+
+def pick_variant(variants: Optional[Dict[str, str]], size: str, accept: Optional[str]) -> Optional[str]:
+    """
+    URL размера size в самом лёгком формате, который принимает клиент
+
+    Формат хранится, только если он легче JPEG (и WebP для AVIF), поэтому первый подходящий - самый лёгкий
+    """
+    if not variants:
+        return None
+    for fmt in accepted_formats(accept):
+        url = variants.get(f"{size}.{fmt}")
+        if url:
+            return url
+    return variants.get(size)
@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from utils.cache import register_cache
+
+# сколько последних сообщений держать на чат (не меньше максимального limit в GET /messages/{chat_id})
+HOT_CHAT_MESSAGES = int(os.getenv("HOT_CHAT_MESSAGES", "100"))
+# сколько чатов держать в памяти одновременно (LRU)
+HOT_CHAT_LIMIT = int(os.getenv("HOT_CHAT_LIMIT", "500"))
+# страховка на случай изменений в обход кеша (другой процесс, прямые правки в БД), секунды
+HOT_CHAT_TTL = float(os.getenv("HOT_CHAT_TTL", "60"))
+
+
+def serialize_message(message, reactions: list = None) -> Dict[str, Any]:
+    """Сообщение в виде MessageOut (dict) для хранения в кеше"""
+    from schemas.message import MessageOut
+
+    data = MessageOut.model_validate(message).model_dump()
+    data["reactions"] = reactions or []
+    data["my_reaction"] = None
+    return data
+
+
+class _ChatWindow:
+    """Последние сообщения одного чата (от старых к новым)"""
+    __slots__ = ("messages", "complete", "loaded_at")
+
+    def __init__(self, messages: List[Dict[str, Any]], complete: bool):
+        self.messages: "OrderedDict[int, Dict[str, Any]]" = OrderedDict(
+            (message["id"], message) for message in messages
+        )
+        # True - в чате нет сообщений старше первого в окне
+        self.complete = complete
+        self.loaded_at = time.monotonic()
+
+
+class HotMessageCache:
+    """
+    Кеш последней страницы сообщений для активных чатов
+
+    - на каждый чат хранится до HOT_CHAT_MESSAGES последних сообщений вместе со сводкой реакций
+      (только счётчики; реакция текущего пользователя дочитывается отдельно)
+    - чаты вытесняются по LRU, когда их больше HOT_CHAT_LIMIT
+    - отправка, редактирование, удаление и реакции обновляют окно сразу (write-through)
+    - если окно не может отдать нужную страницу целиком - это промах, страница читается из БД
+    - изменения считаются по номерам (version): fill не сохраняет окно, если чат изменился
+      после version(), взятого перед чтением из БД - иначе сообщение, добавленное между чтением
+      и fill, не попало бы в окно до истечения TTL
+    """
+
+    def __init__(self, name: str, max_messages: int = HOT_CHAT_MESSAGES,
+                 max_chats: int = HOT_CHAT_LIMIT, ttl: float = HOT_CHAT_TTL):
+        self.name = name
+        self.max_messages = max_messages
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._chats: "OrderedDict[int, _ChatWindow]" = OrderedDict()
+        # обращения из threadpool (def-эндпоинты) и из event loop (Socket.IO)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_fills = 0
+        # номер последнего изменения по чатам (последние max_chats изменённых чатов);
+        # для забытых чатов используется _forgotten_version - fill для них просто пропускается
+        self._version = 0
+        self._chat_versions: "OrderedDict[int, int]" = OrderedDict()
+        self._forgotten_version = 0
+        # вызывается с chat_id при каждом изменении сообщений чата в этом процессе
+        # (при нескольких процессах - рассылка сброса окна остальным, см. main.py)
+        self.on_change: Optional[Callable[[int], None]] = None
+        register_cache(self)
+
+    def _changed(self, chat_id: int):
+        # окно этого чата может быть в другом процессе, даже если здесь его нет
+        if self.on_change is not None:
+            self.on_change(chat_id)
+
+    def _bump(self, chat_id: int):
+        # вызывается под self._lock при любом изменении чата, даже если окна нет
+        self._version += 1
+        self._chat_versions[chat_id] = self._version
+        self._chat_versions.move_to_end(chat_id)
+        while len(self._chat_versions) > self.max_chats:
+            _, forgotten = self._chat_versions.popitem(last=False)
+            self._forgotten_version = max(self._forgotten_version, forgotten)
+
+    def version(self) -> int:
+        """Номер последнего изменения; берётся перед чтением окна из БД и передаётся в fill"""
+        with self._lock:
+            return self._version
+
+    def _window(self, chat_id: int) -> Optional[_ChatWindow]:
+        window = self._chats.get(chat_id)
+        if window is None:
+            return None
+        if time.monotonic() - window.loaded_at > self.ttl:
+            del self._chats[chat_id]
+            return None
+        return window
+
+    def get_latest(self, chat_id: int, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Последние limit сообщений чата или None, если страницу нельзя отдать из памяти
+
+        Возвращаются копии: my_reaction у каждого пользователя свой и заполняется вызывающим
+        """
+        with self._lock:
+            window = self._window(chat_id)
+            if window is None or (len(window.messages) < limit and not window.complete):
+                self.misses += 1
+                return None
+            self._chats.move_to_end(chat_id)
+            self.hits += 1
+            page = list(window.messages.values())[-limit:]
+
+        return [dict(message) for message in page]
+
+    def fill(self, chat_id: int, messages: List[Dict[str, Any]], complete: bool, since: int):
+        """
+        Сохранить последние сообщения чата, прочитанные из БД
+
+        since - version() перед чтением; если чат с тех пор изменился, окно не сохраняется
+        """
+        with self._lock:
+            if self._chat_versions.get(chat_id, self._forgotten_version) > since:
+                self.stale_fills += 1
+                return
+            self._chats[chat_id] = _ChatWindow(messages[-self.max_messages:], complete)
+            self._chats.move_to_end(chat_id)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+                self.evictions += 1
+
+    def add_message(self, chat_id: int, message: Dict[str, Any]):
+        """Новое сообщение (только если чат уже в кеше)"""
+        self._changed(chat_id)
+        with self._lock:
+            self._bump(chat_id)
+            window = self._window(chat_id)
+            if window is None:
+                return
+            last_id = next(reversed(window.messages), None)
+            window.messages[message["id"]] = message
+            if last_id is not None and message["id"] < last_id:
+                # сообщения из параллельных транзакций могли прийти не по порядку
+                window.messages = OrderedDict(sorted(window.messages.items()))
+            while len(window.messages) > self.max_messages:
+                window.messages.popitem(last=False)
+                window.complete = False
+
+    def update_message(self, chat_id: int, message_id: int, **fields):
+        """Изменённые поля сообщения (например, content после редактирования)"""
+        self._changed(chat_id)
+        with self._lock:
+            self._bump(chat_id)
+            window = self._window(chat_id)
+            if window is None or message_id not in window.messages:
+                return
+            window.messages[message_id] = {**window.messages[message_id], **fields}
+
+    def remove_message(self, chat_id: int, message_id: int):
+        """Удалённое сообщение; окно становится короче и при нехватке сообщений дочитается из БД"""
+        self._changed(chat_id)
+        with self._lock:
+            self._bump(chat_id)
+            window = self._window(chat_id)
+            if window is not None:
+                window.messages.pop(message_id, None)
+
+    def set_reactions(self, chat_id: int, message_id: int, reactions: list):
+        """Новая сводка реакций сообщения"""
+        self.update_message(chat_id, message_id, reactions=reactions)
+
+    def apply_reaction_deltas(self, chat_id: int, message_id: int, deltas: list):
+        """Изменения счётчиков реакций: [{"reaction", "delta"}]"""
+        self._changed(chat_id)
+        with self._lock:
+            self._bump(chat_id)
+            window = self._window(chat_id)
+            if window is None or message_id not in window.messages:
+                return
+            counts = {r["reaction"]: r["count"] for r in window.messages[message_id]["reactions"]}
+            for item in deltas:
+                counts[item["reaction"]] = counts.get(item["reaction"], 0) + item["delta"]
+            reactions = [
+                {"reaction": reaction, "count": count}
+                for reaction, count in sorted(counts.items(), key=lambda rc: (-rc[1], rc[0]))
+                if count > 0
+            ]
+            window.messages[message_id] = {**window.messages[message_id], "reactions": reactions}
+
+    def invalidate(self, chat_id: int = None):
+        """Сбросить окно чата (или весь кеш)"""
+        with self._lock:
+            if chat_id is None:
+                self._chats.clear()
+                self._chat_versions.clear()
+                self._version += 1
+                self._forgotten_version = self._version
+            else:
+                self._chats.pop(chat_id, None)
+                self._bump(chat_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики кеша"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._chats),
+            "maxsize": self.max_chats,
+            "messages": sum(len(window.messages) for window in list(self._chats.values())),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale_fills": self.stale_fills,
+            "hit_rate": round(self.hits / total, 3) if total else None
+        }
+
+
+# единственный кеш на процесс
+message_cache = HotMessageCache(name="hot_messages")
@@ -0,0 +1,144 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+from sqlalchemy import insert
+from models.base import AsyncSessionLocal, Message, MessageOutbox
+
+
+class _PendingMessage:
+    __slots__ = ("chat_id", "user_id", "content", "type", "future")
+
+    def __init__(self, chat_id: int, user_id: int, content: str, type: str, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.content = content
+        self.type = type
+        self.future = future
+
+
+class MessageIngest:
+    """
+    Write-behind запись сообщений из Socket.IO микропачками
+
+    Включается через SOCKET_MESSAGE_INGEST=batch. Проверенные сообщения ставятся в очередь,
+    раз в несколько миллисекунд очередь записывается одним многострочным
+    INSERT ... RETURNING и одним коммитом, после чего каждый отправитель получает
+    id и created_at своего сообщения и сразу делает рассылку.
+
+    Записи outbox (упоминания) добавляются в ту же транзакцию, что и пачка.
+    Если пачка не записалась (например, чат удалён), сообщения пишутся по одному,
+    чтобы ошибка досталась только своему отправителю
+    """
+
+    ENABLED = os.getenv("SOCKET_MESSAGE_INGEST", "direct") == "batch"
+    BATCH_INTERVAL_SECONDS = float(os.getenv("MESSAGE_INGEST_INTERVAL_MS", "5")) / 1000
+    BATCH_SIZE = int(os.getenv("MESSAGE_INGEST_BATCH_SIZE", "200"))
+
+    def __init__(self):
+        self._queue: List[_PendingMessage] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.messages = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Пакетная запись включена и обработчик запущен"""
+        return self.ENABLED and self._task is not None
+
+    async def submit(self, chat_id: int, user_id: int, content: str, type: str = "text") -> Dict[str, Any]:
+        """Поставить сообщение в очередь и дождаться записи; возвращает id и created_at"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append(_PendingMessage(chat_id, user_id, content, type, future))
+        self._wakeup.set()
+        return await future
+
+    async def _write(self, batch: List[_PendingMessage]) -> List[Dict[str, Any]]:
+        """Записать пачку одной транзакцией"""
+        async with AsyncSessionLocal() as db:
+            # insertmanyvalues: многострочный INSERT ... RETURNING в порядке параметров
+            rows = (await db.execute(
+                insert(Message).returning(Message.id, Message.created_at, sort_by_parameter_order=True),
+                [
+                    {"chat_id": item.chat_id, "user_id": item.user_id, "content": item.content, "type": item.type}
+                    for item in batch
+                ]
+            )).all()
+
+            outbox = [
+                {"message_id": row.id, "event_type": "message_created"}
+                for item, row in zip(batch, rows)
+                if item.content and "@" in item.content
+            ]
+            if outbox:
+                await db.execute(insert(MessageOutbox), outbox)
+            await db.commit()
+
+        if outbox:
+            from utils.outbox_worker import outbox_worker
+            outbox_worker.wake()
+
+        return [{"id": row.id, "created_at": row.created_at} for row in rows]
+
+    @staticmethod
+    def _resolve(item: _PendingMessage, result=None, error: Exception = None):
+        # отправитель мог отключиться и отменить ожидание
+        if item.future.done():
+            return
+        if error is not None:
+            item.future.set_exception(error)
+        else:
+            item.future.set_result(result)
+
+    async def flush(self):
+        """Записать всё, что накопилось в очереди"""
+        while self._queue:
+            batch, self._queue = self._queue[:self.BATCH_SIZE], self._queue[self.BATCH_SIZE:]
+            try:
+                rows = await self._write(batch)
+            except Exception as e:
+                print(f"[MessageIngest] Batch of {len(batch)} failed, writing one by one: {e}")
+                for item in batch:
+                    try:
+                        self._resolve(item, (await self._write([item]))[0])
+                    except Exception as item_error:
+                        self._resolve(item, error=item_error)
+                continue
+
+            self.batches += 1
+            self.messages += len(batch)
+            for item, row in zip(batch, rows):
+                self._resolve(item, row)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # даём пачке набраться несколько миллисекунд
+            await asyncio.sleep(self.BATCH_INTERVAL_SECONDS)
+            self._wakeup.clear()
+            try:
+                # при остановке текущая пачка дописывается до конца
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                print(f"[MessageIngest] Flush error: {e}")
+
+    def start(self):
+        """Запустить обработчик (вызывается при старте приложения, если режим включён)"""
+        if self.ENABLED and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить обработчик и записать остатки очереди"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# единственная очередь на процесс
+message_ingest = MessageIngest()
@@ -0,0 +1,157 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from models.base import AsyncSessionLocal, MessageOutbox, Message
+
+
+class OutboxWorker:
+    """
+    Фоновый обработчик transactional outbox сообщений
+
+    Сообщение и запись в message_outbox сохраняются одним коммитом, поэтому
+    отправка сообщения не ждёт упоминаний и уведомлений. Обработчик забирает
+    записи пачками (FOR UPDATE SKIP LOCKED - несколько процессов не мешают друг другу),
+    создаёт упоминания и уведомления, удаляет обработанные записи в той же транзакции
+    и после коммита рассылает события в персональные комнаты пользователей
+    """
+
+    POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+    BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+    MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def wake(self):
+        """
+        Разбудить обработчик сразу после коммита (не ждать следующего опроса)
+
+        Можно вызывать и из event loop, и из threadpool
+        """
+        if self._loop is None or self._wakeup is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # event loop уже закрыт (остановка приложения)
+            pass
+
+    def _process_batch_sync(self, db: Session) -> Tuple[int, List[Dict]]:
+        """Обработать одну пачку записей (синхронная часть, выполняется через run_sync)"""
+        from crud.notification import MentionRepository
+
+        rows = db.execute(
+            select(MessageOutbox, Message)
+            .join(Message, Message.id == MessageOutbox.message_id)
+            .where(MessageOutbox.attempts < self.MAX_ATTEMPTS)
+            .order_by(MessageOutbox.id)
+            .limit(self.BATCH_SIZE)
+            .with_for_update(skip_locked=True, of=MessageOutbox)
+        ).all()
+
+        broadcasts = []
+        mention_repo = MentionRepository(db)
+        for outbox, message in rows:
+            try:
+                # savepoint: ошибка одной записи не откатывает остальные
+                with db.begin_nested():
+                    user_ids = []
+                    if outbox.event_type == "message_created" and not message.is_deleted:
+                        user_ids = mention_repo.create_mentions(
+                            message.id, message.content, message.user_id, message.chat_id,
+                            commit=False
+                        )
+                    db.delete(outbox)
+
+                if user_ids:
+                    broadcasts.append({
+                        "message_id": message.id,
+                        "chat_id": message.chat_id,
+                        "user_ids": user_ids
+                    })
+            except Exception as e:
+                print(f"[Outbox] Failed to process outbox record {outbox.id}: {e}")
+                outbox.attempts += 1
+                outbox.last_error = str(e)[:1000]
+
+        db.commit()
+        return len(rows), broadcasts
+
+    async def _broadcast(self, broadcasts: List[Dict]):
+        """
+        Уведомить упомянутых пользователей через их персональные комнаты
+
+        Одно событие на пользователя за пачку, даже если его упомянули в нескольких сообщениях
+        """
+        from utils.socketio_instance import get_sio, user_room
+
+        sio = get_sio()
+        if not sio:
+            return
+
+        per_user: Dict[int, List[Dict]] = {}
+        for item in broadcasts:
+            mention = {'message_id': item["message_id"], 'chat_id': item["chat_id"]}
+            for user_id in item["user_ids"]:
+                per_user.setdefault(user_id, []).append(mention)
+
+        for user_id, mentions in per_user.items():
+            await sio.emit('new_notification', {
+                'type': 'mention',
+                'count': len(mentions),
+                'mentions': mentions
+            }, room=user_room(user_id))
+
+    async def process_batch(self) -> int:
+        """Обработать одну пачку; возвращает число взятых записей"""
+        async with AsyncSessionLocal() as db:
+            processed, broadcasts = await db.run_sync(self._process_batch_sync)
+        # рассылка только после коммита
+        await self._broadcast(broadcasts)
+        return processed
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                # полная пачка - значит, записи ещё есть, забираем следующую сразу
+                while await self.process_batch() >= self.BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print(f"[Outbox] Batch error: {e}")
+
+    def start(self):
+        """Запустить обработчик (вызывается при старте приложения)"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить обработчик и обработать то, что успело накопиться"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.process_batch()
+        except Exception as e:
+            print(f"[Outbox] Final batch error: {e}")
+        self._loop = None
+        self._wakeup = None
+
+
+# единственный обработчик на процесс
+outbox_worker = OutboxWorker()
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional
+import socketio
+
+# предел NOTIFY в PostgreSQL - 8000 байт, оставляем запас на служебные поля
+NOTIFY_PAYLOAD_LIMIT = 7500
+# сколько хранятся большие сообщения в socketio_payloads, секунды
+PAYLOAD_RETENTION_SECONDS = int(os.getenv("SOCKETIO_PAYLOAD_RETENTION", "60"))
+
+
+def make_asyncpg_dsn(url: str) -> str:
+    """Строка подключения для asyncpg напрямую (без указания драйвера SQLAlchemy)"""
+    for prefix in ("postgresql+psycopg2://", "postgresql+asyncpg://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql://" + url[len(prefix):]
+    return url
+
+
+class AsyncPostgresManager(socketio.AsyncPubSubManager):
+    """
+    Менеджер клиентов Socket.IO поверх PostgreSQL LISTEN/NOTIFY
+
+    Позволяет запускать несколько процессов: sio.emit(..., room=...) в одном процессе
+    доходит до сокетов во всех остальных. Отдельный брокер не нужен - используется та же БД.
+
+    - события публикуются через pg_notify в канал channel
+    - каждый процесс держит одно соединение с LISTEN и переподключается при обрыве
+    - сообщения больше предела NOTIFY кладутся в таблицу socketio_payloads,
+      а в канал уходит только ссылка на запись
+    - кроме событий Socket.IO по каналу можно рассылать служебные сообщения
+      между процессами (см. on и publish)
+    """
+
+    name = "postgres"
+
+    def __init__(self, url: str, channel: str = "socketio", write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.dsn = make_asyncpg_dsn(url)
+        self._pool = None
+        self._pool_lock: Optional[asyncio.Lock] = None
+        self._listen_conn = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # служебные сообщения: method -> обработчик(data)
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+        # вызываются для каждого emit из других процессов (например, журнал событий комнат)
+        self._emit_hooks: List[Callable[[Dict[str, Any]], None]] = []
+
+    def initialize(self):
+        self._loop = asyncio.get_running_loop()
+        super().initialize()
+
+    async def _get_pool(self):
+        """Пул соединений для публикации (создаётся при первом сообщении)"""
+        if self._pool is None:
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                if self._pool is None:
+                    import asyncpg
+                    self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=5)
+        return self._pool
+
+    async def _publish(self, data):
+        payload = json.dumps(data, default=str)
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            if len(payload.encode("utf-8")) > NOTIFY_PAYLOAD_LIMIT:
+                payload_id = await conn.fetchval(
+                    "INSERT INTO socketio_payloads (data) VALUES ($1) RETURNING id", payload
+                )
+                # заодно удаляем ссылки, которые все процессы уже прочитали
+                await conn.execute(
+                    "DELETE FROM socketio_payloads WHERE created_at < now() - make_interval(secs => $1)",
+                    PAYLOAD_RETENTION_SECONDS
+                )
+                payload = json.dumps({"ref": payload_id})
+            await conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._queue.put_nowait(payload)
+
+    async def _connect_listener(self):
+        import asyncpg
+
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        await self._listen_conn.add_listener(self.channel, self._on_notify)
+
+    async def _decode(self, payload: str) -> Optional[Dict[str, Any]]:
+        data = json.loads(payload)
+        if "ref" in data and "method" not in data:
+            pool = await self._get_pool()
+            async with pool.acquire() as conn:
+                stored = await conn.fetchval(
+                    "SELECT data FROM socketio_payloads WHERE id = $1", data["ref"]
+                )
+            if stored is None:
+                self._get_logger().warning("socketio payload %s expired", data["ref"])
+                return None
+            data = json.loads(stored)
+        return data
+
+    async def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                if self._listen_conn is None or self._listen_conn.is_closed():
+                    await self._connect_listener()
+                    retry_sleep = 1
+                try:
+                    payload = await asyncio.wait_for(self._queue.get(), timeout=5)
+                except asyncio.TimeoutError:
+                    # заодно проверяем, что соединение с LISTEN живо
+                    continue
+                data = await self._decode(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._get_logger().error(
+                    "Cannot receive from postgres: %s, retrying in %s secs", e, retry_sleep
+                )
+                self._listen_conn = None
+                await asyncio.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
+                continue
+
+            if data is None:
+                continue
+            handler = self._handlers.get(data.get("method"))
+            if handler is not None:
+                # служебное сообщение: свой процесс уже применил изменение сам
+                if data.get("host_id") != self.host_id:
+                    try:
+                        handler(data)
+                    except Exception as e:
+                        self._get_logger().error("Handler error for %s: %s", data.get("method"), e)
+                continue
+            if data.get("method") == "emit" and data.get("host_id") != self.host_id:
+                for hook in self._emit_hooks:
+                    try:
+                        hook(data)
+                    except Exception as e:
+                        self._get_logger().error("Emit hook error: %s", e)
+            yield data
+
+    def on(self, method: str, handler: Callable[[Dict[str, Any]], None]):
+        """Обработчик служебного сообщения от других процессов"""
+        self._handlers[method] = handler
+
+    def on_emit(self, hook: Callable[[Dict[str, Any]], None]):
+        """Обработчик событий, отправленных другими процессами"""
+        self._emit_hooks.append(hook)
+
+    async def next_room_seq(self, room_id: str) -> int:
+        """Следующий номер события комнаты (общий счётчик всех процессов)"""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            return await conn.fetchval(
+                "INSERT INTO room_event_counters (room_id, seq) VALUES ($1, 1) "
+                "ON CONFLICT (room_id) DO UPDATE SET seq = room_event_counters.seq + 1 "
+                "RETURNING seq",
+                room_id
+            )
+
+    async def current_room_seq(self, room_id: str) -> int:
+        """Номер последнего события комнаты"""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            seq = await conn.fetchval("SELECT seq FROM room_event_counters WHERE room_id = $1", room_id)
+        return seq or 0
+
+    async def current_room_seqs(self, room_ids: List[str]) -> Dict[str, int]:
+        """Номера последних событий нескольких комнат одним запросом"""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT room_id, seq FROM room_event_counters WHERE room_id = ANY($1::text[])",
+                list(room_ids)
+            )
+        seqs = {room_id: 0 for room_id in room_ids}
+        seqs.update({row["room_id"]: row["seq"] for row in rows})
+        return seqs
+
+    def publish(self, method: str, **data):
+        """
+        Разослать служебное сообщение другим процессам
+
+        Можно вызывать и из event loop, и из threadpool; до старта менеджера ничего не делает
+        """
+        if self._loop is None:
+            return
+        message = {"method": method, "host_id": self.host_id, **data}
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._loop.create_task(self._safe_publish(message))
+        else:
+            try:
+                asyncio.run_coroutine_threadsafe(self._safe_publish(message), self._loop)
+            except RuntimeError:
+                # event loop уже закрыт (остановка приложения)
+                pass
+
+    async def _safe_publish(self, message: Dict[str, Any]):
+        try:
+            await self._publish(message)
+        except Exception as e:
+            self._get_logger().error("Cannot publish %s: %s", message.get("method"), e)
+
+    async def close(self):
+        """Закрыть соединения (при остановке приложения)"""
+        if self._listen_conn is not None and not self._listen_conn.is_closed():
+            await self._listen_conn.close()
+        self._listen_conn = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
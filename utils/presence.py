@@ -0,0 +1,240 @@
+import asyncio
+import os
+import threading
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
+from sqlalchemy import select
+from models.base import AsyncSessionLocal, Chat, ChatParticipant
+from utils.cache import TTLCache
+from utils.socketio_instance import get_sio, user_room, space_room
+
+# окно склейки изменений статуса, миллисекунды
+PRESENCE_COALESCE_SECONDS = float(os.getenv("PRESENCE_COALESCE_MS", "250")) / 1000
+# сколько пользователей держать в индексе user -> spaces
+PRESENCE_INDEX_SIZE = int(os.getenv("PRESENCE_INDEX_SIZE", "50000"))
+# индекс обновляется при вступлении и выходе, TTL - только страховка от рассинхронизации
+PRESENCE_INDEX_TTL = float(os.getenv("PRESENCE_INDEX_TTL", "600"))
+# сколько раз перечитать пространства пользователя, если состав менялся во время чтения
+_LOAD_ATTEMPTS = 3
+
+
+class PresenceFanout:
+    """
+    Рассылка статусов пользователей только тем, кто с ними в одном пространстве
+
+    - индекс user_id -> пространства пользователя хранится в памяти
+      (загружается из БД при первом обращении, дальше обновляется при join/kick/leave)
+    - при подключении сокет входит в комнаты space:{id} всех пространств пользователя,
+      при вступлении и выходе сокеты пользователя переводятся между комнатами
+    - изменения статуса склеиваются за PRESENCE_COALESCE_MS: уходит только последний статус,
+      одним emit на список комнат (сокет, который есть в нескольких комнатах, получит событие один раз)
+
+    membership_changed вызывается из репозиториев (в т.ч. из threadpool), остальное - из event loop
+    """
+
+    def __init__(self):
+        self._index = TTLCache(maxsize=PRESENCE_INDEX_SIZE, ttl=PRESENCE_INDEX_TTL, name="presence_index")
+        # чтение-изменение-запись индекса из разных потоков
+        self._lock = threading.Lock()
+        # пользователи, чьи пространства сейчас читаются из БД: user_id -> число чтений,
+        # и сколько раз их состав менялся во время чтения (см. spaces_of)
+        self._loading: Dict[int, int] = {}
+        self._changes: Dict[int, int] = {}
+        # user_id -> (nickname, status), ещё не разосланные
+        self._pending: Dict[int, Tuple[str, str]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # вызывается при изменении состава пространства (рассылка другим процессам);
+        # user_id=None - пространство удалено
+        self.on_change: Optional[Callable[[Optional[int], int, bool], None]] = None
+        self.sent = 0
+        self.coalesced = 0
+
+    async def _load_spaces(self, user_id: int) -> FrozenSet[int]:
+        async with AsyncSessionLocal() as db:
+            rows = await db.scalars(
+                select(Chat.space_id)
+                .join(ChatParticipant, ChatParticipant.chat_id == Chat.id)
+                .where(
+                    ChatParticipant.user_id == user_id,
+                    ChatParticipant.is_active == True,
+                    Chat.space_id.isnot(None)
+                )
+            )
+            return frozenset(rows.all())
+
+    async def spaces_of(self, user_id: int) -> FrozenSet[int]:
+        """
+        Пространства пользователя (из индекса или одним запросом)
+
+        Если во время запроса пользователь вступил в пространство или был исключён,
+        прочитанный состав мог устареть - он не кладётся в индекс и перечитывается
+        """
+        user_id = int(user_id)
+        spaces = self._index.get(user_id)
+        if spaces is not None:
+            return spaces
+
+        for _ in range(_LOAD_ATTEMPTS):
+            with self._lock:
+                self._loading[user_id] = self._loading.get(user_id, 0) + 1
+                changes = self._changes.get(user_id, 0)
+            try:
+                spaces = await self._load_spaces(user_id)
+            finally:
+                with self._lock:
+                    changed = self._changes.get(user_id, 0) != changes
+                    self._loading[user_id] -= 1
+                    if not self._loading[user_id]:
+                        del self._loading[user_id]
+                        self._changes.pop(user_id, None)
+
+            if changed:
+                continue
+            with self._lock:
+                # пока шёл запрос, индекс мог обновиться - он свежее
+                current = self._index.get(user_id)
+                if current is not None:
+                    return current
+                self._index.set(user_id, spaces)
+            return spaces
+        # состав меняется прямо сейчас - отдаём последнее прочитанное без кеширования
+        return spaces
+
+    async def join_socket(self, sio, sid: str, user_id: int):
+        """Ввести новое подключение в комнаты пространств пользователя"""
+        for space_id in await self.spaces_of(user_id):
+            await sio.enter_room(sid, space_room(space_id))
+
+    def membership_changed(self, user_id: int, space_id: int, joined: bool):
+        """Пользователь вступил в пространство или покинул его (после коммита)"""
+        self.apply_membership(user_id, space_id, joined)
+        if self.on_change is not None:
+            self.on_change(user_id, space_id, joined)
+
+    def apply_membership(self, user_id: int, space_id: int, joined: bool):
+        """Обновить индекс и комнаты локальных сокетов пользователя"""
+        user_id, space_id = int(user_id), int(space_id)
+        with self._lock:
+            if user_id in self._loading:
+                self._changes[user_id] = self._changes.get(user_id, 0) + 1
+            spaces = self._index.get(user_id)
+            # пользователя нет в индексе - при следующем обращении прочитаем из БД
+            if spaces is not None:
+                self._index.set(user_id, spaces | {space_id} if joined else spaces - {space_id})
+        self._schedule(self._move_sockets(user_id, space_id, joined))
+
+    def space_removed(self, space_id: int):
+        """Пространство удалено"""
+        self.apply_space_removed(space_id)
+        if self.on_change is not None:
+            self.on_change(None, space_id, False)
+
+    def apply_space_removed(self, space_id: int):
+        space_id = int(space_id)
+        with self._lock:
+            # у читающихся сейчас пользователей это пространство могло попасть в результат
+            for user_id in self._loading:
+                self._changes[user_id] = self._changes.get(user_id, 0) + 1
+        self._index.pop_where(lambda user_id, spaces: space_id in spaces)
+        self._schedule(self._close_room(space_id))
+
+    async def _move_sockets(self, user_id: int, space_id: int, joined: bool):
+        sio = get_sio()
+        if sio is None:
+            return
+        room = space_room(space_id)
+        # только подключения этого процесса - остальные процессы делают то же у себя
+        sids = [sid for sid, _ in sio.manager.get_participants('/', user_room(user_id))]
+        for sid in sids:
+            if joined:
+                await sio.enter_room(sid, room)
+            else:
+                await sio.leave_room(sid, room)
+
+    async def _close_room(self, space_id: int):
+        sio = get_sio()
+        if sio is not None:
+            await sio.close_room(space_room(space_id))
+
+    def _schedule(self, coro):
+        """Запустить корутину в event loop приложения из любого потока"""
+        if self._loop is None:
+            coro.close()
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._loop.create_task(coro)
+        else:
+            try:
+                asyncio.run_coroutine_threadsafe(coro, self._loop)
+            except RuntimeError:
+                # event loop уже закрыт (остановка приложения)
+                coro.close()
+
+    async def status_changed(self, user_id: int, nickname: str, status: str):
+        """Поставить изменение статуса в рассылку"""
+        user_id = int(user_id)
+        if self._task is None:
+            await self._emit(user_id, nickname, status)
+            return
+        if user_id in self._pending:
+            self.coalesced += 1
+        self._pending[user_id] = (nickname, status)
+        self._wakeup.set()
+
+    async def _emit(self, user_id: int, nickname: str, status: str):
+        sio = get_sio()
+        if sio is None:
+            return
+        # пространства пользователя и его собственные подключения (другие вкладки)
+        rooms = [space_room(space_id) for space_id in await self.spaces_of(user_id)]
+        rooms.append(user_room(user_id))
+        await sio.emit('user_status_changed', {
+            'user_id': user_id,
+            'nickname': nickname,
+            'status': status
+        }, room=rooms)
+        self.sent += 1
+
+    async def flush(self):
+        """Разослать накопленные изменения статусов"""
+        batch, self._pending = self._pending, {}
+        for user_id, (nickname, status) in batch.items():
+            try:
+                await self._emit(user_id, nickname, status)
+            except Exception as e:
+                print(f"[Presence] Emit error for user {user_id}: {e}")
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # даём изменениям склеиться
+            await asyncio.sleep(PRESENCE_COALESCE_SECONDS)
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Запустить рассылку (вызывается при старте приложения)"""
+        self._loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить рассылку и отправить оставшееся"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+# единственный экземпляр на процесс
+presence = PresenceFanout()
@@ -0,0 +1,454 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy import select
+from models.base import AsyncSessionLocal, User
+from utils.cache import register_cache
+from utils.presence import presence
+
+# статусы, установленные вручную - автоматически не меняются
+MANUAL_STATUSES = ("away", "dnd", "offline")
+# порядок при объединении статусов из разных процессов
+_RANK = {"online": 3, "dnd": 2, "away": 1, "offline": 0}
+
+# без активности дольше - away, дольше AWAY - offline (как в ActivityRepository)
+ONLINE_THRESHOLD_SECONDS = float(os.getenv("PRESENCE_ONLINE_SECONDS", "300"))
+AWAY_THRESHOLD_SECONDS = float(os.getenv("PRESENCE_AWAY_SECONDS", "900"))
+# после закрытия последнего сокета пользователь offline через столько секунд (перезагрузка вкладки)
+DISCONNECT_GRACE_SECONDS = float(os.getenv("PRESENCE_DISCONNECT_GRACE", "30"))
+# шаг и размер колеса таймеров
+TICK_SECONDS = float(os.getenv("PRESENCE_TICK_SECONDS", "1"))
+WHEEL_SLOTS = 1024
+# несколько процессов: как часто процесс сообщает остальным, что жив, и через сколько
+# секунд без вестей статусы его пользователей перестают учитываться (процесс упал или перезапущен)
+HOST_HEARTBEAT_SECONDS = float(os.getenv("PRESENCE_HOST_HEARTBEAT", "15"))
+HOST_TIMEOUT_SECONDS = float(os.getenv("PRESENCE_HOST_TIMEOUT", "60"))
+
+
+class _UserPresence:
+    __slots__ = ("sockets", "last_active", "last_seen", "offline_at", "manual", "manual_loaded",
+                 "local", "deadline", "nickname")
+
+    def __init__(self, now: float):
+        self.sockets = 0
+        self.last_active = now
+        self.last_seen = datetime.now()  # Без timezone
+        self.offline_at: Optional[float] = None
+        self.manual: Optional[str] = None
+        self.manual_loaded = False
+        # последний статус этого процесса, о котором знают остальные
+        self.local: Optional[str] = None
+        self.deadline: Optional[int] = None
+        self.nickname: Optional[str] = None
+
+
+class PresenceRegistry:
+    """
+    Статусы присутствия пользователей в памяти
+
+    - питается подключениями и отключениями сокетов и активностью (запросы, heartbeat)
+    - переходы online -> away -> offline считает колесо таймеров: у каждого пользователя
+      не больше одного дедлайна, раз в TICK_SECONDS обрабатывается одна ячейка колеса
+    - о переходах рассылает PresenceFanout (только соседям по пространствам)
+    - чтения статуса отвечаются из памяти; в БД остаются только last_seen (ActivityBuffer)
+      и статус, выбранный вручную
+    - пользователи без сокетов и без активности из памяти удаляются - их статус читается из БД
+
+    Несколько процессов: каждый процесс считает статус по своим подключениям и рассылает его
+    остальным (on_local_change / apply_remote), итоговый статус - лучший из всех процессов.
+    Процессы раз в HOST_HEARTBEAT_SECONDS сообщают, что живы (on_heartbeat / host_alive);
+    статусы процесса, от которого нет вестей HOST_TIMEOUT_SECONDS, отбрасываются
+    """
+
+    def __init__(self):
+        self._users: Dict[int, _UserPresence] = {}
+        # user_id -> {host_id: (статус, last_seen)} по данным других процессов
+        self._remote: Dict[int, Dict[str, Tuple[str, Optional[datetime]]]] = {}
+        # последний разосланный клиентам статус
+        self._published: Dict[int, str] = {}
+        # host_id других процессов -> когда от них последний раз были вести (monotonic)
+        self._hosts: Dict[str, float] = {}
+        self._next_heartbeat = 0.0
+        # host_id этого процесса (задаётся при нескольких процессах)
+        self.host_id: Optional[str] = None
+        self._slots: List[Set[int]] = [set() for _ in range(WHEEL_SLOTS)]
+        self._origin = time.monotonic()
+        self._tick = 0
+        # connect/touch вызываются и из threadpool
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # рассылка статуса этого процесса другим процессам: (user_id, status, last_seen)
+        self.on_local_change: Optional[Callable[[int, str, Optional[datetime]], None]] = None
+        # рассылка статуса, выбранного вручную
+        self.on_manual_change: Optional[Callable[[int, Optional[str]], None]] = None
+        # сообщение другим процессам, что этот процесс жив
+        self.on_heartbeat: Optional[Callable[[], None]] = None
+        self.expired_hosts = 0
+        self.name = "presence"
+        self.transitions = 0
+        register_cache(self)
+
+    # --- колесо таймеров ---
+
+    def _schedule(self, user_id: int, state: _UserPresence, at: Optional[float]):
+        """Назначить пересчёт статуса на момент at (None - сразу на ближайшем тике)"""
+        tick = self._tick + 1
+        if at is not None:
+            tick = max(tick, math.ceil((at - self._origin) / TICK_SECONDS))
+        state.deadline = tick
+        self._slots[tick % WHEEL_SLOTS].add(user_id)
+
+    def _take_due(self, tick: int) -> List[int]:
+        slot = self._slots[tick % WHEEL_SLOTS]
+        due = []
+        for user_id in list(slot):
+            state = self._users.get(user_id)
+            if state is None or state.deadline is None or state.deadline % WHEEL_SLOTS != tick % WHEEL_SLOTS:
+                # дедлайн перенесён в другую ячейку
+                slot.discard(user_id)
+            elif state.deadline <= tick:
+                slot.discard(user_id)
+                state.deadline = None
+                due.append(user_id)
+            # иначе дедлайн через полный оборот колеса
+        return due
+
+    # --- события ---
+
+    def _get_state(self, user_id: int, now: float) -> _UserPresence:
+        state = self._users.get(user_id)
+        if state is None:
+            state = _UserPresence(now)
+            self._users[user_id] = state
+        return state
+
+    def _activity(self, user_id: int, nickname: Optional[str] = None) -> _UserPresence:
+        now = time.monotonic()
+        state = self._get_state(int(user_id), now)
+        state.last_active = now
+        state.last_seen = datetime.now()
+        state.offline_at = None
+        if nickname:
+            state.nickname = nickname
+        if state.local != self._compute(state, now) or state.deadline is None:
+            self._schedule(int(user_id), state, None)
+        return state
+
+    def touch(self, user_id: int):
+        """Активность пользователя (HTTP-запрос, heartbeat)"""
+        with self._lock:
+            self._activity(user_id)
+
+    def connect(self, user_id: int, nickname: str = None):
+        """Открыт сокет пользователя"""
+        with self._lock:
+            self._activity(user_id, nickname).sockets += 1
+
+    def disconnect(self, user_id: int):
+        """Закрыт сокет пользователя"""
+        user_id = int(user_id)
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                return
+            state.sockets = max(0, state.sockets - 1)
+            if state.sockets == 0:
+                state.offline_at = time.monotonic() + DISCONNECT_GRACE_SECONDS
+                self._schedule(user_id, state, state.offline_at)
+
+    def set_manual(self, user_id: int, status: str, nickname: str = None):
+        """Пользователь выбрал статус (online снимает ручной статус)"""
+        self.apply_manual(user_id, status, nickname)
+        if self.on_manual_change is not None:
+            self.on_manual_change(int(user_id), status)
+
+    def apply_manual(self, user_id: int, status: Optional[str], nickname: str = None):
+        user_id = int(user_id)
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                if nickname is None:
+                    # пользователь не активен в этом процессе - статус прочитается из БД при появлении
+                    return
+                state = self._get_state(user_id, time.monotonic())
+            state.manual = status if status in MANUAL_STATUSES else None
+            state.manual_loaded = True
+            if nickname:
+                state.nickname = nickname
+            self._schedule(user_id, state, None)
+
+    # --- вычисление статуса ---
+
+    @staticmethod
+    def _compute(state: _UserPresence, now: float) -> str:
+        if state.manual:
+            return state.manual
+        if state.sockets == 0 and state.offline_at is not None and now >= state.offline_at:
+            return "offline"
+        idle = now - state.last_active
+        if idle < ONLINE_THRESHOLD_SECONDS:
+            return "online"
+        if state.sockets > 0 or idle < AWAY_THRESHOLD_SECONDS:
+            return "away"
+        return "offline"
+
+    @staticmethod
+    def _gone(state: _UserPresence, now: float) -> bool:
+        """Нет сокетов и давно нет активности - пользователя можно убрать из памяти"""
+        if state.sockets > 0:
+            return False
+        if state.offline_at is not None and now >= state.offline_at:
+            return True
+        return now - state.last_active >= AWAY_THRESHOLD_SECONDS
+
+    @staticmethod
+    def _next_deadline(state: _UserPresence, now: float) -> Optional[float]:
+        """Когда статус может смениться сам по себе"""
+        candidates = [t for t in (
+            None if state.manual else state.last_active + ONLINE_THRESHOLD_SECONDS,
+            state.last_active + AWAY_THRESHOLD_SECONDS if state.sockets == 0 else None,
+            state.offline_at
+        ) if t is not None and t > now]
+        return min(candidates) if candidates else None
+
+    def _merged(self, user_id: int, local: Optional[str]) -> Optional[str]:
+        statuses = [status for status, _ in self._remote.get(user_id, {}).values()]
+        if local is not None:
+            statuses.append(local)
+        if not statuses:
+            return None
+        return max(statuses, key=lambda status: _RANK.get(status, 0))
+
+    def status_of(self, user_id: int) -> Optional[Tuple[str, Optional[datetime]]]:
+        """(статус, last_seen) из памяти или None, если пользователь здесь неизвестен"""
+        user_id = int(user_id)
+        with self._lock:
+            state = self._users.get(user_id)
+            local = None
+            last_seen = None
+            if state is not None and state.manual_loaded:
+                local = self._compute(state, time.monotonic())
+                last_seen = state.last_seen
+            status = self._merged(user_id, local)
+            if status is None:
+                return None
+            for _, remote_seen in self._remote.get(user_id, {}).values():
+                if remote_seen is not None and (last_seen is None or remote_seen > last_seen):
+                    last_seen = remote_seen
+            return status, last_seen
+
+    def current_status(self, user_id: int, stored_status: str = None) -> str:
+        """Статус из памяти; неизвестный пользователь - offline или его ручной статус из БД"""
+        live = self.status_of(user_id)
+        if live is not None:
+            return live[0]
+        return stored_status if stored_status in MANUAL_STATUSES else "offline"
+
+    def active_user_ids(self) -> List[int]:
+        """Пользователи в статусе online или away"""
+        with self._lock:
+            user_ids = set(self._users) | set(self._remote)
+        result = []
+        for user_id in user_ids:
+            live = self.status_of(user_id)
+            if live is not None and live[0] in ("online", "away"):
+                result.append(user_id)
+        return result
+
+    # --- другие процессы ---
+
+    def apply_remote(self, host_id: str, user_id: int, status: str, last_seen: Optional[datetime]):
+        """Статус пользователя по подключениям другого процесса"""
+        user_id = int(user_id)
+        with self._lock:
+            self._hosts[host_id] = time.monotonic()
+            hosts = self._remote.setdefault(user_id, {})
+            if status == "offline":
+                hosts.pop(host_id, None)
+                if not hosts:
+                    del self._remote[user_id]
+            else:
+                hosts[host_id] = (status, last_seen)
+            # рассылку клиентам делает процесс, где статус изменился
+            merged = self._merged(user_id, self._local_status(user_id))
+            if merged is None:
+                self._published.pop(user_id, None)
+            else:
+                self._published[user_id] = merged
+
+    def host_alive(self, host_id: str):
+        """Другой процесс сообщил, что жив"""
+        with self._lock:
+            self._hosts[host_id] = time.monotonic()
+
+    async def _expire_hosts(self):
+        """Отбросить статусы процессов, от которых давно нет вестей"""
+        now = time.monotonic()
+        with self._lock:
+            dead = {host_id for host_id, heard in self._hosts.items() if now - heard > HOST_TIMEOUT_SECONDS}
+            if not dead:
+                return
+            for host_id in dead:
+                del self._hosts[host_id]
+            # изменения клиентам рассылает один из оставшихся процессов (с меньшим host_id)
+            alive = set(self._hosts)
+            if self.host_id is not None:
+                alive.add(self.host_id)
+            leader = self.host_id is None or self.host_id == min(alive)
+
+            broadcasts = []
+            for user_id in list(self._remote):
+                hosts = self._remote[user_id]
+                if not dead & set(hosts):
+                    continue
+                for host_id in dead:
+                    hosts.pop(host_id, None)
+                if not hosts:
+                    del self._remote[user_id]
+                merged = self._merged(user_id, self._local_status(user_id)) or "offline"
+                if merged != self._published.get(user_id):
+                    state = self._users.get(user_id)
+                    broadcasts.append((user_id, state.nickname if state is not None else None, merged))
+                if merged == "offline" and user_id not in self._users and user_id not in self._remote:
+                    self._published.pop(user_id, None)
+                else:
+                    self._published[user_id] = merged
+
+        self.expired_hosts += len(dead)
+        print(f"[Presence] No heartbeat from {len(dead)} host(s), dropped their statuses")
+        if leader:
+            for user_id, nickname, status in broadcasts:
+                await presence.status_changed(user_id, nickname, status)
+
+    async def _heartbeat(self):
+        now = time.monotonic()
+        if now < self._next_heartbeat:
+            return
+        self._next_heartbeat = now + HOST_HEARTBEAT_SECONDS
+        if self.on_heartbeat is not None:
+            self.on_heartbeat()
+        await self._expire_hosts()
+
+    def _local_status(self, user_id: int) -> Optional[str]:
+        state = self._users.get(user_id)
+        return state.local if state is not None else None
+
+    # --- обработка тиков ---
+
+    async def _load_manual(self, user_ids: List[int]):
+        """Статусы, выбранные вручную, для новых пользователей (одним запросом)"""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(User.id, User.status, User.nickname).where(User.id.in_(user_ids))
+            )).all()
+        with self._lock:
+            for user_id, status, nickname in rows:
+                state = self._users.get(user_id)
+                if state is not None:
+                    state.manual = status if status in MANUAL_STATUSES else None
+                    state.nickname = state.nickname or nickname
+            for user_id in user_ids:
+                state = self._users.get(user_id)
+                if state is not None:
+                    state.manual_loaded = True
+
+    async def advance(self):
+        """Обработать наступившие тики колеса"""
+        target = int((time.monotonic() - self._origin) / TICK_SECONDS)
+        with self._lock:
+            due: List[int] = []
+            while self._tick < target:
+                self._tick += 1
+                due.extend(self._take_due(self._tick))
+            unloaded = [user_id for user_id in due if not self._users[user_id].manual_loaded]
+
+        if unloaded:
+            try:
+                await self._load_manual(unloaded)
+            except Exception as e:
+                print(f"[Presence] Cannot load statuses: {e}")
+                with self._lock:
+                    for user_id in unloaded:
+                        state = self._users.get(user_id)
+                        if state is not None:
+                            self._schedule(user_id, state, None)
+                due = [user_id for user_id in due if user_id not in unloaded]
+
+        changes = []
+        now = time.monotonic()
+        with self._lock:
+            for user_id in due:
+                state = self._users.get(user_id)
+                if state is None:
+                    continue
+                gone = self._gone(state, now)
+                # ушедший пользователь для остальных offline, даже с ручным статусом
+                status = "offline" if gone else self._compute(state, now)
+                if status != state.local:
+                    state.local = status
+                    changes.append((user_id, status, state.last_seen, state.nickname))
+
+                if gone:
+                    # дальше статус читается из БД
+                    del self._users[user_id]
+                else:
+                    deadline = self._next_deadline(state, now)
+                    if deadline is not None:
+                        self._schedule(user_id, state, deadline)
+
+            broadcasts = []
+            for user_id, status, _, nickname in changes:
+                merged = self._merged(user_id, status)
+                if merged != self._published.get(user_id):
+                    self._published[user_id] = merged
+                    broadcasts.append((user_id, nickname, merged))
+                if merged == "offline" and user_id not in self._users and user_id not in self._remote:
+                    self._published.pop(user_id, None)
+
+        for user_id, status, last_seen, _ in changes:
+            self.transitions += 1
+            if self.on_local_change is not None:
+                self.on_local_change(user_id, status, last_seen)
+        for user_id, nickname, status in broadcasts:
+            await presence.status_changed(user_id, nickname, status)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(TICK_SECONDS)
+            try:
+                await self.advance()
+                await self._heartbeat()
+            except Exception as e:
+                print(f"[Presence] Tick error: {e}")
+
+    def start(self):
+        """Запустить колесо таймеров (вызывается при старте приложения)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        """Метрики реестра"""
+        return {
+            "size": len(self._users),
+            "remote": len(self._remote),
+            "hosts": len(self._hosts),
+            "expired_hosts": self.expired_hosts,
+            "transitions": self.transitions
+        }
+
+
+# единственный реестр на процесс
+presence_registry = PresenceRegistry()
@@ -0,0 +1,146 @@
+import os
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from utils.cache import register_cache
+
+# сколько последних событий хранить на комнату
+ROOM_EVENT_LOG_SIZE = int(os.getenv("ROOM_EVENT_LOG_SIZE", "200"))
+# сколько комнат держать в памяти (LRU); для вытесненной комнаты клиент получит resync
+ROOM_EVENT_ROOMS = int(os.getenv("ROOM_EVENT_ROOMS", "2000"))
+
+# события комнаты, которые получают номер и попадают в журнал
+SEQUENCED_EVENTS = frozenset({
+    'new_message', 'message_edited', 'message_deleted', 'reaction_updated', 'user_kicked'
+})
+
+# (seq, event, data)
+RoomEvent = Tuple[int, str, Dict[str, Any]]
+
+
+class RoomEventLog:
+    """
+    Журнал событий комнат Socket.IO для досылки после переподключения
+
+    - каждое событие комнаты получает номер seq, монотонный в пределах комнаты
+    - последние ROOM_EVENT_LOG_SIZE событий комнаты хранятся в кольцевом буфере
+    - resume(after_seq) отдаёт пропущенные события или None, если их уже нет в буфере
+      (клиент должен перечитать историю по HTTP)
+    - epoch меняется при перезапуске процесса: номера из старой эпохи недействительны
+
+    Один процесс: номера выдаются в памяти. Несколько процессов: номера выдаёт БД
+    (см. use_shared_sequence), события других процессов приходят через менеджер Socket.IO.
+    Используется только из event loop
+    """
+
+    def __init__(self, name: str, max_events: int = ROOM_EVENT_LOG_SIZE, max_rooms: int = ROOM_EVENT_ROOMS):
+        self.name = name
+        self.max_events = max_events
+        self.max_rooms = max_rooms
+        self.epoch = uuid.uuid4().hex
+        # номера не вытесняются вместе с буфером, иначе они начнутся заново
+        self._seq: Dict[str, int] = {}
+        self._rings: "OrderedDict[str, deque]" = OrderedDict()
+        self._allocate: Optional[Callable[[str], Awaitable[int]]] = None
+        self._current: Optional[Callable[[str], Awaitable[int]]] = None
+        self._current_many: Optional[Callable[[List[str]], Awaitable[Dict[str, int]]]] = None
+        self.replayed = 0
+        self.resyncs = 0
+        register_cache(self)
+
+    def use_shared_sequence(self, epoch: str, allocate: Callable[[str], Awaitable[int]],
+                            current: Callable[[str], Awaitable[int]],
+                            current_many: Callable[[List[str]], Awaitable[Dict[str, int]]] = None):
+        """Выдавать номера из общего для всех процессов счётчика"""
+        self.epoch = epoch
+        self._allocate = allocate
+        self._current = current
+        self._current_many = current_many
+
+    async def next_seq(self, room_id: str) -> int:
+        if self._allocate is not None:
+            seq = await self._allocate(room_id)
+        else:
+            seq = self._seq.get(room_id, 0) + 1
+        self._seq[room_id] = max(seq, self._seq.get(room_id, 0))
+        return seq
+
+    async def current_seq(self, room_id: str) -> int:
+        """Номер последнего события комнаты"""
+        if self._current is not None:
+            return await self._current(room_id)
+        return self._seq.get(room_id, 0)
+
+    async def current_seqs(self, room_ids: List[str]) -> Dict[str, int]:
+        """Номера последних событий сразу нескольких комнат"""
+        if self._current_many is not None:
+            return await self._current_many(room_ids)
+        if self._current is not None:
+            return {room_id: await self._current(room_id) for room_id in room_ids}
+        return {room_id: self._seq.get(room_id, 0) for room_id in room_ids}
+
+    def record(self, room_id: str, seq: int, event: str, data: Dict[str, Any]):
+        """Сохранить событие в буфер комнаты"""
+        ring = self._rings.get(room_id)
+        if ring is None:
+            ring = deque(maxlen=self.max_events)
+            self._rings[room_id] = ring
+            while len(self._rings) > self.max_rooms:
+                self._rings.popitem(last=False)
+        self._rings.move_to_end(room_id)
+        ring.append((seq, event, data))
+        if seq > self._seq.get(room_id, 0):
+            self._seq[room_id] = seq
+
+    def record_remote(self, message: Dict[str, Any]):
+        """Событие, отправленное другим процессом (сообщение менеджера Socket.IO)"""
+        data = message.get('data')
+        room_id = message.get('room')
+        if message.get('event') in SEQUENCED_EVENTS and isinstance(data, dict) \
+                and isinstance(room_id, str) and 'seq' in data:
+            self.record(room_id, data['seq'], message['event'], data)
+
+    async def replay(self, room_id: str, after_seq: int, epoch: str) -> Optional[List[RoomEvent]]:
+        """События после after_seq по порядку или None, если нужен resync"""
+        current = await self.current_seq(room_id)
+        if epoch != self.epoch or after_seq > current:
+            self.resyncs += 1
+            return None
+        if after_seq == current:
+            return []
+
+        ring = self._rings.get(room_id, ())
+        events = sorted((e for e in ring if e[0] > after_seq), key=lambda e: e[0])
+        # досылаем только непрерывную цепочку, иначе клиент пропустит событие
+        if [e[0] for e in events] != list(range(after_seq + 1, current + 1)):
+            self.resyncs += 1
+            return None
+        self.replayed += len(events)
+        return events
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики журнала"""
+        return {
+            "size": len(self._rings),
+            "maxsize": self.max_rooms,
+            "events": sum(len(ring) for ring in list(self._rings.values())),
+            "replayed": self.replayed,
+            "resyncs": self.resyncs
+        }
+
+
+# единственный журнал на процесс
+room_events = RoomEventLog(name="room_events")
+
+
+async def emit_room_event(sio, event: str, data: Dict[str, Any], room_id, skip_sid=None):
+    """
+    Отправить событие в комнату с номером seq и сохранить его в журнал
+
+    В data добавляются seq и epoch - по ним клиент запрашивает пропущенное (событие resume)
+    """
+    room_id = str(room_id)
+    seq = await room_events.next_seq(room_id)
+    payload = {**data, 'seq': seq, 'epoch': room_events.epoch}
+    room_events.record(room_id, seq, event, payload)
+    await sio.emit(event, payload, room=room_id, skip_sid=skip_sid)
@@ -1,17 +1,24 @@
 import socketio
-from typing import Dict
-from models.base import SessionLocal, ChatParticipant, User
+from models.base import AsyncSessionLocal, User
+from crud.base import AsyncRepository
 from crud.message import MessageRepository
-from crud.ban import BanRepository
+from crud.notification import NotificationRepository
+from utils.chat_access import resolve_chat_access, resolve_chat_access_many
+from utils.message_cache import message_cache, serialize_message
 from utils.websocket_manager import WebSocketManager
+from utils.room_events import room_events, emit_room_event
+from utils.message_ingest import message_ingest
+from utils.auth import verify_token
+from utils.presence import presence
+from utils.presence_registry import presence_registry
 
 
-# Хранилище для связи sid -> user_info
-user_sessions: Dict[str, Dict] = {}
-
-# Менеджер WebSocket соединений
+# Менеджер WebSocket соединений (сессии sid, комнаты, все подключения пользователя)
 ws_manager = None
 
+# сколько комнат можно войти одним join_rooms
+MAX_JOIN_ROOMS = 100
+
 
 def register_socketio_handlers(sio: socketio.AsyncServer):
     """Регистрация всех обработчиков Socket.IO событий"""
@@ -19,6 +26,41 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
     global ws_manager
     ws_manager = WebSocketManager(sio)
 
+    async def join_authorized_rooms(sid, session, room_ids):
+        """
+        Войти сразу в несколько комнат: права на все проверяются одним запросом
+
+        Комнаты, в которых сокет уже состоит, не проверяются повторно.
+        Возвращает (комнаты с seq и epoch для resume, отказы)
+        """
+        to_check = [room_id for room_id in room_ids if not ws_manager.in_room(sid, room_id)]
+        chat_ids = [int(room_id) for room_id in to_check if room_id.isdigit()]
+        accesses = {}
+        if chat_ids:
+            async with AsyncSessionLocal() as db:
+                accesses = await resolve_chat_access_many(db, int(session.user_id), chat_ids)
+
+        denied = []
+        for room_id in to_check:
+            access = accesses.get(int(room_id)) if room_id.isdigit() else None
+            if access is None or not access.is_member:
+                denied.append({'room_id': room_id, 'message': 'Access denied: not a participant'})
+                continue
+            if access.is_banned:
+                denied.append({'room_id': room_id, 'message': 'You are banned from this space'})
+                continue
+            if await ws_manager.join_room(sid, room_id):
+                await sio.emit('user_joined_room', {
+                    'user_id': session.user_id,
+                    'nickname': session.nickname,
+                    'room_id': room_id
+                }, room=room_id, skip_sid=sid)
+
+        joined = [room_id for room_id in room_ids if ws_manager.in_room(sid, room_id)]
+        seqs = await room_events.current_seqs(joined) if joined else {}
+        rooms = [{'room_id': room_id, 'seq': seqs[room_id], 'epoch': room_events.epoch} for room_id in joined]
+        return rooms, denied
+
     @sio.event
     async def connect(sid, environ, auth):
         """Подключение клиента к Socket.IO"""
@@ -34,23 +76,40 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
                 print(f"[Socket.IO] Connection rejected: no user_id")
                 return False
 
-            # Сохраняем информацию о сессии
-            user_sessions[sid] = {
-                'user_id': user_id,
-                'nickname': nickname,
-                'sid': sid
-            }
+            # JWT в auth подтверждает пользователя (без него - прежнее подключение по user_id)
+            token = auth.get('token') if isinstance(auth, dict) else None
+            authenticated = False
+            if token:
+                if verify_token(token) != int(user_id):
+                    print(f"[Socket.IO] Connection rejected: token does not match user {user_id}")
+                    return False
+                authenticated = True
+
+            # Сохраняем сессию; персональная комната user:{id} - все подключения пользователя
+            session = await ws_manager.connect(sid, user_id, nickname, authenticated)
+            # Комнаты пространств: статусы присутствия приходят только от соседей
+            await presence.join_socket(sio, sid, int(user_id))
+            presence_registry.connect(int(user_id), nickname)
 
             try:
                 print(f"[Socket.IO] User {nickname} (ID: {user_id}) connected with sid: {sid}")
             except UnicodeEncodeError:
                 print(f"[Socket.IO] User [Unicode name] (ID: {user_id}) connected with sid: {sid}")
 
+            # Переподключение в пределах SOCKET_RECONNECT_GRACE: возвращаем прежние комнаты сразу,
+            # чтобы события не терялись до повторного join от клиента
+            restored = []
+            if authenticated:
+                recent = ws_manager.take_recent_rooms(user_id)
+                if recent:
+                    restored, _ = await join_authorized_rooms(sid, session, sorted(recent)[:MAX_JOIN_ROOMS])
+
             # Отправляем подтверждение подключения
             await sio.emit('connected', {
                 'message': 'Successfully connected to Socket.IO server',
                 'user_id': user_id,
-                'nickname': nickname
+                'nickname': nickname,
+                'restored_rooms': [room['room_id'] for room in restored]
             }, room=sid)
 
             return True
@@ -64,24 +123,21 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
     async def disconnect(sid):
         """Отключение клиента"""
         try:
-            user_info = user_sessions.get(sid)
-            if user_info:
-                user_id = user_info['user_id']
-                nickname = user_info['nickname']
-
-                # Очищаем из всех комнат
-                if ws_manager:
-                    rooms = ws_manager.get_user_rooms(user_id)
-                    for room_id in rooms:
-                        ws_manager.remove_user_from_room(user_id, room_id)
-                        await sio.emit('user_left_room', {
-                            'user_id': user_id,
-                            'nickname': nickname,
-                            'room_id': room_id
-                        }, room=room_id, skip_sid=sid)
-
-                # Удаляем из сессий
-                del user_sessions[sid]
+            # Удаляем сессию и sid из всех комнат
+            session = ws_manager.disconnect(sid)
+            if session:
+                user_id = session.user_id
+                nickname = session.nickname
+
+                # О выходе сообщаем только там, где у пользователя не осталось других вкладок
+                for room_id in session.rooms:
+                    await sio.emit('user_left_room', {
+                        'user_id': user_id,
+                        'nickname': nickname,
+                        'room_id': room_id
+                    }, room=room_id, skip_sid=sid)
+                # последний сокет - offline после короткой паузы (перезагрузка страницы)
+                presence_registry.disconnect(int(user_id))
 
                 try:
                     print(f"[Socket.IO] User {nickname} (ID: {user_id}) disconnected")
@@ -103,60 +159,41 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
                 await sio.emit('error', {'message': 'room_id and user_id are required'}, room=sid)
                 return
 
-            # Проверка прав доступа через БД
-            db = SessionLocal()
-            try:
-                # Проверяем, является ли пользователь участником чата
-                participant = db.query(ChatParticipant).filter(
-                    ChatParticipant.chat_id == int(room_id),
-                    ChatParticipant.user_id == int(user_id),
-                    ChatParticipant.is_active == True
-                ).first()
-
-                if not participant:
-                    await sio.emit('error', {'message': 'Access denied: not a participant'}, room=sid)
-                    return
+            # Проверка прав доступа через БД: участие и бан - одним запросом
+            async with AsyncSessionLocal() as db:
+                access = await resolve_chat_access(db, int(user_id), int(room_id))
 
-                # Проверяем бан
-                ban_repo = BanRepository(db)
-                # Получаем space_id через чат
-                from models.base import Chat
-                chat = db.query(Chat).filter(Chat.id == int(room_id)).first()
-                if chat and chat.space_id:
-                    if ban_repo.is_active(int(user_id), chat.space_id):
-                        await sio.emit('error', {'message': 'You are banned from this space'}, room=sid)
-                        return
-
-            finally:
-                db.close()
-
-            # Добавляем в Socket.IO room
-            await sio.enter_room(sid, room_id)
-
-            # Добавляем в WebSocketManager
-            if ws_manager:
-                ws_manager.add_user_to_room(user_id, room_id, {
-                    'nickname': nickname,
-                    'sid': sid
-                })
+            if not access.is_member:
+                await sio.emit('error', {'message': 'Access denied: not a participant'}, room=sid)
+                return
+
+            if access.is_banned:
+                await sio.emit('error', {'message': 'You are banned from this space'}, room=sid)
+                return
+
+            # Добавляем в Socket.IO room и в WebSocketManager
+            first_connection = await ws_manager.join_room(sid, room_id)
 
             try:
                 print(f"[Socket.IO] User {nickname} joined room {room_id}")
             except UnicodeEncodeError:
                 print(f"[Socket.IO] User [Unicode name] joined room {room_id}")
 
-            # Уведомляем пользователя
+            # Уведомляем пользователя; seq и epoch - точка, с которой клиент запросит пропущенное (resume)
             await sio.emit('joined_room', {
                 'room_id': room_id,
-                'message': f'You joined room {room_id}'
+                'message': f'You joined room {room_id}',
+                'seq': await room_events.current_seq(room_id),
+                'epoch': room_events.epoch
             }, room=sid)
 
-            # Уведомляем остальных участников
-            await sio.emit('user_joined_room', {
-                'user_id': user_id,
-                'nickname': nickname,
-                'room_id': room_id
-            }, room=room_id, skip_sid=sid)
+            # Уведомляем остальных участников (вторая вкладка того же пользователя - не новость)
+            if first_connection:
+                await sio.emit('user_joined_room', {
+                    'user_id': user_id,
+                    'nickname': nickname,
+                    'room_id': room_id
+                }, room=room_id, skip_sid=sid)
 
         except Exception as e:
             try:
@@ -166,6 +203,33 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
             await sio.emit('error', {'message': f'Failed to join room: {str(e)}'}, room=sid)
 
 
+    @sio.event
+    async def join_rooms(sid, data):
+        """
+        Вход сразу в несколько комнат (после переподключения)
+
+        Права на все комнаты проверяются одним запросом, уже восстановленные комнаты не проверяются.
+        Ответ - rooms_joined: {rooms: [{room_id, seq, epoch}], denied: [{room_id, message}]}
+        """
+        try:
+            session = ws_manager.get_session(sid)
+            if not session:
+                await sio.emit('error', {'message': 'Unknown session'}, room=sid)
+                return
+
+            room_ids = list(dict.fromkeys(str(room_id) for room_id in (data.get('room_ids') or [])))
+            if len(room_ids) > MAX_JOIN_ROOMS:
+                await sio.emit('error', {'message': f'Too many rooms (max {MAX_JOIN_ROOMS})'}, room=sid)
+                return
+
+            rooms, denied = await join_authorized_rooms(sid, session, room_ids)
+            await sio.emit('rooms_joined', {'rooms': rooms, 'denied': denied}, room=sid)
+
+        except Exception as e:
+            print(f"[Socket.IO] Join rooms error: {e}")
+            await sio.emit('error', {'message': f'Failed to join rooms: {str(e)}'}, room=sid)
+
+
     @sio.event
     async def leave_room(sid, data):
         """Покинуть комнату"""
@@ -173,19 +237,15 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
             room_id = str(data.get('room_id'))
             user_id = str(data.get('user_id'))
 
-            user_info = user_sessions.get(sid, {})
-            nickname = user_info.get('nickname', 'Unknown')
+            session = ws_manager.get_session(sid)
+            nickname = session.nickname if session else 'Unknown'
 
             if not room_id or not user_id:
                 await sio.emit('error', {'message': 'room_id and user_id are required'}, room=sid)
                 return
 
-            # Удаляем из Socket.IO room
-            await sio.leave_room(sid, room_id)
-
-            # Удаляем из WebSocketManager
-            if ws_manager:
-                ws_manager.remove_user_from_room(user_id, room_id)
+            # Удаляем из Socket.IO room и из WebSocketManager
+            last_connection = await ws_manager.leave_room(sid, room_id)
 
             try:
                 print(f"[Socket.IO] User {nickname} left room {room_id}")
@@ -198,12 +258,13 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
                 'message': f'You left room {room_id}'
             }, room=sid)
 
-            # Уведомляем остальных участников
-            await sio.emit('user_left_room', {
-                'user_id': user_id,
-                'nickname': nickname,
-                'room_id': room_id
-            }, room=room_id)
+            # Уведомляем остальных участников, если у пользователя не осталось вкладок в комнате
+            if last_connection:
+                await sio.emit('user_left_room', {
+                    'user_id': user_id,
+                    'nickname': nickname,
+                    'room_id': room_id
+                }, room=room_id)
 
         except Exception as e:
             try:
@@ -226,90 +287,82 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
                 await sio.emit('error', {'message': 'room_id, user_id and message are required'}, room=sid)
                 return
 
-            # Сохраняем сообщение в БД
-            db = SessionLocal()
-            try:
-                message_repo = MessageRepository(db)
-                ban_repo = BanRepository(db)
-
+            # Проверки и запись в БД (асинхронная сессия - не блокирует event loop)
+            async with AsyncSessionLocal() as db:
                 # Получаем информацию о пользователе
-                user = db.query(User).filter(User.id == int(user_id)).first()
+                user = await db.get(User, int(user_id))
                 if not user:
                     await sio.emit('error', {'message': 'User not found'}, room=sid)
                     return
 
-                # Проверяем бан перед отправкой сообщения
-                from models.base import Chat
-                chat = db.query(Chat).filter(Chat.id == int(room_id)).first()
-                if chat and chat.space_id:
-                    if ban_repo.is_active(int(user_id), chat.space_id):
-                        await sio.emit('error', {'message': 'Вы забанены и не можете отправлять сообщения'}, room=sid)
-                        return
-
-                # Создаём сообщение
-                new_message = message_repo.create(
-                    chat_id=int(room_id),
-                    user_id=int(user_id),
-                    content=message_content,
-                    type='text'
-                )
-
-                # Обрабатываем @-упоминания
-                try:
-                    from crud.notification import MentionRepository
-                    mention_repo = MentionRepository(db)
-                    mention_repo.create_mentions(
-                        message_id=new_message.id,
+                # Проверяем участие и бан перед отправкой сообщения
+                access = await resolve_chat_access(db, int(user_id), int(room_id))
+                if not access.is_member:
+                    await sio.emit('error', {'message': 'Access denied: not a participant'}, room=sid)
+                    return
+                if access.is_banned:
+                    await sio.emit('error', {'message': 'Вы забанены и не можете отправлять сообщения'}, room=sid)
+                    return
+
+                if not message_ingest.enabled:
+                    # Создаём сообщение (отдельный коммит на каждое сообщение)
+                    message_repo = AsyncRepository(MessageRepository, db)
+                    new_message = await message_repo.create(
+                        chat_id=int(room_id),
+                        user_id=int(user_id),
                         content=message_content,
-                        author_id=int(user_id),
-                        chat_id=int(room_id)
+                        type='text'
                     )
-                except Exception as mention_error:
-                    print(f"[Socket.IO] Failed to create mentions: {mention_error}")
-                    # Продолжаем отправку сообщения даже если упоминания не создались
-
-                # Получаем attachment если есть
-                attachment_data = None
-                if new_message.attachment:
-                    attachment_data = {
-                        'id': new_message.attachment.id,
-                        'file_url': new_message.attachment.file_url,
-                        'file_type': new_message.attachment.file_type,
-                        'file_size': new_message.attachment.file_size
-                    }
-
-                # Формируем данные для отправки
-                message_data = {
-                    'id': new_message.id,
-                    'chat_id': new_message.chat_id,
-                    'room_id': room_id,
-                    'user_id': new_message.user_id,
-                    'content': new_message.content,
-                    'message': new_message.content,  # для совместимости
-                    'type': new_message.type,
-                    'created_at': new_message.created_at.isoformat(),
-                    'timestamp': new_message.created_at.isoformat(),
-                    'user_nickname': user.nickname,
-                    'nickname': user.nickname,  # для совместимости
-                    'user_avatar_url': user.avatar_url,  # добавляем аватар
-                    'attachment': attachment_data,  # добавляем вложение
-                    'reactions': [],  # пустой список реакций для нового сообщения
-                    'my_reaction': None  # нет реакций от текущего пользователя
-                }
+                    message_id, created_at = new_message.id, new_message.created_at
 
-                try:
-                    print(f"[Socket.IO] Message from {nickname} in room {room_id}: {message_content}")
-                except UnicodeEncodeError:
-                    print(f"[Socket.IO] Message from user in room {room_id} [contains Unicode]")
+            if message_ingest.enabled:
+                # Пакетная запись: сессия уже закрыта, ждём только id из общей пачки
+                row = await message_ingest.submit(int(room_id), int(user_id), message_content, 'text')
+                message_id, created_at = row["id"], row["created_at"]
 
-                # Подтверждаем отправителю
-                await sio.emit('message_sent', message_data, room=sid)
+            # @-упоминания и уведомления создаёт обработчик outbox (utils/outbox_worker.py)
 
-                # Broadcast всем в комнате
-                await sio.emit('new_message', message_data, room=room_id)
+            # Формируем данные для отправки (вложений у сообщений из сокета нет)
+            message_data = {
+                'id': message_id,
+                'chat_id': int(room_id),
+                'room_id': room_id,
+                'user_id': user.id,
+                'content': message_content,
+                'message': message_content,  # для совместимости
+                'type': 'text',
+                'created_at': created_at.isoformat(),
+                'timestamp': created_at.isoformat(),
+                'user_nickname': user.nickname,
+                'nickname': user.nickname,  # для совместимости
+                'user_avatar_url': user.avatar_url,  # добавляем аватар
+                'attachment': None,
+                'reactions': [],  # пустой список реакций для нового сообщения
+                'my_reaction': None  # нет реакций от текущего пользователя
+            }
 
-            finally:
-                db.close()
+            try:
+                print(f"[Socket.IO] Message from {nickname} in room {room_id}: {message_content}")
+            except UnicodeEncodeError:
+                print(f"[Socket.IO] Message from user in room {room_id} [contains Unicode]")
+
+            # Обновляем кеш последних сообщений чата
+            message_cache.add_message(int(room_id), serialize_message({
+                'id': message_id,
+                'chat_id': int(room_id),
+                'user_id': user.id,
+                'content': message_content,
+                'type': 'text',
+                'created_at': created_at,
+                'user': {'id': user.id, 'nickname': user.nickname, 'avatar_url': user.avatar_url},
+                'user_nickname': user.nickname
+            }))
+
+            # Подтверждаем отправителю
+            await sio.emit('message_sent', message_data, room=sid)
+
+            # Broadcast всем в комнате
+            await emit_room_event(sio, 'new_message', message_data, room_id)
 
         except Exception as e:
             try:
@@ -329,19 +382,13 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
                 await sio.emit('error', {'message': 'room_id is required'}, room=sid)
                 return
 
-            if ws_manager:
-                user_ids = ws_manager.get_room_users(room_id)
-                users_info = ws_manager.get_users_info(user_ids)
+            user_ids = ws_manager.get_room_users(room_id)
+            users_info = ws_manager.get_users_info(user_ids)
 
-                await sio.emit('room_users', {
-                    'room_id': room_id,
-                    'users': users_info
-                }, room=sid)
-            else:
-                await sio.emit('room_users', {
-                    'room_id': room_id,
-                    'users': {}
-                }, room=sid)
+            await sio.emit('room_users', {
+                'room_id': room_id,
+                'users': users_info
+            }, room=sid)
 
         except Exception as e:
             try:
@@ -377,12 +424,12 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
 
             # Broadcast обновление сообщения всем в комнате
             # ВРЕМЕННО БЕЗ skip_sid для отладки
-            await sio.emit('message_edited', {
+            await emit_room_event(sio, 'message_edited', {
                 'room_id': room_id,
                 'message_id': message_id,
                 'content': content,
                 'user_id': user_id
-            }, room=room_id)
+            }, room_id)
 
             print(f"[Socket.IO] Message {message_id} edited in room {room_id} - broadcast sent")
 
@@ -421,11 +468,11 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
 
             # Broadcast удаление сообщения всем в комнате
             # ВРЕМЕННО БЕЗ skip_sid для отладки
-            await sio.emit('message_deleted', {
+            await emit_room_event(sio, 'message_deleted', {
                 'room_id': room_id,
                 'message_id': message_id,
                 'user_id': user_id
-            }, room=room_id)
+            }, room_id)
 
             print(f"[Socket.IO] Message {message_id} deleted in room {room_id} - broadcast sent")
 
@@ -439,4 +486,98 @@ def register_socketio_handlers(sio: socketio.AsyncServer):
             await sio.emit('error', {'message': f'Failed to delete message: {str(e)}'}, room=sid)
 
 
+    @sio.event
+    async def resume(sid, data):
+        """
+        Досылка событий комнаты, пропущенных за время разрыва соединения
+
+        Клиент сначала заново входит в комнату (join_room), затем присылает
+        последний полученный seq и epoch. В ответ - resume_events с пропущенными событиями
+        по порядку или resync, если они уже вытеснены из журнала (нужно перечитать историю)
+        """
+        try:
+            room_id = str(data.get('room_id'))
+            after_seq = data.get('after_seq')
+            epoch = data.get('epoch')
+
+            if not data.get('room_id') or after_seq is None:
+                await sio.emit('error', {'message': 'room_id and after_seq are required'}, room=sid)
+                return
+
+            # досылаем только в комнату, в которую сокет уже вошёл (права проверены в join_room)
+            if not ws_manager.in_room(sid, room_id):
+                await sio.emit('error', {'message': 'Join the room before resume'}, room=sid)
+                return
+
+            events = await room_events.replay(room_id, int(after_seq), epoch)
+            if events is None:
+                await sio.emit('resync', {
+                    'room_id': room_id,
+                    'seq': await room_events.current_seq(room_id),
+                    'epoch': room_events.epoch
+                }, room=sid)
+                return
+
+            await sio.emit('resume_events', {
+                'room_id': room_id,
+                'events': [{'event': event, 'data': payload} for _, event, payload in events]
+            }, room=sid)
+
+        except Exception as e:
+            print(f"[Socket.IO] Resume error: {e}")
+            await sio.emit('error', {'message': f'Failed to resume: {str(e)}'}, room=sid)
+
+
+    @sio.event
+    async def heartbeat(sid, data):
+        """
+        Heartbeat по уже открытому сокету (вместо POST /status/heartbeat и GET /notifications/unread-count)
+
+        Клиент присылает последние seq комнат ({'epoch', 'rooms': {room_id: seq}}).
+        Ответ (ack): число непрочитанных уведомлений и пропущенные события комнат -
+        для комнаты либо events по порядку, либо resync, если их уже нет в журнале
+        """
+        from utils.activity_buffer import activity_buffer
+
+        session = ws_manager.get_session(sid)
+        if not session:
+            return {'error': 'Unknown session'}
+
+        try:
+            user_id = int(session.user_id)
+            ws_manager.update_user_activity(sid)
+            # статус - в памяти, last_seen - в write-behind буфер
+            presence_registry.touch(user_id)
+            activity_buffer.touch(user_id)
+
+            async with AsyncSessionLocal() as db:
+                unread_count = await AsyncRepository(NotificationRepository, db).get_unread_count(user_id)
+
+            data = data or {}
+            epoch = data.get('epoch')
+            rooms = []
+            for room_id, seq in (data.get('rooms') or {}).items():
+                room_id = str(room_id)
+                # только комнаты, в которые сокет вошёл (права проверены в join_room)
+                if not ws_manager.in_room(sid, room_id) or seq is None:
+                    continue
+                events = await room_events.replay(room_id, int(seq), epoch)
+                if events is None:
+                    rooms.append({
+                        'room_id': room_id,
+                        'resync': {'seq': await room_events.current_seq(room_id), 'epoch': room_events.epoch}
+                    })
+                elif events:
+                    rooms.append({
+                        'room_id': room_id,
+                        'events': [{'event': event, 'data': payload} for _, event, payload in events]
+                    })
+
+            return {'unread_count': unread_count, 'rooms': rooms}
+
+        except Exception as e:
+            print(f"[Socket.IO] Heartbeat error: {e}")
+            return {'error': str(e)}
+
+
     print("[Socket.IO] Handlers registered successfully")
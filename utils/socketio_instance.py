@@ -11,3 +11,11 @@ def set_sio(socketio_instance):
 def get_sio():
     """Получить глобальный инстанс Socket.IO"""
     return sio
+
+def user_room(user_id) -> str:
+    """Персональная комната пользователя (все его подключения)"""
+    return f"user:{user_id}"
+
+def space_room(space_id) -> str:
+    """Комната пространства: все подключения его участников (статусы присутствия)"""
+    return f"space:{space_id}"
@@ -1,53 +1,15 @@
-import os
-from typing import Optional
-from supabase import create_client, Client
+from typing import Dict, Optional
 from io import BytesIO
-from PIL import Image
 import hashlib
 from datetime import datetime
+from utils.storage_backends import avatar_storage, delete_by_url
+from utils.file_upload import run_upload, gather_uploads, UPLOAD_TIMEOUT_SECONDS
+from utils.image_pipeline import (
+    process_image, rendition_filename, ImageError, AVATAR_RENDITIONS, BANNER_RENDITIONS, FORMAT_CONTENT_TYPES
+)
 
-# Инициализация Supabase клиента
-SUPABASE_URL = os.getenv("SUPABASE_URL", "")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
-SUPABASE_BUCKET = os.getenv("SUPABASE_BUCKET", "avatars")
-
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-
-def optimize_image(image_bytes: bytes, max_size: tuple = (800, 800), quality: int = 85) -> bytes:
-    """
-    Оптимизирует изображение: уменьшает размер и качество
-
-    Args:
-        image_bytes: Байты изображения
-        max_size: Максимальный размер (ширина, высота)
-        quality: Качество сжатия (1-100)
-
-    Returns:
-        Оптимизированные байты изображения
-    """
-    img = Image.open(BytesIO(image_bytes))
-
-    # Конвертируем в RGB если нужно (для JPEG)
-    if img.mode in ('RGBA', 'LA', 'P'):
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        if img.mode == 'P':
-            img = img.convert('RGBA')
-        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-        img = background
-
-    # Изменяем размер если нужно
-    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-
-    # Сохраняем в буфер
-    output = BytesIO()
-    img.save(output, format='JPEG', quality=quality, optimize=True)
-    output.seek(0)
-
-    return output.read()
+# Аватары и баннеры сохраняются в хранилище AVATAR_STORAGE (по умолчанию Supabase Storage),
+# клиент хранилища создаётся при первой загрузке - без настроек модуль импортируется
 
 
 def generate_unique_filename(user_id: int, file_type: str) -> str:
@@ -59,11 +21,11 @@ def generate_unique_filename(user_id: int, file_type: str) -> str:
         file_type: Тип файла ('avatar' или 'banner')
 
     Returns:
-        Уникальное имя файла
+        Уникальное имя файла без расширения (к нему добавляется размер)
     """
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     hash_part = hashlib.md5(f"{user_id}{timestamp}".encode()).hexdigest()[:8]
-    return f"{user_id}/{file_type}_{timestamp}_{hash_part}.jpg"
+    return f"{user_id}/{file_type}_{timestamp}_{hash_part}"
 
 
 async def upload_image_to_storage(
@@ -71,49 +33,69 @@ async def upload_image_to_storage(
     file_bytes: bytes,
     file_type: str,  # 'avatar' or 'banner'
     content_type: str = "image/jpeg"
-) -> Optional[str]:
+) -> Optional[Dict[str, str]]:
     """
-    Загружает изображение в Supabase Storage
+    Загружает изображение в хранилище аватаров (AVATAR_STORAGE) в нескольких размерах
+
+    Размеры делаются в пуле процессов за одно декодирование (utils/image_pipeline.py):
+    аватар - 64, 128 и 400 px, баннер - 600 и 1200 px по ширине.
+    Каждый размер - в JPEG и, если они легче, в WebP / AVIF (IMAGE_FORMATS)
 
     Args:
         user_id: ID пользователя
         file_bytes: Байты файла
         file_type: Тип файла ('avatar' или 'banner')
-        content_type: MIME тип файла
+        content_type: MIME тип исходного файла
 
     Returns:
-        Публичный URL загруженного файла или None при ошибке
+        URL по размерам ({"64": url, "64.webp": url, ..., "400": url}) или None при ошибке
+
+    Raises:
+        ImageError: файл не читается как изображение или слишком большой (ошибка клиента, не хранилища)
     """
     try:
         print(f"🔄 Starting upload for user {user_id}, type: {file_type}")
 
-        # Оптимизируем изображение
+        # Делаем размеры изображения (вне event loop)
         if file_type == 'avatar':
-            optimized_bytes = optimize_image(file_bytes, max_size=(400, 400), quality=85)
+            image = await process_image(file_bytes, AVATAR_RENDITIONS, quality=85)
         else:  # banner
-            optimized_bytes = optimize_image(file_bytes, max_size=(1200, 400), quality=90)
+            image = await process_image(file_bytes, BANNER_RENDITIONS, quality=90)
 
-        print(f"📦 Image optimized: {len(optimized_bytes)} bytes")
+        renditions = image["renditions"]
+        print("📦 Image optimized: " + ", ".join(
+            f"{name}: {len(r['data'])} bytes" for name, r in renditions.items()
+        ))
 
         # Генерируем уникальное имя файла
         filename = generate_unique_filename(user_id, file_type)
         print(f"📝 Generated filename: {filename}")
 
-        # Загружаем файл в Supabase Storage
-        print(f"☁️  Uploading to bucket '{SUPABASE_BUCKET}'...")
-        response = supabase.storage.from_(SUPABASE_BUCKET).upload(
-            path=filename,
-            file=optimized_bytes,
-            file_options={"content-type": content_type, "upsert": "true"}
-        )
-        print(f"📤 Upload response: {response}")
-
-        # Получаем публичный URL
-        public_url = supabase.storage.from_(SUPABASE_BUCKET).get_public_url(filename)
-        print(f"🔗 Public URL generated: {public_url}")
-
-        return public_url
-
+        # Загружаем все размеры параллельно (вне event loop)
+        storage = avatar_storage()
+        print(f"☁️  Uploading to '{storage.name}' storage...")
+        folder, name = filename.split("/", 1)
+        names = list(renditions)
+        results = await gather_uploads(storage, [
+            run_upload(
+                storage.save,
+                BytesIO(renditions[size]["data"]),
+                folder,
+                rendition_filename(name, size, renditions[size]),
+                FORMAT_CONTENT_TYPES[renditions[size]["format"]],
+                resource_type="image",
+                timeout=UPLOAD_TIMEOUT_SECONDS
+            )
+            for size in names
+        ])
+
+        urls = {size: result["url"] for size, result in zip(names, results)}
+        print(f"🔗 Public URLs generated: {urls}")
+
+        return urls
+
+    except ImageError:
+        raise
     except Exception as e:
         print(f"❌ Error uploading image to storage: {e}")
         import traceback
@@ -123,7 +105,7 @@ async def upload_image_to_storage(
 
 async def delete_image_from_storage(file_url: str) -> bool:
     """
-    Удаляет изображение из Supabase Storage
+    Удаляет изображение из хранилища, которому принадлежит URL
 
     Args:
         file_url: URL файла для удаления
@@ -132,20 +114,17 @@ async def delete_image_from_storage(file_url: str) -> bool:
         True если успешно удалено, False при ошибке
     """
     try:
-        # Извлекаем путь файла из URL
-        # URL формат: https://project.supabase.co/storage/v1/object/public/bucket/path
-        if "/object/public/" in file_url:
-            path = file_url.split("/object/public/")[1]
-            bucket_and_path = path.split("/", 1)
-            if len(bucket_and_path) == 2:
-                file_path = bucket_and_path[1]
-
-                # Удаляем файл
-                supabase.storage.from_(SUPABASE_BUCKET).remove([file_path])
-                return True
-
-        return False
+        return await run_upload(delete_by_url, file_url)
 
     except Exception as e:
         print(f"Error deleting image from storage: {e}")
         return False
+
+
+async def delete_images_from_storage(file_url: Optional[str], variants: Optional[Dict[str, str]] = None):
+    """Удаляет изображение и все его размеры"""
+    urls = set((variants or {}).values())
+    if file_url:
+        urls.add(file_url)
+    for url in urls:
+        await delete_image_from_storage(url)
@@ -0,0 +1,296 @@
+import os
+import re
+import shutil
+import uuid
+from typing import BinaryIO, Dict, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+# хранилище вложений чата и хранилище аватаров/баннеров: cloudinary, supabase или local
+ATTACHMENT_STORAGE = os.getenv("ATTACHMENT_STORAGE", "cloudinary")
+AVATAR_STORAGE = os.getenv("AVATAR_STORAGE", "supabase")
+
+# local: каталог с файлами и URL, по которому их отдаёт routers/media.py
+MEDIA_ROOT = os.path.abspath(os.getenv("MEDIA_ROOT", "media"))
+MEDIA_URL = os.getenv("MEDIA_URL", "/media").rstrip("/")
+# таймаут одного обращения к хранилищу, секунды (задаётся самому клиенту хранилища)
+STORAGE_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_TIMEOUT", "60"))
+
+
+class StorageError(Exception):
+    """Хранилище не настроено или отказало"""
+
+
+# расширение сохранённого файла берётся из проверенного типа, а не из имени от клиента:
+# иначе документ "x.html" с типом text/plain отдавался бы обратно как HTML
+CONTENT_TYPE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+    "audio/mpeg": ".mp3",
+    "audio/wav": ".wav",
+    "audio/ogg": ".ogg",
+    "application/pdf": ".pdf",
+    "application/msword": ".doc",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "text/plain": ".txt",
+}
+# тип, с которым routers/media.py отдаёт файл с таким расширением
+EXTENSION_CONTENT_TYPES = {
+    ext: content_type for content_type, ext in CONTENT_TYPE_EXTENSIONS.items() if content_type != "image/jpg"
+}
+
+
+def unique_name(filename: str, content_type: str) -> str:
+    """
+    Имя файла со случайным суффиксом: файлы не перезаписываются и кешируются навсегда
+
+    Расширение - по content_type (.bin для неизвестного типа), от filename берётся только основа
+    """
+    name = os.path.splitext(os.path.basename(filename or "file"))[0]
+    name = "".join(c for c in name if c.isalnum() or c in "-_")[:40] or "file"
+    ext = CONTENT_TYPE_EXTENSIONS.get(content_type, ".bin")
+    return f"{name}_{uuid.uuid4().hex[:12]}{ext}"
+
+
+class StorageBackend:
+    """
+    Хранилище файлов
+
+    Методы синхронные (сетевые клиенты Cloudinary и Supabase синхронные) -
+    вызываются через run_upload из utils/file_upload.py, вне event loop.
+
+    save возвращает словарь: url, public_id и, если хранилище их знает,
+    width, height, format, duration
+    """
+
+    name = ""
+
+    def save(self, fileobj: BinaryIO, folder: str, filename: str, content_type: str,
+             resource_type: str = "image", timeout: float = None) -> Dict:
+        raise NotImplementedError
+
+    def delete_url(self, url: str) -> bool:
+        """Удалить файл по его URL; False - URL не из этого хранилища"""
+        raise NotImplementedError
+
+    def delete(self, public_id: str, url: str, resource_type: str = "image") -> bool:
+        """Удалить файл, сохранённый через save (по public_id и url из его ответа)"""
+        return self.delete_url(url)
+
+
+class CloudinaryStorage(StorageBackend):
+    name = "cloudinary"
+
+    def __init__(self):
+        self._configured = False
+
+    def _uploader(self):
+        import cloudinary
+        import cloudinary.uploader
+
+        if not self._configured:
+            if not os.getenv("CLOUDINARY_CLOUD_NAME"):
+                raise StorageError("CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY и CLOUDINARY_API_SECRET не заданы")
+            cloudinary.config(
+                cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+                api_key=os.getenv("CLOUDINARY_API_KEY"),
+                api_secret=os.getenv("CLOUDINARY_API_SECRET")
+            )
+            self._configured = True
+        return cloudinary.uploader
+
+    def save(self, fileobj, folder, filename, content_type, resource_type="image", timeout=None):
+        options = {"folder": folder, "resource_type": resource_type}
+        if timeout:
+            options["timeout"] = timeout
+        result = self._uploader().upload(fileobj, **options)
+        return {
+            "url": result["secure_url"],
+            "public_id": result["public_id"],
+            "width": result.get("width"),
+            "height": result.get("height"),
+            "format": result.get("format"),
+            "duration": result.get("duration")
+        }
+
+    @staticmethod
+    def parse_url(url: str) -> Optional[Tuple[str, str]]:
+        """
+        (public_id, resource_type) из URL доставки Cloudinary или None, если URL не из этого облака
+
+        URL формат: https://res.cloudinary.com/<cloud>/<resource_type>/upload/v<version>/<public_id>.<ext>;
+        у image и video расширение не входит в public_id, у raw - входит
+        """
+        parsed = urlparse(url or "")
+        parts = unquote(parsed.path).strip("/").split("/")
+        cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
+        if parsed.hostname != "res.cloudinary.com" or len(parts) < 4 or not cloud_name or parts[0] != cloud_name:
+            return None
+        resource_type, rest = parts[1], parts[3:]
+        # трансформации и версия идут до public_id; save сохраняет URL без трансформаций
+        for i, part in enumerate(rest[:-1]):
+            if re.fullmatch(r"v\d+", part):
+                rest = rest[i + 1:]
+                break
+        public_id = "/".join(rest)
+        if resource_type != "raw":
+            public_id = os.path.splitext(public_id)[0]
+        return (public_id, resource_type) if public_id else None
+
+    def delete_url(self, url):
+        # public_id восстанавливается из URL: при AVATAR_STORAGE=cloudinary размеры хранятся только URL
+        parsed = self.parse_url(url)
+        if parsed is None:
+            return False
+        public_id, resource_type = parsed
+        return self.delete(public_id, url, resource_type)
+
+    def delete(self, public_id, url, resource_type="image"):
+        self._uploader().destroy(public_id, resource_type=resource_type or "image", invalidate=True)
+        return True
+
+
+class SupabaseStorage(StorageBackend):
+    name = "supabase"
+
+    def __init__(self):
+        self.bucket = os.getenv("SUPABASE_BUCKET", "avatars")
+        self._client = None
+
+    def _storage(self):
+        if self._client is None:
+            url = os.getenv("SUPABASE_URL", "")
+            key = os.getenv("SUPABASE_KEY", "")
+            if not url or not key:
+                raise StorageError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+            from supabase import create_client, ClientOptions
+            # таймаут задаётся клиенту: параметр timeout в save клиент Supabase не принимает
+            self._client = create_client(url, key, options=ClientOptions(
+                storage_client_timeout=max(1, int(STORAGE_TIMEOUT_SECONDS))
+            ))
+        return self._client.storage.from_(self.bucket)
+
+    def save(self, fileobj, folder, filename, content_type, resource_type="image", timeout=None):
+        path = f"{folder}/{unique_name(filename, content_type)}"
+        storage = self._storage()
+        storage.upload(
+            path=path,
+            file=fileobj.read(),
+            file_options={"content-type": content_type, "upsert": "true"}
+        )
+        return {
+            "url": storage.get_public_url(path),
+            "public_id": path,
+            "format": os.path.splitext(path)[1].lstrip(".") or None
+        }
+
+    def delete_url(self, url):
+        # URL формат: https://project.supabase.co/storage/v1/object/public/bucket/path
+        if "/object/public/" not in url:
+            return False
+        bucket_and_path = url.split("/object/public/")[1].split("/", 1)
+        if len(bucket_and_path) != 2:
+            return False
+        self._storage().remove([bucket_and_path[1]])
+        return True
+
+
+class LocalStorage(StorageBackend):
+    """
+    Файлы на локальном диске (MEDIA_ROOT), отдаются приложением по MEDIA_URL
+
+    Имена файлов уникальны и не переиспользуются, поэтому ответы кешируются навсегда (immutable)
+    """
+
+    name = "local"
+
+    def __init__(self, root: str = MEDIA_ROOT, base_url: str = MEDIA_URL):
+        self.root = root
+        self.base_url = base_url
+
+    def path_for(self, relative: str) -> Optional[str]:
+        """Абсолютный путь файла или None, если путь выходит за MEDIA_ROOT"""
+        path = os.path.abspath(os.path.join(self.root, relative))
+        if os.path.commonpath([path, self.root]) != self.root:
+            return None
+        return path
+
+    def save(self, fileobj, folder, filename, content_type, resource_type="image", timeout=None):
+        relative = f"{folder}/{unique_name(filename, content_type)}"
+        path = self.path_for(relative)
+        if path is None:
+            raise StorageError(f"Недопустимый путь: {relative}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # пишем во временный файл и переименовываем - читатель не увидит недописанный файл
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "wb") as out:
+            shutil.copyfileobj(fileobj, out, 1024 * 1024)
+        os.replace(tmp_path, path)
+
+        result = {
+            "url": f"{self.base_url}/{relative}",
+            "public_id": relative,
+            "format": os.path.splitext(relative)[1].lstrip(".") or None
+        }
+        if resource_type == "image":
+            try:
+                from PIL import Image
+                with Image.open(path) as img:
+                    result["width"], result["height"] = img.size
+            except Exception:
+                pass
+        return result
+
+    def delete_url(self, url):
+        prefix = f"{self.base_url}/"
+        if not url.startswith(prefix):
+            return False
+        path = self.path_for(url[len(prefix):])
+        if path is None:
+            return False
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+
+_BACKENDS = {
+    "cloudinary": CloudinaryStorage,
+    "supabase": SupabaseStorage,
+    "local": LocalStorage,
+}
+_instances: Dict[str, StorageBackend] = {}
+
+
+def get_storage(name: str) -> StorageBackend:
+    """Экземпляр хранилища по имени (создаётся при первом обращении)"""
+    backend = _instances.get(name)
+    if backend is None:
+        if name not in _BACKENDS:
+            raise StorageError(f"Неизвестное хранилище: {name}")
+        backend = _BACKENDS[name]()
+        _instances[name] = backend
+    return backend
+
+
+def attachment_storage() -> StorageBackend:
+    """Хранилище вложений чата (ATTACHMENT_STORAGE)"""
+    return get_storage(ATTACHMENT_STORAGE)
+
+
+def avatar_storage() -> StorageBackend:
+    """Хранилище аватаров и баннеров (AVATAR_STORAGE)"""
+    return get_storage(AVATAR_STORAGE)
+
+
+def delete_by_url(url: str) -> bool:
+    """Удалить файл из того хранилища, которому принадлежит URL"""
+    for name in (AVATAR_STORAGE, ATTACHMENT_STORAGE):
+        if get_storage(name).delete_url(url):
+            return True
+    return False
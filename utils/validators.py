@@ -170,6 +170,9 @@ class Validators:
         
         # удаляем NULL байты
         text = text.replace('\x00', '')
+
+        # удаляем управляющие символы, которые поиск использует как маркеры подсветки
+        text = text.replace('\x02', '').replace('\x03', '')
         
         # обрезаем пробелы
         text = text.strip()
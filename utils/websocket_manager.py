@@ -1,58 +1,194 @@
+import os
 import socketio
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Set
 from datetime import datetime
+from utils.cache import TTLCache
+from utils.socketio_instance import user_room
 
+# сколько секунд после отключения комнаты пользователя восстанавливаются при переподключении
+RECONNECT_GRACE_SECONDS = float(os.getenv("SOCKET_RECONNECT_GRACE", "60"))
 
-class WebSocketManager:
-
-    def __init__(self, sio: socketio.AsyncServer):
-        self.sio = sio
-        self.rooms: Dict[str, List[str]] = {}
-        self.user_rooms: Dict[str, List[str]] = {}
-        self.user_data: Dict[str, Dict] = {}
-
-    def add_user_to_room(self, user_id: str, room_id: str, user_info: Dict = None):
-        if room_id not in self.rooms:
-            self.rooms[room_id] = []
 
-        if user_id not in self.rooms[room_id]:
-            self.rooms[room_id].append(user_id)
+class SocketSession:
+    """Одно подключение (вкладка, устройство) пользователя"""
 
-        if user_id not in self.user_rooms:
-            self.user_rooms[user_id] = []
+    __slots__ = ("sid", "user_id", "nickname", "authenticated", "rooms", "connected_at", "last_seen")
 
-        if room_id not in self.user_rooms[user_id]:
-            self.user_rooms[user_id].append(room_id)
+    def __init__(self, sid: str, user_id: str, nickname: str, authenticated: bool = False):
+        self.sid = sid
+        self.user_id = user_id
+        self.nickname = nickname
+        # пользователь подтверждён JWT при подключении
+        self.authenticated = authenticated
+        # комнаты чатов, в которые вошёл сокет
+        self.rooms: Set[str] = set()
+        self.connected_at = datetime.now()
+        self.last_seen = self.connected_at
 
-        if user_info:
-            self.user_data[user_id] = user_info
 
-    def remove_user_from_room(self, user_id: str, room_id: str):
-        if room_id in self.rooms and user_id in self.rooms[room_id]:
-            self.rooms[room_id].remove(user_id)
+class WebSocketManager:
+    """
+    Реестр подключений Socket.IO этого процесса
+
+    - у пользователя может быть несколько подключений (вкладки, устройства):
+      все его sid состоят в персональной комнате user:{id}, событие для пользователя -
+      один emit в эту комнату без перебора комнат чатов
+    - комнаты и подключения хранятся в множествах: проверка и удаление за O(1)
+    - пользователь считается участником комнаты чата, пока в ней есть хотя бы один его sid
+    - при отключении sid убирается из всех комнат; комнаты подтверждённого (JWT) пользователя
+      запоминаются на RECONNECT_GRACE_SECONDS и восстанавливаются при переподключении
+    """
 
-        if user_id in self.user_rooms and room_id in self.user_rooms[user_id]:
-            self.user_rooms[user_id].remove(room_id)
+    def __init__(self, sio: socketio.AsyncServer):
+        self.sio = sio
+        self.sessions: Dict[str, SocketSession] = {}
+        # user_id -> sid всех подключений пользователя
+        self.user_sids: Dict[str, Set[str]] = {}
+        # room_id -> sid в комнате
+        self.rooms: Dict[str, Set[str]] = {}
+        # user_id -> комнаты отключившихся подключений
+        self._recent_rooms = TTLCache(maxsize=10000, ttl=RECONNECT_GRACE_SECONDS, name="socket_restore")
+        # рассылка исключения из комнаты другим процессам: (user_id, room_id), см. main.py
+        self.on_kick: Optional[Callable[[str, str], None]] = None
+
+    async def connect(self, sid: str, user_id, nickname: str, authenticated: bool = False) -> SocketSession:
+        """Зарегистрировать подключение и ввести его в персональную комнату пользователя"""
+        user_id = str(user_id)
+        session = SocketSession(sid, user_id, nickname, authenticated)
+        self.sessions[sid] = session
+        self.user_sids.setdefault(user_id, set()).add(sid)
+        await self.sio.enter_room(sid, user_room(user_id))
+        return session
+
+    def disconnect(self, sid: str) -> Optional[SocketSession]:
+        """
+        Убрать подключение из реестра
+
+        В session.rooms остаются комнаты, из которых пользователь ушёл полностью
+        (других его подключений там нет) - в них нужно сообщить о выходе
+        """
+        session = self.sessions.pop(sid, None)
+        if session is None:
+            return None
+
+        sids = self.user_sids.get(session.user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self.user_sids[session.user_id]
+
+        if session.authenticated and session.rooms:
+            recent = self._recent_rooms.get(session.user_id) or frozenset()
+            self._recent_rooms.set(session.user_id, recent | session.rooms)
+
+        left = set()
+        for room_id in session.rooms:
+            if self._remove_sid(room_id, sid, session.user_id):
+                left.add(room_id)
+        session.rooms = left
+        return session
+
+    def take_recent_rooms(self, user_id) -> Set[str]:
+        """Комнаты, в которых пользователь был до отключения (если оно было недавно)"""
+        return set(self._recent_rooms.pop(str(user_id)) or ())
+
+    def get_session(self, sid: str) -> Optional[SocketSession]:
+        return self.sessions.get(sid)
+
+    def get_user_sids(self, user_id) -> Set[str]:
+        """Подключения пользователя в этом процессе"""
+        return self.user_sids.get(str(user_id), set())
+
+    def is_connected(self, user_id) -> bool:
+        return str(user_id) in self.user_sids
+
+    def in_room(self, sid: str, room_id: str) -> bool:
+        """Сокет вошёл в комнату чата"""
+        session = self.sessions.get(sid)
+        return session is not None and room_id in session.rooms
+
+    def _user_in_room(self, user_id: str, room_id: str) -> bool:
+        sids = self.rooms.get(room_id)
+        if not sids:
+            return False
+        return any(sid in sids for sid in self.user_sids.get(user_id, ()))
+
+    def _remove_sid(self, room_id: str, sid: str, user_id: str) -> bool:
+        """Убрать sid из комнаты; True - у пользователя в комнате больше нет подключений"""
+        sids = self.rooms.get(room_id)
+        if sids is None:
+            return False
+        sids.discard(sid)
+        if not sids:
+            del self.rooms[room_id]
+        return not self._user_in_room(user_id, room_id)
+
+    async def join_room(self, sid: str, room_id: str) -> bool:
+        """Ввести сокет в комнату чата; True - первое подключение пользователя в этой комнате"""
+        session = self.sessions.get(sid)
+        if session is None:
+            return False
+        await self.sio.enter_room(sid, room_id)
+        first = not self._user_in_room(session.user_id, room_id)
+        self.rooms.setdefault(room_id, set()).add(sid)
+        session.rooms.add(room_id)
+        return first
+
+    async def leave_room(self, sid: str, room_id: str) -> bool:
+        """Вывести сокет из комнаты чата; True - у пользователя в ней больше нет подключений"""
+        await self.sio.leave_room(sid, room_id)
+        session = self.sessions.get(sid)
+        if session is None or room_id not in session.rooms:
+            return False
+        session.rooms.discard(room_id)
+        return self._remove_sid(room_id, sid, session.user_id)
+
+    async def remove_user_from_room(self, user_id, room_id: str):
+        """Вывести из комнаты все подключения пользователя в этом процессе"""
+        for sid in list(self.get_user_sids(user_id)):
+            await self.leave_room(sid, room_id)
+
+    async def kick_from_room(self, user_id, room_id: str):
+        """
+        Вывести пользователя из комнаты во всех процессах (исключение из пространства)
+
+        Подключения в других процессах выводят сами процессы по сообщению on_kick
+        """
+        await self.remove_user_from_room(user_id, room_id)
+        if self.on_kick is not None:
+            self.on_kick(str(user_id), room_id)
 
     def get_room_users(self, room_id: str) -> List[str]:
-        return self.rooms.get(room_id, [])
-
-    def get_user_rooms(self, user_id: str) -> List[str]:
-        return self.user_rooms.get(user_id, [])
-
-    def cleanup_user(self, user_id: str):
-        if user_id in self.user_rooms:
-            for room_id in self.user_rooms[user_id]:
-                if room_id in self.rooms and user_id in self.rooms[room_id]:
-                    self.rooms[room_id].remove(user_id)
-            del self.user_rooms[user_id]
-
-        if user_id in self.user_data:
-            del self.user_data[user_id]
-
-    def update_user_activity(self, user_id: str):
-        if user_id in self.user_data:
-            self.user_data[user_id]['last_seen'] = datetime.now().isoformat()
+        """Пользователи с хотя бы одним подключением в комнате"""
+        users = {self.sessions[sid].user_id for sid in self.rooms.get(room_id, ()) if sid in self.sessions}
+        return list(users)
+
+    def get_user_rooms(self, user_id) -> Set[str]:
+        """Комнаты чатов, в которых есть подключения пользователя"""
+        rooms = set()
+        for sid in self.get_user_sids(user_id):
+            rooms |= self.sessions[sid].rooms
+        return rooms
+
+    def update_user_activity(self, sid: str):
+        session = self.sessions.get(sid)
+        if session is not None:
+            session.last_seen = datetime.now()
 
     def get_users_info(self, user_ids: List[str]) -> Dict[str, Dict]:
-        return {user_id: self.user_data.get(user_id, {}) for user_id in user_ids}
+        result = {}
+        for user_id in user_ids:
+            sessions = [self.sessions[sid] for sid in self.get_user_sids(user_id)]
+            if not sessions:
+                result[user_id] = {}
+                continue
+            result[user_id] = {
+                'nickname': sessions[0].nickname,
+                'sids': [session.sid for session in sessions],
+                'last_seen': max(session.last_seen for session in sessions).isoformat()
+            }
+        return result
+
+    async def emit_to_user(self, event: str, data, user_id, skip_sid: str = None):
+        """Событие всем подключениям пользователя (во всех процессах)"""
+        await self.sio.emit(event, data, room=user_room(user_id), skip_sid=skip_sid)